@@ -0,0 +1,50 @@
+# adatabase.py
+# Асинхронный фасад над database: те же функции, но каждая выполняется в ограниченном пуле потоков,
+# чтобы блокирующий sqlite не останавливал цикл событий.
+#   row = await adatabase.get_latest_market("Дерево")
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import database
+
+DB_THREADS = 8
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def configure(threads: int = DB_THREADS) -> None:
+    """Задаёт размер пула. Вызывать до первого обращения к БД."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="db")
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def run(fn: Callable, *args, **kwargs):
+    """Выполняет любую блокирующую функцию в пуле БД."""
+    if _executor is None:
+        configure()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def __getattr__(name: str):
+    fn = getattr(database, name, None)
+    if name.startswith("_") or not callable(fn) or getattr(fn, "__module__", None) != database.__name__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+
+    globals()[name] = wrapper
+    return wrapper
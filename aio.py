@@ -0,0 +1,264 @@
+# aio.py
+# Асинхронный режим: AsyncTeleBot, фоновые задачи как asyncio-задачи, БД через adatabase.
+# Логика обработчиков общая с синхронным режимом (handlers.py): синхронная часть (БД, расчёты)
+# выполняется в отдельном пуле обработчиков, а вызовы Telegram API ставятся корутинами в цикл
+# событий и не держат поток, пока идёт запрос. Пул adatabase остаётся за фоновыми задачами.
+import asyncio
+import logging
+import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from telebot.async_telebot import AsyncTeleBot
+
+import adatabase
+import alerts
+import config
+import dispatcher
+import handlers
+import ingest
+import leader
+import metrics
+import prices
+import supervisor
+
+logger = logging.getLogger(__name__)
+
+
+class SyncBotAdapter:
+    """
+    Синхронный фасад над AsyncTeleBot для кода, выполняемого в потоках (обработчики, диспетчер).
+    Корутинные методы бота запускаются в цикле событий, вызывающий поток ждёт результата.
+    Нельзя вызывать из потока самого цикла событий.
+    """
+
+    def __init__(self, bot: AsyncTeleBot, loop: asyncio.AbstractEventLoop):
+        self._bot = bot
+        self._loop = loop
+        self._next_steps: Dict[int, Callable] = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._bot, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(attr(*args, **kwargs), self._loop).result()
+        return call
+
+    def deferred(self) -> "DeferredBot":
+        return DeferredBot(self)
+
+    # AsyncTeleBot не поддерживает next step handlers — храним их сами, по chat id
+    def register_next_step_handler(self, message, callback: Callable) -> None:
+        with self._lock:
+            self._next_steps[message.chat.id] = callback
+
+    def has_next_step(self, message) -> bool:
+        with self._lock:
+            return message.chat.id in self._next_steps
+
+    def pop_next_step(self, message):
+        with self._lock:
+            return self._next_steps.pop(message.chat.id, None)
+
+
+class _Pending:
+    """Результат отложенного вызова Telegram API; поток ждёт ответа, только если обращается к нему."""
+
+    __slots__ = ("_future", "observed")
+
+    def __init__(self, future: Future):
+        self._future = future
+        self.observed = False
+
+    def result(self, timeout: Optional[float] = None):
+        self.observed = True
+        return self._future.result(timeout)
+
+    def __getattr__(self, name: str):
+        return getattr(self.result(), name)
+
+    def __bool__(self) -> bool:
+        return self.result() is not None
+
+
+class DeferredBot:
+    """
+    Фасад бота для одного апдейта или запуска задачи. Корутинные методы бота не блокируют поток:
+    вызов ставится в цикл событий и сразу возвращает _Pending. Вызовы одного фасада выполняются
+    строго по очереди, так что ответы приходят в порядке отправки. Ошибку вызова, результат которого
+    никто не запросил, пишем в лог.
+    """
+
+    def __init__(self, adapter: SyncBotAdapter):
+        self.base_bot = adapter          # диспетчер и прочие общие объекты — по исходному адаптеру
+        self._adapter = adapter
+        self._last: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._adapter._bot, name, None)
+        if not asyncio.iscoroutinefunction(attr):
+            return getattr(self._adapter, name)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                future = asyncio.run_coroutine_threadsafe(
+                    _after(self._last, lambda: attr(*args, **kwargs)), self._adapter._loop)
+                self._last = future
+            pending = _Pending(future)
+            future.add_done_callback(lambda f: _log_unobserved(name, pending, f))
+            return pending
+        return call
+
+    async def drain(self) -> None:
+        """Ждёт в цикле событий завершения всех поставленных вызовов."""
+        with self._lock:
+            last = self._last
+        if last is not None:
+            await _settled(last)
+
+
+async def _settled(future: Future) -> None:
+    try:
+        await asyncio.wrap_future(future)
+    except Exception:
+        pass  # ошибку вернёт _Pending.result() или запишет _log_unobserved
+
+
+async def _after(previous: Optional[Future], call: Callable):
+    if previous is not None:
+        await _settled(previous)
+    return await call()
+
+
+def _log_unobserved(name: str, pending: _Pending, future: Future) -> None:
+    if not pending.observed and not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Вызов Telegram API {name} завершился ошибкой: {future.exception()}")
+
+
+def register(bot: AsyncTeleBot, adapter: SyncBotAdapter, executor: ThreadPoolExecutor) -> None:
+    async def run_handler(fn, update):
+        loop = asyncio.get_running_loop()
+        deferred = adapter.deferred()
+        try:
+            await loop.run_in_executor(executor, fn, deferred, update)
+        finally:
+            await deferred.drain()
+
+    async def next_step(message):
+        callback = adapter.pop_next_step(message)
+        if callback:
+            await run_handler(lambda _bot, update: callback(update), message)
+
+    # Должен стоять первым, чтобы ответ на «Отправьте число минут» не ушёл в другие обработчики
+    bot.register_message_handler(next_step, func=adapter.has_next_step, content_types=["text"])
+
+    def make_callback(fn):
+        async def callback(update):
+            await run_handler(fn, update)
+        callback.__name__ = fn.__name__
+        return callback
+
+    handlers.register_handlers(bot, make_callback)
+
+
+async def _periodic(job: supervisor.Job, adapter: SyncBotAdapter, elector=None,
+                    wake: Optional[asyncio.Event] = None) -> None:
+    """Запускает задачу по расписанию; установленный wake — внеочередной запуск без сдвига расписания."""
+    loop = asyncio.get_running_loop()
+    wake = wake or asyncio.Event()
+    next_run = loop.time() + job.next_delay()
+    while True:
+        try:
+            await asyncio.wait_for(wake.wait(), max(0.0, next_run - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        triggered = wake.is_set()
+        wake.clear()
+        if not triggered:
+            next_run = loop.time() + job.next_delay()
+        if elector is not None and not elector.is_leader():
+            continue
+        started = loop.time()
+        failed = False
+        deferred = adapter.deferred()
+        try:
+            # Задача получает свой фасад бота: отправки уходят в цикл событий, а не держат поток БД
+            await adatabase.run(alerts.background_jobs(deferred)[job.name])
+        except Exception:
+            failed = True
+            logger.exception(f"Ошибка в фоновой задаче {job.name}")
+        await deferred.drain()
+        finished = loop.time()
+        if not triggered:
+            next_run = finished + job.next_delay()
+        if job.record(started, finished, failed):
+            logger.warning(f"Задача {job.name} выполнялась {finished - started:.1f} с — дольше интервала {job.interval:g} с")
+
+
+def _trigger(loop: asyncio.AbstractEventLoop, wakes: Dict[str, asyncio.Event], name: str) -> None:
+    """Аналог Supervisor.trigger для asyncio-задач; вызывается из любого потока."""
+    loop.call_soon_threadsafe(wakes[name].set)
+
+
+async def serve(cfg: config.Config) -> None:
+    loop = asyncio.get_running_loop()
+    adatabase.configure(cfg.db_threads)
+    bot = AsyncTeleBot(cfg.token)
+    adapter = SyncBotAdapter(bot, loop)
+    executor = ThreadPoolExecutor(max_workers=cfg.handler_workers, thread_name_prefix="handler")
+    register(bot, adapter, executor)
+
+    elector = None
+    if cfg.leader_election:
+        elector = leader.LeaderElector(cfg.instance_id or None, ttl=cfg.leader_ttl, heartbeat=cfg.leader_heartbeat)
+        alerts.follow_leader(elector, adapter)
+        elector.start()
+    jobs = [
+        supervisor.Job(name, fn, cfg.job_intervals[name], cfg.job_jitter)
+        for name, fn in alerts.background_jobs(adapter).items()
+    ]
+    wakes = {job.name: asyncio.Event() for job in jobs}
+    tasks = [asyncio.create_task(_periodic(job, adapter, elector, wakes[job.name]), name=job.name) for job in jobs]
+    await asyncio.to_thread(prices.start, cfg.price_snapshot_interval, cfg.inline_cache_time)
+    # Форварды здесь коммитятся в потоке обработчика, без отдельного конвейера; после коммита —
+    # свежий снимок цен и внеочередная проверка алертов (у лидера), как в синхронном режиме
+    ingest.on_commit(prices.market_changed)
+    ingest.on_commit(lambda: _trigger(loop, wakes, "check_profit_alerts"))
+    ingest.on_commit(lambda: _trigger(loop, wakes, "update_dynamic_timers"))
+    if cfg.metrics_port:
+        alerts.register_gauges(adapter)
+        metrics.start_http_server(cfg.metrics_port, cfg.metrics_host)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    logger.info("Бот запущен (asyncio).")
+    polling = asyncio.create_task(bot.infinity_polling(timeout=10))
+    stopper = asyncio.create_task(stop.wait())
+    await asyncio.wait({polling, stopper}, return_when=asyncio.FIRST_COMPLETED)
+
+    logger.info("Остановка...")
+    for task in tasks + [polling, stopper]:
+        task.cancel()
+    await asyncio.gather(*tasks, polling, stopper, return_exceptions=True)
+    # Сначала дорабатывают обработчики, потом диспетчер досылает очередь. Его отправки ждут
+    # цикл событий, поэтому останавливаем его из потока
+    await asyncio.to_thread(executor.shutdown)
+    await asyncio.to_thread(dispatcher.for_bot(adapter).stop)
+    if elector is not None:
+        await asyncio.to_thread(elector.stop)
+    await bot.close_session()
+    adatabase.shutdown()
+
+
+def run(cfg: config.Config) -> None:
+    asyncio.run(serve(cfg))
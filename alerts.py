@@ -3,15 +3,31 @@ import threading
 import time
 import logging
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 from telebot import types
+import chats
+import config
 import database
+import dispatcher
+import metrics
+import scheduler
+import supervisor
 import users
 import market
 
 
 logger = logging.getLogger(__name__)
 
+# Таймеры в памяти общего планировщика: id алерта -> время срабатывания.
+# При нескольких процессах таймеры держит только лидер (см. leader.py),
+# алерты, созданные в других процессах, он подхватывает задачей sync_new_timers (новые id раз в
+# пару секунд) и sync_timers (все алерты, подошедшие к горизонту).
+TIMER_HORIZON = 300     # секунд вперёд, на которые sync_timers планирует алерты
+_timers: Dict[int, float] = {}
+_timers_lock = threading.Lock()
+_last_alert_id: Optional[int] = None   # последний алерт, уже просмотренный sync_timers/sync_new_timers
+_is_leader: Callable[[], bool] = lambda: True
+
 
 def calculate_speed(records: List[dict], price_field: str = "buy") -> Optional[float]:
     if not records or len(records) < 2:
@@ -39,24 +55,72 @@ def get_trend(records: List[dict], price_field: str = "buy") -> str:
         return "stable"
 
 
-def schedule_alert(alert_id: int, bot):
+def schedule_alert(alert_id: int, bot, alert_time: datetime):
+    if not _is_leader():
+        return
+    ts = alert_time.timestamp()
+    with _timers_lock:
+        if alert_id in _timers:
+            return
+        _timers[alert_id] = ts
+    scheduler.shared().call_at(ts, check_alert, alert_id, bot)
+
+
+def sync_timers(bot):
+    """Ставит в планировщик активные алерты, срабатывающие в ближайшие TIMER_HORIZON секунд и ещё не запланированные."""
+    global _last_alert_id
+    # Курсор sync_new_timers — до выборки: алерт, созданный между ними, просмотрят оба, но не пропустит никто
+    last_id = database.get_max_alert_id()
+    horizon = (datetime.now() + timedelta(seconds=TIMER_HORIZON)).isoformat()
+    for alert in database.get_alerts_due_before(horizon):
+        schedule_alert(alert['id'], bot, datetime.fromisoformat(alert['alert_time']))
+    with _timers_lock:
+        if _last_alert_id is None or last_id > _last_alert_id:
+            _last_alert_id = last_id
+
+
+def sync_new_timers(bot):
+    """
+    Подхватывает алерты, созданные после прошлого просмотра (в том числе /timer в другом процессе):
+    запрос по первичному ключу, поэтому задача выполняется раз в пару секунд и таймер с коротким ETA
+    у лидера ставится с задержкой не больше её интервала.
+    """
+    global _last_alert_id
+    if not _is_leader():
+        return
+    if _last_alert_id is None:
+        sync_timers(bot)
+        return
+    horizon = (datetime.now() + timedelta(seconds=TIMER_HORIZON)).isoformat()
+    alerts = database.get_alerts_created_after(_last_alert_id)
+    for alert in alerts:
+        if alert['status'] == 'active' and alert['alert_time'] < horizon:
+            schedule_alert(alert['id'], bot, datetime.fromisoformat(alert['alert_time']))
+    if alerts:
+        with _timers_lock:
+            _last_alert_id = max(_last_alert_id or 0, alerts[-1]['id'])
+
+
+def _forget_timers():
+    global _last_alert_id
+    with _timers_lock:
+        _timers.clear()
+        _last_alert_id = None
+
+
+def check_alert(alert_id: int, bot):
+    with _timers_lock:
+        _timers.pop(alert_id, None)
+    if not _is_leader():
+        return
     try:
         alert = database.get_alert_by_id(alert_id)
-        if not alert:
+        if not alert or alert['status'] != 'active':
             return
 
-        alert_time = datetime.fromisoformat(alert['alert_time'])
-        now = datetime.now()
-        sleep_s = (alert_time - now).total_seconds()
-        if sleep_s > 0:
-            time.sleep(sleep_s)
-
         current = database.get_latest_market(alert['resource'])
         if not current:
-            try:
-                bot.send_message(alert['user_id'], f"⚠️ Невозможно проверить цель: нет данных по {alert['resource']}.")
-            except Exception:
-                pass
+            dispatcher.for_bot(bot).notify(alert['user_id'], f"⚠️ Невозможно проверить цель: нет данных по {alert['resource']}.")
             database.update_alert_status(alert_id, 'error')
             return
 
@@ -69,25 +133,16 @@ def schedule_alert(alert_id: int, bot):
             reached = True
 
         if reached:
-            try:
-                bot.send_message(alert['user_id'], f"🔔 Ваш таймер сработал! {alert['resource']} достигла {alert['target_price']:.2f}. Текущая: {current_price_adj:.2f}")
-            except Exception:
-                pass
+            dispatcher.for_bot(bot).notify(alert['user_id'], f"🔔 Ваш таймер сработал! {alert['resource']} достигла {alert['target_price']:.2f}. Текущая: {current_price_adj:.2f}")
             database.update_alert_status(alert_id, 'completed')
-            try:
-                if alert.get('chat_id'):
-                    bot.send_message(alert['chat_id'], f"🔔 Таймер @{alert['user_id']} сработал: {alert['resource']} достигла {alert['target_price']:.2f} (текущая: {current_price_adj:.2f}).")
-            except Exception:
-                pass
+            if alert.get('chat_id'):
+                dispatcher.for_bot(bot).notify(alert['chat_id'], f"🔔 Таймер @{alert['user_id']} сработал: {alert['resource']} достигла {alert['target_price']:.2f} (текущая: {current_price_adj:.2f}).")
         else:
-            try:
-                bot.send_message(alert['user_id'], f"⏰ Таймер сработал, но цель ({alert['target_price']:.2f}) не достигнута. Текущая: {current_price_adj:.2f}")
-            except Exception:
-                pass
+            dispatcher.for_bot(bot).notify(alert['user_id'], f"⏰ Таймер сработал, но цель ({alert['target_price']:.2f}) не достигнута. Текущая: {current_price_adj:.2f}")
             database.update_alert_status(alert_id, 'expired')
 
     except Exception as e:
-        logger.exception("Ошибка в schedule_alert")
+        logger.exception("Ошибка в check_alert")
         try:
             database.update_alert_status(alert_id, 'error')
         except Exception:
@@ -95,178 +150,157 @@ def schedule_alert(alert_id: int, bot):
 
 
 def update_dynamic_timers_once(bot):
-    try:
-        active_alerts = database.get_active_alerts()
-        now = datetime.now()
-        for alert in active_alerts:
-            try:
-                records = database.get_recent_market(alert['resource'], minutes=15)
-                if not records or len(records) < 2:
-                    continue
-
-                latest = database.get_latest_market(alert['resource'])
-                if not latest:
-                    continue
-
-                created_ts = datetime.fromisoformat(alert['created_at']).timestamp() if alert.get('created_at') else 0
-                if latest['timestamp'] <= created_ts:
-                    continue
-
-                bonus = users.get_user_bonus(alert['user_id'])
-                current_adj_price, _ = users.adjust_prices_for_user(alert['user_id'], latest['buy'], latest['sell'])
-                speed_raw = calculate_speed(records, "buy")
-                if speed_raw is None:
-                    continue
-
-                adj_speed = speed_raw / (1 + bonus) if isinstance(bonus, float) else speed_raw
-                if adj_speed is None or adj_speed == 0:
-                    continue
-
-                current_trend = get_trend(records, "buy")
-                if (alert['direction'] == "down" and current_trend == "up") or (alert['direction'] == "up" and current_trend == "down"):
-                    try:
-                        bot.send_message(alert['user_id'], f"⚠️ Тренд для {alert['resource']} изменился (теперь {current_trend}). Оповещение будет деактивировано.")
-                    except Exception:
-                        pass
-                    database.update_alert_status(alert['id'], 'trend_changed')
-                    continue
-
-                if (alert['direction'] == "down" and current_adj_price <= alert['target_price']) or (alert['direction'] == "up" and current_adj_price >= alert['target_price']):
-                    try:
-                        bot.send_message(alert['user_id'], f"🔔 {alert['resource']} достигла цели {alert['target_price']:.2f} (текущая: {current_adj_price:.2f}).")
-                    except Exception:
-                        pass
-                    database.update_alert_status(alert['id'], 'completed')
-                    continue
-
-                price_diff = alert['target_price'] - current_adj_price
-                if (alert['direction'] == "down" and adj_speed >= 0) or (alert['direction'] == "up" and adj_speed <= 0):
-                    continue
-
-                time_minutes = abs(price_diff) / abs(adj_speed)
-                new_alert_time = datetime.now() + timedelta(minutes=time_minutes)
-
-                database.update_alert_fields(alert['id'], {
-                    'alert_time': new_alert_time.isoformat(),
-                    'speed': adj_speed,
-                    'current_price': current_adj_price
-                })
-
-                try:
-                    old = datetime.fromisoformat(alert['alert_time']) if alert.get('alert_time') else None
-                    if old:
-                        diff_min = abs((new_alert_time - old).total_seconds() / 60.0)
-                        if diff_min > 5:
-                            bot.send_message(alert['user_id'], f"🔄 Таймер для {alert['resource']} обновлён. Новое время: {new_alert_time.strftime('%H:%M:%S')}")
-                except Exception:
-                    pass
-
-            except Exception as e:
-                logger.exception(f"Ошибка при обновлении алерта {alert.get('id')}: {e}")
-    except Exception as e:
-        logger.exception("Ошибка в update_dynamic_timers_once")
+    active_alerts = database.get_active_alerts()
+    if not active_alerts:
+        return
 
+    # Окно, последний тик и скорость считаются один раз на ресурс
+    windows = database.get_recent_market_all(minutes=15)
+    per_resource = {}
+    for resource, records in windows.items():
+        if len(records) < 2:
+            continue
+        speed_raw = calculate_speed(records, "buy")
+        if speed_raw is None:
+            continue
+        per_resource[resource] = (records[-1], speed_raw, get_trend(records, "buy"))
+
+    bonuses = users.get_users_bonus([a['user_id'] for a in active_alerts if a['resource'] in per_resource])
 
-def cleanup_expired_alerts_loop():
-    while True:
+    now = datetime.now()
+    statuses = []
+    reschedules = []
+    messages = []
+    for alert in active_alerts:
         try:
-            now = datetime.now()
-            active = database.get_active_alerts()
-            expired_ids = []
-            for a in active:
-                try:
-                    if not a.get('alert_time'):
-                        continue
-                    at = datetime.fromisoformat(a['alert_time'])
-                    if at < (now - timedelta(hours=1)):
-                        expired_ids.append(a['id'])
-                except Exception:
-                    continue
-            for aid in expired_ids:
-                database.update_alert_status(aid, 'cleanup_expired')
-                logger.info(f"Очистка: деактивирован алерт {aid} (просрочен)")
-        except Exception as e:
-            logger.exception("Ошибка в cleanup_expired_alerts_loop")
-        time.sleep(600)
+            state = per_resource.get(alert['resource'])
+            if not state:
+                continue
+            latest, speed_raw, current_trend = state
+
+            created_ts = datetime.fromisoformat(alert['created_at']).timestamp() if alert.get('created_at') else 0
+            if latest['timestamp'] <= created_ts:
+                continue
 
+            bonus = bonuses.get(alert['user_id'], 0.0)
+            current_adj_price, _ = users.adjust_prices_with_bonus(bonus, latest['buy'], latest['sell'])
 
-def stale_db_reminder_loop(bot):
-    while True:
-        try:
-            global_ts = database.get_global_latest_timestamp()
-            now_ts = int(time.time())
-            delta = None if not global_ts else now_ts - global_ts
-            if delta is not None and delta < 15 * 60:
-                time.sleep(60)
+            adj_speed = speed_raw / (1 + bonus) if isinstance(bonus, float) else speed_raw
+            if adj_speed is None or adj_speed == 0:
                 continue
 
-            users_list = database.get_users_with_notifications_enabled()
-            for u in users_list:
-                uid = u["id"]
-                interval = int(u.get("notify_interval", 15))
-                last = int(u.get("last_reminder", 0))
-                if now_ts - last >= interval * 60:
-                    try:
-                        bot.send_message(uid, "⚠️ База данных рынков не обновлялась более 15 минут. Пожалуйста, пришлите свежий форвард рынка (🎪). Вы можете отключить уведомления или изменить интервал в /push.")
-                    except Exception:
-                        pass
-                    database.set_user_last_reminder(uid, now_ts)
-
-            chats = database.get_chats_with_notifications_enabled()
-            for c in chats:
-                chat_id = c["chat_id"]
-                interval = int(c.get("notify_interval", 15))
-                last = int(c.get("last_reminder", 0))
-                if now_ts - last >= interval * 60:
-                    try:
-                        bot.send_message(chat_id, "⚠️ Внимание: база данных рынков не обновлялась более 15 минут. Пожалуйста, пришлите форвард рынка или проверьте, что бот имеет доступ к сообщениям.")
-                    except Exception:
-                        pass
-                    database.set_chat_last_reminder(chat_id, now_ts)
+            if (alert['direction'] == "down" and current_trend == "up") or (alert['direction'] == "up" and current_trend == "down"):
+                messages.append((alert['user_id'], f"⚠️ Тренд для {alert['resource']} изменился (теперь {current_trend}). Оповещение будет деактивировано."))
+                statuses.append((alert['id'], 'trend_changed'))
+                continue
 
-        except Exception:
-            logger.exception("Ошибка в stale_db_reminder_loop")
-        time.sleep(60)
+            if (alert['direction'] == "down" and current_adj_price <= alert['target_price']) or (alert['direction'] == "up" and current_adj_price >= alert['target_price']):
+                messages.append((alert['user_id'], f"🔔 {alert['resource']} достигла цели {alert['target_price']:.2f} (текущая: {current_adj_price:.2f})."))
+                statuses.append((alert['id'], 'completed'))
+                continue
 
+            price_diff = alert['target_price'] - current_adj_price
+            if (alert['direction'] == "down" and adj_speed >= 0) or (alert['direction'] == "up" and adj_speed <= 0):
+                continue
 
-def update_dynamic_timers_loop(bot):
-    while True:
-        try:
-            update_dynamic_timers_once(bot)
-        except Exception:
-            logger.exception("Ошибка в update_dynamic_timers_loop")
-        time.sleep(60)
+            time_minutes = abs(price_diff) / abs(adj_speed)
+            new_alert_time = now + timedelta(minutes=time_minutes)
+            reschedules.append((alert['id'], new_alert_time.isoformat(), adj_speed, current_adj_price))
 
+            old = datetime.fromisoformat(alert['alert_time']) if alert.get('alert_time') else None
+            if old:
+                diff_min = abs((new_alert_time - old).total_seconds() / 60.0)
+                if diff_min > 5:
+                    messages.append((alert['user_id'], f"🔄 Таймер для {alert['resource']} обновлён. Новое время: {new_alert_time.strftime('%H:%M:%S')}"))
 
-def check_profit_alerts(bot):
-    while True:
-        try:
-            chats = database.get_chats_with_profit_alerts()
-            for chat in chats:
-                chat_id = chat['chat_id']
-                alerts = database.get_chat_profit_alerts(chat_id)
-                latest = database.get_latest_market_all()
-                for alert in alerts:
-                    resource = alert['resource']
-                    threshold = alert['threshold_price']
-                    min_qty = alert['min_quantity']
-                    current = next((r for r in latest if r['resource'] == resource), None)
-                    if current and current['buy'] <= threshold and current['quantity'] >= min_qty:
-                        try:
-                            bot.send_message(chat_id, f"@all Пора брать! {resource} Ожидает твоей покупки.")
-                            database.deactivate_profit_alert(chat_id, resource)
-                        except Exception:
-                            pass
         except Exception as e:
-            logger.exception("Ошибка в check_profit_alerts")
-        time.sleep(300)
+            logger.exception(f"Ошибка при обновлении алерта {alert.get('id')}: {e}")
+
+    # Все переназначения и смены статусов — одной транзакцией, сообщения — после коммита
+    database.apply_alert_updates(statuses, reschedules)
+    for chat_id, text in messages:
+        dispatcher.for_bot(bot).notify(chat_id, text)
+
+
+def cleanup_expired_alerts():
+    cutoff = (datetime.now() - timedelta(hours=1)).isoformat()
+    expired_ids = database.expire_active_alerts(cutoff)
+    if expired_ids:
+        logger.info(f"Очистка: деактивировано {len(expired_ids)} просроченных алертов: {expired_ids}")
+
+
+def send_stale_db_reminders(bot):
+    global_ts = database.get_global_latest_timestamp()
+    now_ts = int(time.time())
+    delta = None if not global_ts else now_ts - global_ts
+    if delta is not None and delta < 15 * 60:
+        return
+
+    outbox = dispatcher.for_bot(bot)
+    for uid in database.claim_due_user_reminders(now_ts):
+        outbox.send(uid, "⚠️ База данных рынков не обновлялась более 15 минут. Пожалуйста, пришлите свежий форвард рынка (🎪). Вы можете отключить уведомления или изменить интервал в /push.")
+
+    for chat_id in database.claim_due_chat_reminders(now_ts):
+        outbox.send(chat_id, "⚠️ Внимание: база данных рынков не обновлялась более 15 минут. Пожалуйста, пришлите форвард рынка или проверьте, что бот имеет доступ к сообщениям.")
 
 
-def start_background_tasks(bot):
-    threading.Thread(target=cleanup_expired_alerts_loop, daemon=True).start()
-    threading.Thread(target=update_dynamic_timers_loop, args=(bot,), daemon=True).start()
-    threading.Thread(target=stale_db_reminder_loop, args=(bot,), daemon=True).start()
-    threading.Thread(target=check_profit_alerts, args=(bot,), daemon=True).start()
+def check_profit_alerts(bot):
+    outbox = dispatcher.for_bot(bot)
+    notified = []
+    for alert in database.get_triggered_profit_alerts():
+        if outbox.notify(alert['chat_id'], f"@all Пора брать! {alert['resource']} Ожидает твоей покупки."):
+            notified.append(alert['id'])
+    database.deactivate_profit_alerts(notified)
+
+
+def background_jobs(bot) -> Dict[str, Callable[[], None]]:
+    """Периодические задачи по именам (имена совпадают с ключами Config.job_intervals)."""
+    return {
+        "cleanup_expired_alerts": cleanup_expired_alerts,
+        "update_dynamic_timers": lambda: update_dynamic_timers_once(bot),
+        "stale_db_reminders": lambda: send_stale_db_reminders(bot),
+        "check_profit_alerts": lambda: check_profit_alerts(bot),
+        "sync_timers": lambda: sync_timers(bot),
+        "sync_new_timers": lambda: sync_new_timers(bot),
+    }
+
+
+def register_gauges(bot) -> None:
+    """Gauge-метрики состояния: активные алерты, очереди планировщика и отправки, число потоков."""
+    metrics.gauge("bsp_active_alerts", "Активные таймеры").set_function(database.count_active_alerts)
+    metrics.gauge("bsp_scheduler_queue_depth", "Задачи в очереди общего планировщика").set_function(
+        lambda: scheduler.shared().pending())
+    metrics.gauge("bsp_send_queue_depth", "Сообщения в очереди отправки").set_function(
+        lambda: dispatcher.for_bot(bot).metrics()["queue_depth"])
+    metrics.gauge("bsp_threads", "Число потоков процесса").set_function(threading.active_count)
+
+
+def follow_leader(elector, bot) -> None:
+    """Таймеры планируются только у лидера; при избрании они восстанавливаются из БД, при потере роли — забываются."""
+    global _is_leader
+    _is_leader = elector.is_leader
+    elector.on_elected(lambda: scheduler.shared().call_later(0, sync_timers, bot))
+    elector.on_demoted(_forget_timers)
+
+
+def start_background_tasks(bot, cfg: Optional[config.Config] = None, elector=None) -> supervisor.Supervisor:
+    """
+    Запускает периодические задачи под управлением Supervisor и возвращает его.
+    Интервалы, джиттер и размер пула берутся из конфигурации.
+    elector (leader.LeaderElector) — задачи и таймеры выполняются, только пока процесс лидер;
+    при избрании таймеры сразу восстанавливаются из БД.
+    """
+    cfg = cfg or config.Config.from_env()
+    if elector is not None:
+        follow_leader(elector, bot)
+    sup = supervisor.Supervisor(workers=cfg.job_workers, is_leader=_is_leader)
+    for name, fn in background_jobs(bot).items():
+        sup.add_job(name, fn, cfg.job_intervals[name], jitter=cfg.job_jitter)
+    # Последним: пул обработчиков, webhook и ingest к этому моменту остановлены и больше ничего не ставят в очередь
+    sup.add_shutdown_hook(dispatcher.for_bot(bot).stop, last=True)
+    if elector is not None:
+        sup.add_shutdown_hook(elector.stop)
+    return sup
 
 
 def cmd_timer_handler(bot, message):
@@ -349,14 +383,14 @@ def cmd_timer_handler(bot, message):
         )
         sent = bot.reply_to(message, notify)
 
-        if chat_id and chat_id != user_id:
+        if chat_id and chat_id != user_id and not chats.get_settings(chat_id)["no_pin"]:
             try:
                 bot.pin_chat_message(chat_id, sent.message_id, disable_notification=True)
-                database.upsert_chat_settings(chat_id, True, database.get_chat_settings(chat_id)["notify_interval"], pinned_message_id=sent.message_id)
+                chats.set_pinned_message(chat_id, sent.message_id)
             except Exception:
                 pass
 
-        threading.Thread(target=schedule_alert, args=(alert_id, bot), daemon=True).start()
+        schedule_alert(alert_id, bot, alert_time)
 
     except Exception:
         logger.exception("Ошибка в cmd_timer_handler")
@@ -386,17 +420,19 @@ def cmd_cancel_handler(bot, message):
 
 
 def cmd_help_handler(bot, message):
-    help_text = """
+    help_text = f"""
 🆘 Инструкция по использованию бота:
 
 📊 /stat - Текущая статистика рынка с прогнозами и трендами.
-📜 /history [ресурс] - История цен за 24 часа (ресурс: Дерево, Камень, Провизия, Лошади).
+📜 /history [ресурс] [24h|7d|30d|all] - История цен (ресурс: {', '.join(market.resource_names())}).
+📈 /chart [ресурс] [24h|7d|30d|all] - График цен и объёма.
 🔔 /timer <ресурс> <цена> - Установить таймер на достижение цены (с кнопками up/down).
 📋 /status - Показать активные оповещения.
 🗑️ /cancel - Удалить все оповещения.
 ⚙️ /settings - Настроить якорь и уровень торговли.
 ⚡ /push - Настройки уведомлений и интервалов.
 🎪 Перешлите сообщение рынка для обновления данных.
+🔎 Inline-режим: наберите в любом чате @имя_бота Дерево - текущие цены без команд.
 
 Для групп: Бот может уведомлять @all о выгодных сделках и закреплять сообщения.
     """
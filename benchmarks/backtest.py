@@ -0,0 +1,276 @@
+# benchmarks/backtest.py
+# Бэктест прогноза /timer: на исторических тиках market запускаются тысячи синтетических
+# таймеров на ресурс, прогноз времени достижения цели сравнивается с фактическим пересечением.
+#
+#   python -m benchmarks.backtest --db bsp.db --lookbacks 5,15,30,60 --scenarios 5000
+#   python -m benchmarks.backtest --synthetic 4 --out backtest.json
+#
+# Прогноз, как в cmd_timer_handler: скорость по окну последних lookback минут, ETA = |цель - цена| / |скорость|;
+# если цена движется не к цели, таймер не ставится. Бонус пользователя делит и цену, и скорость
+# на одно число, поэтому на ETA не влияет и здесь не учитывается.
+# Оценки скорости:
+#   endpoints — (последняя - первая) / время, как сейчас в alerts.calculate_speed;
+#   ols       — наклон линейной регрессии по всем тикам окна;
+#   ewls      — взвешенная регрессия, вес тика падает вдвое каждые lookback/3 минуты.
+# Всё посчитано в numpy сразу по всем сценариям: окна — матрица индексов (сценарий x тик окна),
+# фактическое пересечение ищется блоками тиков вперёд для ещё не сработавших сценариев.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только этому инструменту
+    np = None
+
+import database
+
+ESTIMATORS = ("endpoints", "ols", "ewls")
+DEFAULT_LOOKBACKS = (5, 10, 15, 30, 60)
+SCAN_BLOCK = 512        # тиков за шаг поиска пересечения
+MATRIX_CELLS = 2_000_000  # ячеек в матрице окон за один проход оценки скорости
+WITHIN = 0.2            # «точный» прогноз: ошибка не больше 20% фактического времени
+
+
+def load_ticks(resources: Optional[List[str]] = None, since: Optional[int] = None,
+               until: Optional[int] = None) -> Dict[str, Tuple["np.ndarray", "np.ndarray"]]:
+    """{ресурс: (timestamp int64, buy float64)} из снимка БД, по возрастанию времени."""
+    conn = database.snapshot_connection()
+    try:
+        names = [r[0] for r in conn.execute("SELECT name FROM resources ORDER BY id")]
+        out = {}
+        for name in resources or names:
+            cur = conn.execute(
+                "SELECT m.timestamp, m.buy FROM resources r JOIN market m ON m.resource_id = r.id "
+                "WHERE r.name = ? AND m.timestamp >= ? AND m.timestamp < ? ORDER BY m.timestamp",
+                (name, since or 0, until or 2 ** 62))
+            data = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 2)
+            if len(data) > 1:
+                out[name] = (data[:, 0], data[:, 1] / database.PRICE_SCALE)
+        return out
+    finally:
+        conn.close()
+
+
+def make_scenarios(ts, price, n: int, horizon: int, max_lookback: int, min_move: float,
+                   max_move: float, rng) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Индексы тиков, в которые «ставится» таймер, и целевые цены. Отступ цели от текущей цены —
+    лог-равномерно в [min_move, max_move], вверх или вниз с равной вероятностью.
+    Старты берутся там, где есть полное окно истории и полный горизонт впереди.
+    """
+    lo = np.searchsorted(ts, ts[0] + max_lookback * 60)
+    hi = np.searchsorted(ts, ts[-1] - horizon * 60, side="right")
+    if hi - lo < 1:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    start = rng.integers(lo, hi, size=n)
+    move = np.exp(rng.uniform(np.log(min_move), np.log(max_move), size=n))
+    sign = rng.choice((-1.0, 1.0), size=n)
+    return start, price[start] * (1 + sign * move)
+
+
+def actual_crossing(ts, price, start, target, horizon: int) -> "np.ndarray":
+    """Минуты от старта до первого тика, где цена достигла цели; nan, если не достигла за horizon минут."""
+    n = len(start)
+    result = np.full(n, np.nan)
+    up = target > price[start]
+    limit = ts[start] + horizon * 60
+    pending = np.arange(n)
+    offset = 1
+    size = len(ts)
+    while len(pending):
+        s = start[pending]
+        idx = s[:, None] + offset + np.arange(SCAN_BLOCK)[None, :]
+        valid = idx < size
+        idx = np.minimum(idx, size - 1)
+        valid &= ts[idx] <= limit[pending, None]
+        block = price[idx]
+        tgt = target[pending, None]
+        hit = valid & np.where(up[pending, None], block >= tgt, block <= tgt)
+        found = hit.any(axis=1)
+        first = hit.argmax(axis=1)
+        done = pending[found]
+        result[done] = (ts[idx[found, first[found]]] - ts[start[done]]) / 60.0
+        # Дальше ищем только у тех, кто не сработал и ещё не упёрся в горизонт или конец данных
+        pending = pending[~found & valid[:, -1]]
+        offset += SCAN_BLOCK
+    return result
+
+
+def estimate_speed(ts, price, start, lookback: int, estimator: str) -> "np.ndarray":
+    """Скорость (цена в минуту) по тикам с timestamp >= ts[start] - lookback минут; nan, если тиков меньше двух."""
+    first = np.searchsorted(ts, ts[start] - lookback * 60)
+    count = start - first + 1
+    if estimator == "endpoints":
+        minutes = (ts[start] - ts[first]) / 60.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            speed = (price[start] - price[first]) / minutes
+        # как в calculate_speed: окно короче 0.1 минуты не даёт скорости
+        speed[(count < 2) | (minutes < 0.1)] = np.nan
+        return speed
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"Неизвестная оценка скорости {estimator!r}")
+    # Матрица окон сценарии x тики окна строится частями, чтобы не раздувать память на частых тиках
+    width = int(count.max())
+    step = max(1, MATRIX_CELLS // width)
+    speed = np.empty(len(start))
+    for lo in range(0, len(start), step):
+        part = slice(lo, lo + step)
+        speed[part] = _regression_slope(ts, price, start[part], count[part], width, lookback, estimator)
+    return speed
+
+
+def _regression_slope(ts, price, start, count, width: int, lookback: int, estimator: str):
+    offsets = np.arange(width)[None, :]
+    mask = offsets < count[:, None]
+    idx = np.maximum(start[:, None] - offsets, 0)
+    age = (ts[start][:, None] - ts[idx]) / 60.0          # минут назад, >= 0
+    w = mask * np.exp2(-age / (lookback / 3.0)) if estimator == "ewls" else mask.astype(float)
+    x = -age
+    y = price[idx]
+    sw = w.sum(axis=1)
+    mx = (w * x).sum(axis=1) / sw
+    my = (w * y).sum(axis=1) / sw
+    dx = x - mx[:, None]
+    sxx = (w * dx * dx).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = (w * dx * (y - my[:, None])).sum(axis=1) / sxx
+    speed[(count < 2) | (sxx <= 0)] = np.nan
+    return speed
+
+
+def score(predicted, actual) -> Dict:
+    """
+    predicted — ETA в минутах (nan: таймер бы не поставили), actual — фактическое время (nan: цель не достигнута).
+    Ошибка меряется отношением log(прогноз / факт): симметрична к «вдвое раньше» и «вдвое позже».
+    """
+    n = len(predicted)
+    issued = ~np.isnan(predicted)
+    reached = ~np.isnan(actual)
+    both = issued & reached
+    log_ratio = np.log(predicted[both] / np.maximum(actual[both], 1e-9))
+    abs_err = np.abs(predicted[both] - actual[both])
+
+    def q(values, pct):
+        return round(float(np.percentile(values, pct)), 4) if len(values) else None
+
+    return {
+        "scenarios": n,
+        "issued": round(float(issued.mean()), 4) if n else 0.0,
+        "hit_rate": round(float(reached[issued].mean()), 4) if issued.any() else None,
+        "missed_reached": round(float(reached[~issued].mean()), 4) if (~issued).any() else None,
+        "median_abs_log_ratio": q(np.abs(log_ratio), 50),
+        "p90_abs_log_ratio": q(np.abs(log_ratio), 90),
+        "bias_log_ratio": q(log_ratio, 50),
+        "median_abs_err_min": q(abs_err, 50),
+        "within_20pct": round(float((np.abs(log_ratio) <= np.log1p(WITHIN)).mean()), 4) if len(log_ratio) else None,
+    }
+
+
+def backtest(ticks: Dict, lookbacks, estimators, scenarios: int, horizon: int,
+             min_move: float, max_move: float, seed: int) -> Dict:
+    rng = np.random.default_rng(seed)
+    per_resource = {}
+    collected: Dict[Tuple[str, int], List] = {}
+    for resource, (ts, price) in ticks.items():
+        start, target = make_scenarios(ts, price, scenarios, horizon, max(lookbacks), min_move, max_move, rng)
+        if not len(start):
+            continue
+        actual = actual_crossing(ts, price, start, target, horizon)
+        diff = target - price[start]
+        per_resource[resource] = {"ticks": len(ts), "reached": round(float((~np.isnan(actual)).mean()), 4)}
+        for estimator in estimators:
+            for lookback in lookbacks:
+                speed = estimate_speed(ts, price, start, lookback, estimator)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    eta = diff / speed
+                # Цена идёт не к цели или стоит — таймер бы отклонили
+                eta[~(eta > 0) | ~np.isfinite(eta)] = np.nan
+                per_resource[resource][f"{estimator}/{lookback}"] = score(eta, actual)
+                pred, act = collected.setdefault((estimator, lookback), [[], []])
+                pred.append(eta)
+                act.append(actual)
+    overall = {f"{e}/{lb}": score(np.concatenate(p), np.concatenate(a))
+               for (e, lb), (p, a) in collected.items()}
+    return {"overall": overall, "per_resource": per_resource}
+
+
+def _synthetic_db(weeks: float, seed: int) -> str:
+    from benchmarks import generators
+    path = os.path.join(tempfile.mkdtemp(prefix="bsp-backtest-"), "backtest.db")
+    database.DB_PATH = path
+    database.init_db()
+    generators.populate(weeks, 0, 0, 0, seed=seed)
+    return path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бэктест прогноза времени /timer на истории рынка")
+    parser.add_argument("--db", help="БД с историей (по умолчанию database.DB_PATH)")
+    parser.add_argument("--synthetic", type=float, metavar="WEEKS", help="вместо БД — синтетический рынок за WEEKS недель")
+    parser.add_argument("--resource", action="append", help="ресурс; можно повторять (по умолчанию все)")
+    parser.add_argument("--since", type=int, help="unix timestamp начала истории")
+    parser.add_argument("--until", type=int, help="unix timestamp конца истории")
+    parser.add_argument("--lookbacks", default=",".join(map(str, DEFAULT_LOOKBACKS)), help="окна, минуты через запятую")
+    parser.add_argument("--estimators", default=",".join(ESTIMATORS), help="оценки скорости через запятую")
+    parser.add_argument("--scenarios", type=int, default=2000, help="таймеров на ресурс")
+    parser.add_argument("--horizon", type=int, default=24 * 60, help="сколько минут ждать пересечения")
+    parser.add_argument("--min-move", type=float, default=0.002, help="минимальный отступ цели, доля цены")
+    parser.add_argument("--max-move", type=float, default=0.05, help="максимальный отступ цели, доля цены")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="записать отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("Для бэктеста нужен numpy: pip install numpy", file=sys.stderr)
+        return 1
+    estimators = [e.strip() for e in args.estimators.split(",") if e.strip()]
+    unknown = set(estimators) - set(ESTIMATORS)
+    if unknown:
+        parser.error(f"неизвестные оценки: {', '.join(sorted(unknown))}")
+    lookbacks = sorted({int(v) for v in args.lookbacks.split(",") if v.strip()})
+    if args.synthetic:
+        _synthetic_db(args.synthetic, args.seed)
+    elif args.db:
+        database.DB_PATH = args.db
+
+    started = time.perf_counter()
+    ticks = load_ticks(args.resource, args.since, args.until)
+    loaded = time.perf_counter()
+    if not ticks:
+        print("В БД нет истории рынка", file=sys.stderr)
+        return 1
+    result = backtest(ticks, lookbacks, estimators, args.scenarios, args.horizon,
+                      args.min_move, args.max_move, args.seed)
+    finished = time.perf_counter()
+    result["params"] = {k: v for k, v in vars(args).items() if k != "out"}
+    result["elapsed_s"] = {"load": round(loaded - started, 3), "simulate": round(finished - loaded, 3)}
+
+    total_ticks = sum(len(t[0]) for t in ticks.values())
+    print(f"Тиков: {total_ticks} по {len(ticks)} ресурсам, таймеров на ресурс: {args.scenarios}, "
+          f"загрузка {result['elapsed_s']['load']} с, симуляция {result['elapsed_s']['simulate']} с")
+    print(f"{'оценка/окно':<16}{'выдано':>8}{'сбылось':>9}{'|log|50':>9}{'|log|90':>9}"
+          f"{'смещ.':>8}{'±20%':>7}{'ош.50,мин':>11}")
+    ranked = sorted(result["overall"].items(),
+                    key=lambda kv: (kv[1]["median_abs_log_ratio"] is None, kv[1]["median_abs_log_ratio"] or 0))
+
+    def fmt(value, width):
+        return f"{'—' if value is None else value:>{width}}"
+
+    for name, s in ranked:
+        print(f"{name:<16}{fmt(s['issued'], 8)}{fmt(s['hit_rate'], 9)}{fmt(s['median_abs_log_ratio'], 9)}"
+              f"{fmt(s['p90_abs_log_ratio'], 9)}{fmt(s['bias_log_ratio'], 8)}{fmt(s['within_20pct'], 7)}"
+              f"{fmt(s['median_abs_err_min'], 11)}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт записан в {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# benchmarks/fakebot.py
+import threading
+from types import SimpleNamespace
+from typing import List, Optional
+
+
+class FakeBot:
+    """
+    Подмена TeleBot для бенчмарков: ничего не отправляет, только запоминает исходящие сообщения.
+    Поддерживает методы, которые вызывают обработчики и диспетчер.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.sent: List[tuple] = []
+        self.callback_answers = 0
+        self.next_steps = {}
+
+    def _message(self, chat_id: int, text: str):
+        with self._lock:
+            message_id = self._next_id
+            self._next_id += 1
+            self.sent.append((chat_id, text))
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id), text=text)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._message(chat_id, text)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._message(message.chat.id, text)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        msg = self._message(chat_id, caption or "")
+        msg.photo = [SimpleNamespace(file_id=f"photo{msg.message_id}")]
+        return msg
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        with self._lock:
+            self.callback_answers += 1
+        return True
+
+    def pin_chat_message(self, chat_id, message_id, disable_notification=False):
+        return True
+
+    def register_next_step_handler(self, message, callback, *args, **kwargs):
+        self.next_steps[message.chat.id] = callback
+
+    def reset(self) -> None:
+        with self._lock:
+            self.sent.clear()
+            self.callback_answers = 0
+
+
+def make_message(text: str, user_id: int, chat_id: Optional[int] = None, chat_type: str = "private",
+                 username: Optional[str] = None, date: Optional[int] = None, forward_from_id: Optional[int] = None):
+    """Минимальный объект сообщения с полями, которые читают обработчики."""
+    chat_id = user_id if chat_id is None else chat_id
+    return SimpleNamespace(
+        text=text,
+        date=date,
+        message_id=1,
+        from_user=SimpleNamespace(id=user_id, username=username or f"user{user_id}"),
+        chat=SimpleNamespace(id=chat_id, type=chat_type),
+        forward_from=SimpleNamespace(id=forward_from_id, username=f"user{forward_from_id}") if forward_from_id else None,
+        forward_sender_name=None,
+    )
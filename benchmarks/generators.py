@@ -0,0 +1,120 @@
+# benchmarks/generators.py
+# Синтетические, но правдоподобные данные: ряды цен по ресурсам, пользователи с бонусами,
+# таймеры и /buyalert. Всё детерминировано через seed.
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import database
+import market
+
+# Стартовые цены покупки и типичные объёмы
+BASE = {
+    "Дерево": (8.3, 96_000_000),
+    "Камень": (6.1, 54_000_000),
+    "Провизия": (4.7, 120_000_000),
+    "Лошади": (31.0, 2_500_000),
+}
+SELL_RATIO = 0.82
+TICK = 300
+
+
+def resources() -> List[str]:
+    return market.resource_names()
+
+
+def market_series(rng: random.Random, start_ts: int, end_ts: int, step: int = TICK) -> List[Tuple[str, float, float, int, int]]:
+    """Случайное блуждание с возвратом к среднему: тик раз в step секунд по каждому ресурсу."""
+    rows = []
+    for res in resources():
+        base_price, base_qty = BASE.get(res, (10.0, 1_000_000))
+        price, qty = base_price, base_qty
+        for ts in range(start_ts, end_ts + 1, step):
+            price += rng.gauss(0, base_price * 0.004) + (base_price - price) * 0.01
+            price = max(price, base_price * 0.3)
+            qty = max(0, int(qty + rng.gauss(0, base_qty * 0.01) + (base_qty - qty) * 0.02))
+            rows.append((res, round(price, 3), round(price * SELL_RATIO, 3), qty, ts))
+    return rows
+
+
+def market_message(prices: Dict[str, Tuple[float, float, int]]) -> str:
+    """Текст сообщения рынка в формате, который разбирает market._parse_market_message_lines."""
+    lines = ["🎪 Рынок", ""]
+    emoji = market.resource_emoji()
+    for res, (buy, sell, qty) in prices.items():
+        lines.append(f"{res}: {qty:,} {emoji.get(res, '')}".replace(",", " "))
+        lines.append(f"📈 Купить/продать: {buy:.2f}/{sell:.2f}💰")
+    return "\n".join(lines)
+
+
+def latest_prices(rows) -> Dict[str, Tuple[float, float, int]]:
+    latest = {}
+    for res, buy, sell, qty, ts in rows:
+        latest[res] = (buy, sell, qty)
+    return latest
+
+
+def populate(weeks: float = 2, n_users: int = 2000, n_timers: int = 3000, n_buyalerts: int = 500,
+             seed: int = 1, end_ts: Optional[int] = None) -> Dict:
+    """
+    Заполняет текущую БД (database.DB_PATH): рынок за weeks недель, пользователи с бонусами
+    (якорь и уровень торговли 0..5), активные таймеры и алерты /buyalert в группах.
+    """
+    rng = random.Random(seed)
+    end_ts = int(time.time()) if end_ts is None else end_ts
+    start_ts = end_ts - int(weeks * 7 * 24 * 3600)
+
+    rows = market_series(rng, start_ts, end_ts)
+    database.insert_market_records(rows)
+    latest = latest_prices(rows)
+
+    user_rows = []
+    for uid in range(1, n_users + 1):
+        anchor = rng.random() < 0.3
+        level = rng.choice([0, 0, 1, 2, 3, 4, 5])
+        bonus = (0.02 if anchor else 0) + 0.02 * level
+        interval = rng.choice([5, 15, 15, 30, 60])
+        user_rows.append((uid, f"user{uid}", bonus, 1 if rng.random() < 0.9 else 0, interval, int(anchor), level))
+
+    now = datetime.fromtimestamp(end_ts)
+    alert_rows = []
+    res_list = resources()
+    for _ in range(n_timers):
+        uid = rng.randint(1, n_users)
+        res = rng.choice(res_list)
+        buy = latest[res][0]
+        direction = rng.choice(["up", "down"])
+        target = buy * (1 + rng.uniform(0.01, 0.1)) if direction == "up" else buy * (1 - rng.uniform(0.01, 0.1))
+        speed = rng.uniform(0.0005, 0.01) * (1 if direction == "up" else -1)
+        alert_time = now + timedelta(minutes=rng.uniform(-90, 600))
+        created = now - timedelta(minutes=rng.uniform(20, 600))
+        chat_id = -rng.randint(1, 200) if rng.random() < 0.2 else None
+        alert_rows.append((uid, res, round(target, 3), direction, speed, buy, alert_time.isoformat(), created.isoformat(), chat_id))
+
+    buyalert_rows = []
+    for i in range(n_buyalerts):
+        res = rng.choice(res_list)
+        buy, _, qty = latest[res]
+        buyalert_rows.append((-(1000 + i), res, round(buy * rng.uniform(0.9, 1.1), 3), int(qty * rng.uniform(0.5, 1.2))))
+
+    conn = database.get_connection()
+    c = conn.cursor()
+    c.executemany("""
+        INSERT OR REPLACE INTO users (id, username, bonus, notify_enabled, notify_interval, anchor, trade_level)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, user_rows)
+    c.executemany("""
+        INSERT INTO alerts (user_id, resource, target_price, direction, speed, current_price, alert_time, created_at, chat_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, alert_rows)
+    c.executemany("""
+        INSERT INTO chat_profit_alerts (chat_id, resource, threshold_price, min_quantity, active)
+        VALUES (?, ?, ?, ?, 1)
+    """, buyalert_rows)
+    c.executemany("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", [(-i,) for i in range(1, 201)])
+    conn.commit()
+    conn.close()
+
+    return {"ticks": len(rows), "users": n_users, "timers": n_timers, "buyalerts": n_buyalerts,
+            "start_ts": start_ts, "end_ts": end_ts, "latest": latest}
@@ -0,0 +1,312 @@
+# benchmarks/replay.py
+# Нагрузочный прогон: поток апдейтов Telegram (записанный или синтетический) проходит через
+# настоящую регистрацию обработчиков из bot.py и пул update_pool при заданной частоте,
+# Telegram API подменён локальной заглушкой, база — временная.
+#
+#   python -m benchmarks.replay --updates 5000 --rate 200 --workers 8
+#   python -m benchmarks.replay --input updates.jsonl --rate 0 --with-jobs --out replay.json
+#
+# Отчёт: p50/p95/p99 задержки обработки (от постановки в очередь до конца обработчика),
+# пропускная способность, исходящие вызовы API по методам, запросы к БД и ожидание блокировок.
+# Блокировки SQLite измеряются косвенно: время пишущих запросов и COMMIT (включая ожидание
+# busy timeout) и число ошибок «database is locked».
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterator, List
+
+from benchmarks import generators
+from benchmarks.run import _git_commit, _percentile
+
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE", "COMMIT")
+
+# Доли типов апдейтов в синтетическом потоке
+MIX = {
+    "command": 0.35,
+    "market_forward": 0.15,
+    "callback": 0.15,
+    "chatter": 0.35,
+}
+COMMANDS = ["/start", "/help", "/stat", "/history {res}", "/status", "/settings", "/push", "/timer"]
+CALLBACKS = ["settings_anchor", "push_toggle"]
+CHATTER = ["всем привет", "кто продаёт дерево?", "ок", "куплю камень", "спасибо!", "что по ценам?"]
+
+
+class FakeTelegramApi:
+    """
+    Заглушка HTTP API Telegram для telebot.apihelper.CUSTOM_REQUEST_SENDER:
+    считает вызовы по методам и отвечает правдоподобным JSON (для send*/edit* — объект сообщения).
+    latency — искусственная задержка ответа в секундах.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        name = url.rsplit("/", 1)[-1]
+        params = params or {}
+        with self._lock:
+            self.calls[name] += 1
+            message_id = self._next_id
+            self._next_id += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if name.startswith(("send", "edit")):
+            try:
+                chat_id = int(params.get("chat_id", 0))
+            except (TypeError, ValueError):
+                chat_id = 0
+            result = {"message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                      "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}}
+            if name == "sendPhoto":
+                result["photo"] = [{"file_id": f"photo{message_id}", "file_unique_id": f"u{message_id}",
+                                    "width": 800, "height": 500}]
+        else:
+            result = True
+        return _Response({"ok": True, "result": result})
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, payload: Dict):
+        self._payload = payload
+        self.text = json.dumps(payload, ensure_ascii=False)
+
+    def json(self):
+        return self._payload
+
+
+class QueryStats:
+    """Слушатель querytrace: агрегирует запросы к БД за прогон."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.writes: List[float] = []
+        self.locked = 0
+
+    def __call__(self, query) -> None:
+        is_write = query.sql.lstrip().upper().startswith(WRITE_PREFIXES)
+        with self._lock:
+            # «queries» — как в benchmarks.run, без COMMIT; время COMMIT идёт в пишущие
+            self.total += query.sql != "COMMIT"
+            if is_write:
+                self.writes.append(query.duration)
+            if query.error and "locked" in query.error:
+                self.locked += 1
+
+    def report(self) -> Dict:
+        with self._lock:
+            writes = list(self.writes)
+        return {
+            "queries": self.total,
+            "writes": len(writes),
+            "write_time_s": round(sum(writes), 4),
+            "write_p99_ms": round(_percentile(writes, 99) * 1000, 3) if writes else 0.0,
+            "write_max_ms": round(max(writes) * 1000, 3) if writes else 0.0,
+            "locked_errors": self.locked,
+        }
+
+
+def _user(uid: int) -> Dict:
+    return {"id": uid, "is_bot": False, "first_name": f"user{uid}", "username": f"user{uid}"}
+
+
+def _chat(chat_id: int) -> Dict:
+    return {"id": chat_id, "type": "private"} if chat_id > 0 else {"id": chat_id, "type": "supergroup", "title": f"chat{chat_id}"}
+
+
+def _message(update_id: int, uid: int, chat_id: int, text: str, **extra) -> Dict:
+    msg = {"message_id": update_id, "from": _user(uid), "chat": _chat(chat_id), "date": int(time.time()), "text": text}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    msg.update(extra)
+    return {"update_id": update_id, "message": msg}
+
+
+def synthesize(n: int, users: int, groups: int, market_text: str, seed: int = 1) -> Iterator[Dict]:
+    """Синтетический поток апдейтов в формате Bot API (как их присылает getUpdates/webhook)."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX.items())
+    res = generators.resources()
+    for update_id in range(1, n + 1):
+        kind = rng.choices(kinds, weights)[0]
+        uid = rng.randint(1, users)
+        if kind == "command":
+            text = rng.choice(COMMANDS).format(res=rng.choice(res))
+            yield _message(update_id, uid, uid, text)
+        elif kind == "market_forward":
+            yield _message(update_id, uid, uid, market_text,
+                           forward_from=_user(rng.randint(1, users)), forward_date=int(time.time()))
+        elif kind == "callback":
+            anchor = _message(update_id, uid, uid, "⚙️")["message"]
+            yield {"update_id": update_id, "callback_query": {
+                "id": str(update_id), "from": _user(uid), "chat_instance": str(uid),
+                "data": rng.choice(CALLBACKS), "message": anchor}}
+        else:
+            yield _message(update_id, uid, -rng.randint(1, groups), rng.choice(CHATTER))
+
+
+def load(path: str) -> Iterator[Dict]:
+    """Записанный поток: JSONL, по одному апдейту (dict из Bot API) на строку."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _refresh_dates(raw: Dict) -> Dict:
+    # Форварды рынка старше часа отклоняются, поэтому записанные апдейты «переносим» в настоящее
+    now = int(time.time())
+    for key in ("message", "edited_message"):
+        if key in raw:
+            raw[key]["date"] = now
+    if "callback_query" in raw and raw["callback_query"].get("message"):
+        raw["callback_query"]["message"]["date"] = now
+    return raw
+
+
+def run(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="bsp-replay-")
+    os.environ.setdefault("BSP_TOKEN", "0:replay")
+
+    import database
+    import querytrace
+    from telebot import apihelper, types
+
+    database.DB_PATH = os.path.join(workdir, "replay.db")
+    database.init_db()
+    summary = generators.populate(args.weeks, args.users, args.timers, args.buyalerts, seed=args.seed)
+
+    api = FakeTelegramApi(args.api_latency)
+    apihelper.CUSTOM_REQUEST_SENDER = api
+    stats = QueryStats()
+    querytrace.add_listener(stats)
+    # Без рамок запросов и предупреждений: слушатель получает все запросы
+    querytrace.enable(slow_ms=float("inf"), max_queries=sys.maxsize, sample_rate=0.0)
+
+    import alerts
+    import bot as bot_module
+    import config
+    import update_pool
+
+    cfg = config.Config.from_env()
+    cfg.db_path = database.DB_PATH
+    cfg.query_trace = False     # трассировка уже включена выше, с нашими порогами
+    bot = bot_module.create_app(cfg)
+    latencies: List[float] = []
+    lat_lock = threading.Lock()
+
+    def process(updates):
+        try:
+            bot.process_new_updates(updates)
+        finally:
+            done = time.perf_counter()
+            with lat_lock:
+                for u in updates:
+                    latencies.append(done - u._replay_submitted)
+
+    pool = update_pool.ChatWorkerPool(process, workers=args.workers, max_queue=args.max_queue).start()
+    tasks = alerts.start_background_tasks(bot, cfg) if args.with_jobs else None
+
+    if args.input:
+        stream = load(args.input)
+    else:
+        text = generators.market_message(summary["latest"])
+        stream = synthesize(args.updates, args.users, args.groups, text, seed=args.seed)
+
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    submitted = 0
+    start = time.perf_counter()
+    for raw in stream:
+        if interval:
+            delay = start + submitted * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        update = types.Update.de_json(_refresh_dates(raw))
+        update._replay_submitted = time.perf_counter()
+        pool.submit([update])
+        submitted += 1
+    pool.join()
+    elapsed = time.perf_counter() - start
+
+    if tasks:
+        tasks.stop()
+    pool_stats = pool.stats()
+    pool.stop()
+    querytrace.remove_listener(stats)
+    querytrace.disable()
+    apihelper.CUSTOM_REQUEST_SENDER = None
+
+    lat_ms = [x * 1000 for x in latencies]
+    result = {
+        "meta": {
+            "commit": _git_commit(),
+            "params": {k: v for k, v in vars(args).items() if k != "out"},
+        },
+        "updates": submitted,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(submitted / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(lat_ms, 50), 3) if lat_ms else 0.0,
+            "p95": round(_percentile(lat_ms, 95), 3) if lat_ms else 0.0,
+            "p99": round(_percentile(lat_ms, 99), 3) if lat_ms else 0.0,
+            "max": round(max(lat_ms), 3) if lat_ms else 0.0,
+        },
+        "pool": {"failed": pool_stats["failed"], "avg_wait_ms": round(pool_stats["avg_wait"] * 1000, 3),
+                 "max_wait_ms": round(pool_stats["max_wait"] * 1000, 3)},
+        "db": stats.report(),
+        "outbound": dict(api.calls.most_common()),
+    }
+    if tasks:
+        result["jobs"] = tasks.stats()
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон апдейтов BS Market bot")
+    parser.add_argument("--input", help="JSONL с записанными апдейтами (по умолчанию — синтетический поток)")
+    parser.add_argument("--updates", type=int, default=2000, help="число синтетических апдейтов")
+    parser.add_argument("--rate", type=float, default=100, help="апдейтов в секунду, 0 — без ограничения")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=1000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа заглушки API, с")
+    parser.add_argument("--with-jobs", action="store_true", help="параллельно запускать фоновые задачи")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--weeks", type=float, default=1)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--timers", type=int, default=3000)
+    parser.add_argument("--buyalerts", type=int, default=500)
+    parser.add_argument("--out", help="записать отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    lat = result["latency_ms"]
+    db = result["db"]
+    print(f"Апдейтов: {result['updates']} за {result['elapsed_s']} с ({result['throughput_per_s']}/с), "
+          f"ошибок обработки: {result['pool']['failed']}")
+    print(f"Задержка, мс: p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    print(f"БД: {db['queries']} запросов, {db['writes']} пишущих ({db['write_time_s']} с, p99 {db['write_p99_ms']} мс), "
+          f"database is locked: {db['locked_errors']}")
+    print("Исходящие вызовы API: " + ", ".join(f"{k}={v}" for k, v in result["outbound"].items()))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт записан в {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+# benchmarks/run.py
+# Воспроизводимые бенчмарки горячих путей на синтетических данных.
+#
+#   python -m benchmarks.run --out bench.json
+#   python -m benchmarks.run --out new.json --compare bench.json --threshold 0.2
+#
+# Результаты (мин/медиана/p95 в мс и число SQL-запросов на вызов) пишутся в JSON,
+# чтобы сравнивать прогоны между коммитами; --compare завершает с кодом 1 при регрессии медианы.
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+import alerts
+import database
+import handlers
+import ingest
+import market
+import querytrace
+
+from benchmarks import generators
+from benchmarks.fakebot import FakeBot, make_message
+
+
+def _copy_db(src: str, dst: str) -> None:
+    with sqlite3.connect(src) as s, sqlite3.connect(dst) as d:
+        s.backup(d)
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def bench(fn: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    if setup:
+        setup()
+    with querytrace.assert_max_queries(sys.maxsize) as scope:
+        fn()
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(timings), 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "p95_ms": round(_percentile(timings, 95), 4),
+        "queries": len(scope.queries),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="bsp-bench-")
+    fresh_db = os.path.join(workdir, "fresh.db")
+    stale_db = os.path.join(workdir, "stale.db")
+    work_db = os.path.join(workdir, "work.db")
+    now = int(time.time())
+
+    database.DB_PATH = fresh_db
+    database.init_db()
+    summary = generators.populate(args.weeks, args.users, args.timers, args.buyalerts, seed=args.seed, end_ts=now)
+    # Для напоминаний нужна «устаревшая» база: последний тик полчаса назад
+    database.DB_PATH = stale_db
+    database.init_db()
+    generators.populate(args.weeks, args.users, 0, 0, seed=args.seed, end_ts=now - 1800)
+
+    bot = FakeBot()
+    rng = random.Random(args.seed)
+    user_ids = list(range(1, args.users + 1))
+    text = generators.market_message(summary["latest"])
+    res = generators.resources()
+
+    def on(path: str, mutating: bool = False):
+        # Мутирующие бенчмарки каждый раз получают свежую копию БД (и забывают состояние, привязанное к прежней)
+        def setup():
+            if mutating:
+                _copy_db(path, work_db)
+                ingest.reset()
+            database.DB_PATH = work_db if mutating else path
+        return setup
+
+    cases = {
+        "_parse_market_message_lines": (lambda: market._parse_market_message_lines(text), None, args.repeat * 20),
+        "handle_market_forward": (
+            lambda: ingest.handle_market_forward(bot, make_message(text, rng.choice(user_ids), date=int(time.time()),
+                                                                   forward_from_id=rng.choice(user_ids))),
+            on(fresh_db, mutating=True), args.repeat),
+        "cmd_stat": (lambda: handlers.cmd_stat(bot, make_message("/stat", rng.choice(user_ids))),
+                     on(fresh_db), args.repeat),
+        "cmd_history": (lambda: handlers.cmd_history(bot, make_message(f"/history {rng.choice(res)}", rng.choice(user_ids))),
+                        on(fresh_db), args.repeat),
+        "update_dynamic_timers_once": (lambda: alerts.update_dynamic_timers_once(bot), on(fresh_db, mutating=True), args.repeat),
+        "check_profit_alerts": (lambda: alerts.check_profit_alerts(bot), on(fresh_db, mutating=True), args.repeat),
+        "send_stale_db_reminders": (lambda: alerts.send_stale_db_reminders(bot), on(stale_db, mutating=True), args.repeat),
+    }
+
+    results = {}
+    for name, (fn, setup, repeat) in cases.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = bench(fn, repeat, setup)
+        print(f"{name:32s} median {results[name]['median_ms']:10.3f} ms  p95 {results[name]['p95_ms']:10.3f} ms  "
+              f"queries {results[name]['queries']}")
+
+    meta = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "timestamp": now,
+        "params": {"weeks": args.weeks, "users": args.users, "timers": args.timers,
+                   "buyalerts": args.buyalerts, "seed": args.seed, "repeat": args.repeat},
+        "ticks": summary["ticks"],
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> bool:
+    """Печатает сравнение медиан; возвращает True, если есть регрессия больше threshold."""
+    regressed = False
+    print(f"\nСравнение с {baseline['meta'].get('commit')} (порог {threshold:.0%}):")
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        ratio = cur["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- регрессия"
+            regressed = True
+        print(f"{name:32s} {base['median_ms']:10.3f} -> {cur['median_ms']:10.3f} ms  x{ratio:.2f}{flag}")
+    return regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки BS Market bot")
+    parser.add_argument("--out", default="bench_output.json")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост медианы (доля)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--weeks", type=float, default=2)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--timers", type=int, default=3000)
+    parser.add_argument("--buyalerts", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--only", nargs="*", help="запустить только указанные бенчмарки")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 1 if compare(result, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
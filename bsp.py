@@ -0,0 +1,172 @@
+# bsp.py
+# Точка входа для обслуживания и запуска: каждая подкоманда импортирует только то, что ей нужно.
+#
+#   python -m bsp run                      # бот (режим и настройки — из BSP_*)
+#   python -m bsp migrate                  # создать/обновить схему БД
+#   python -m bsp compact                  # PRAGMA optimize + VACUUM
+#   python -m bsp import market.csv        # загрузить тики рынка из CSV
+#   python -m bsp export market candles --format parquet --out dump/ --since 2024-05-01
+#   python -m bsp bench -- --repeat 5      # benchmarks.run с переданными аргументами
+#   python -m bsp backtest -- --lookbacks 5,15,60   # точность прогноза /timer на истории из БД
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import config
+
+IMPORT_BATCH = 5000
+
+
+def cmd_run(cfg: config.Config, args) -> int:
+    import bot
+    bot.main(cfg)
+    return 0
+
+
+def _open_db(cfg: config.Config):
+    import database
+    database.DB_PATH = cfg.db_path
+    return database
+
+
+def cmd_migrate(cfg: config.Config, args) -> int:
+    database = _open_db(cfg)
+    database.init_db()
+    print(f"Схема БД {cfg.db_path} актуальна")
+    return 0
+
+
+def cmd_compact(cfg: config.Config, args) -> int:
+    if not os.path.exists(cfg.db_path):
+        print(f"Файл БД {cfg.db_path} не найден", file=sys.stderr)
+        return 1
+    database = _open_db(cfg)
+    before = os.path.getsize(cfg.db_path)
+    start = time.perf_counter()
+    database.compact()
+    after = os.path.getsize(cfg.db_path)
+    print(f"{cfg.db_path}: {before / 1e6:.1f} МБ -> {after / 1e6:.1f} МБ за {time.perf_counter() - start:.1f} с")
+    return 0
+
+
+def _read_market_csv(path: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield (row["resource"], float(row["buy"]), float(row["sell"]),
+                   int(float(row.get("quantity") or 0)), int(float(row["timestamp"])))
+
+
+def cmd_import(cfg: config.Config, args) -> int:
+    """CSV с заголовком resource,buy,sell,quantity,timestamp (как в таблице market)."""
+    database = _open_db(cfg)
+    database.init_db()
+    total = 0
+    batch = []
+    for record in _read_market_csv(args.file):
+        batch.append(record)
+        if len(batch) >= IMPORT_BATCH:
+            database.insert_market_records(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        database.insert_market_records(batch)
+        total += len(batch)
+    print(f"Импортировано записей рынка: {total}")
+    return 0
+
+
+def _parse_time(value: str) -> int:
+    """Unix timestamp или дата/время ISO 8601."""
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def cmd_export(cfg: config.Config, args) -> int:
+    import export
+    if not os.path.exists(cfg.db_path):
+        print(f"Файл БД {cfg.db_path} не найден", file=sys.stderr)
+        return 1
+    _open_db(cfg)
+    try:
+        since = _parse_time(args.since) if args.since else None
+        until = _parse_time(args.until) if args.until else None
+        start = time.perf_counter()
+        counts = export.export(args.tables or list(export.TABLES), args.out, args.format,
+                               since, until, args.resource, args.chunk)
+    except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.out != "-":
+        summary = ", ".join(f"{name}: {n}" for name, n in counts.items())
+        print(f"Выгружено в {args.out} за {time.perf_counter() - start:.1f} с ({summary})")
+    return 0
+
+
+def _strip_separator(rest):
+    return rest[1:] if rest and rest[0] == "--" else rest
+
+
+def cmd_bench(cfg: config.Config, args) -> int:
+    from benchmarks import run
+    return run.main(_strip_separator(args.rest))
+
+
+def cmd_replay(cfg: config.Config, args) -> int:
+    from benchmarks import replay
+    return replay.main(_strip_separator(args.rest))
+
+
+def cmd_backtest(cfg: config.Config, args) -> int:
+    _open_db(cfg)
+    from benchmarks import backtest
+    return backtest.main(_strip_separator(args.rest))
+
+
+COMMANDS = {
+    "run": (cmd_run, "запустить бота"),
+    "migrate": (cmd_migrate, "создать или обновить схему БД"),
+    "compact": (cmd_compact, "обновить статистику и сжать файл БД"),
+    "import": (cmd_import, "импортировать тики рынка из CSV"),
+    "export": (cmd_export, "выгрузить market, свечи и алерты в CSV/Parquet"),
+    "bench": (cmd_bench, "микробенчмарки (benchmarks.run)"),
+    "replay": (cmd_replay, "нагрузочный прогон апдейтов (benchmarks.replay)"),
+    "backtest": (cmd_backtest, "бэктест прогноза /timer (benchmarks.backtest)"),
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bsp", description="BS Market bot")
+    parser.add_argument("--db", help="путь к БД (по умолчанию BSP_DB_PATH или bsp.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        p = sub.add_parser(name, help=help_text)
+        if name == "import":
+            p.add_argument("file", help="CSV: resource,buy,sell,quantity,timestamp")
+        elif name == "export":
+            p.add_argument("tables", nargs="*", help="market, candles, alerts (по умолчанию все)")
+            p.add_argument("--format", choices=["csv", "parquet"], default="csv")
+            p.add_argument("--out", default=".", help="каталог для файлов или - (stdout, одна таблица CSV)")
+            p.add_argument("--since", help="начало интервала: unix timestamp или ISO 8601")
+            p.add_argument("--until", help="конец интервала (не включая)")
+            p.add_argument("--resource", action="append", help="ресурс; можно повторять")
+            p.add_argument("--chunk", type=int, default=10000, help="строк в порции")
+        elif name in ("bench", "replay", "backtest"):
+            p.add_argument("rest", nargs=argparse.REMAINDER, help="аргументы для модуля")
+    args = parser.parse_args(argv)
+
+    cfg = config.Config.from_env()
+    if args.db:
+        cfg.db_path = args.db
+    if args.command != "run":
+        logging.basicConfig(level=logging.WARNING)
+    return COMMANDS[args.command][0](cfg, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# charts.py
+# PNG-графики цен покупки/продажи и объёма (matplotlib, backend Agg, без дисплея).
+# Готовые картинки лежат в LRU-кэше по ключу (ресурс, период, ступень бонуса, версия данных):
+# версия — время последнего тика ресурса, бонус округляется до BONUS_TIER, поэтому после каждого
+# форварда график рисуется один раз на ступень, а остальные запросы получают те же байты или
+# уже загруженный в Telegram file_id. Одинаковый график, который уже рисуется, не рисуется второй раз —
+# запрос ждёт его отрисовки; разные графики рисуются параллельно.
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import database
+import downsample
+import metrics
+import users
+
+logger = logging.getLogger(__name__)
+
+RANGES = {"24h": 24 * 3600, "7d": 7 * 24 * 3600, "30d": 30 * 24 * 3600, "all": None}
+CACHE_MAX = 128
+MAX_POINTS = 800        # точек на линию после LTTB; больше по ширине картинки не видно
+BONUS_TIER = 0.1        # шаг бонуса на графике: не отдельная картинка на каждый бонус
+
+RENDERS = metrics.counter("bsp_chart_renders_total", "Отрисованные графики", ["range"])
+CACHE_HITS = metrics.counter("bsp_chart_cache_hits_total", "Графики, отданные из кэша", ["kind"])
+RENDER_WAITS = metrics.counter("bsp_chart_render_waits_total", "Запросы, дождавшиеся уже идущей отрисовки")
+RENDER_DURATION = metrics.histogram("bsp_chart_render_seconds", "Время отрисовки графика", ["range"])
+
+_cache: "OrderedDict[Tuple, Dict]" = OrderedDict()
+_inflight: Dict[Tuple, Future] = {}   # ключ -> идущая отрисовка
+_lock = threading.Lock()               # кэш и _inflight
+
+
+def available() -> bool:
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def preload() -> None:
+    """Импортирует matplotlib при старте процесса, а не в первом запросе /chart (около полусекунды CPU)."""
+    if not available():
+        return
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import dates, figure  # noqa: F401
+    from matplotlib.backends import backend_agg  # noqa: F401
+
+
+def bonus_tier(bonus: float) -> float:
+    return round(round(bonus / BONUS_TIER) * BONUS_TIER, 4)
+
+
+def _series(resource: str, range_name: str):
+    """Ряды (ts, buy, sell, quantity): сырые тики за 24 часа, иначе часовые свечи."""
+    span = RANGES[range_name]
+    if range_name == "24h":
+        rows = database.get_market_history(resource, hours=span // 3600)
+        return [(r['timestamp'], r['buy'], r['sell'], r['quantity']) for r in rows]
+    since = int(time.time()) - span if span else 0
+    rows = database.get_market_candles(resource, since)
+    return [(r['bucket'], r['close'], r['sell'], r['quantity']) for r in rows]
+
+
+def _render(resource: str, range_name: str, bonus: float, series) -> bytes:
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import dates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    idx = downsample.lttb([s[0] for s in series], [s[1] for s in series], MAX_POINTS)
+    points = [series[i] for i in idx]
+    times = [datetime.fromtimestamp(p[0]) for p in points]
+    adjusted = [users.adjust_prices_with_bonus(bonus, p[1], p[2]) for p in points]
+
+    # Figure без pyplot: не трогает глобальное состояние и безопасна в потоках-обработчиках
+    fig = Figure(figsize=(8, 5), dpi=100)
+    FigureCanvasAgg(fig)
+    price_ax, qty_ax = fig.subplots(2, 1, sharex=True, gridspec_kw={"height_ratios": [3, 1]})
+    price_ax.plot(times, [a[0] for a in adjusted], label="Покупка", color="tab:green", linewidth=1.2)
+    price_ax.plot(times, [a[1] for a in adjusted], label="Продажа", color="tab:red", linewidth=1.2)
+    price_ax.set_title(f"{resource} — {range_name}" + (f" (бонус ≈{bonus:.0%})" if bonus else ""))
+    price_ax.grid(alpha=0.3)
+    price_ax.legend(loc="upper left")
+    qty_ax.fill_between(times, [p[3] for p in points], step="post", alpha=0.4, color="tab:blue")
+    qty_ax.set_ylabel("Объём")
+    qty_ax.grid(alpha=0.3)
+    locator = dates.AutoDateLocator(maxticks=8)
+    qty_ax.xaxis.set_major_locator(locator)
+    qty_ax.xaxis.set_major_formatter(dates.ConciseDateFormatter(locator))
+    # Фиксированные поля вместо tight_layout (лишняя отрисовка) и быстрое сжатие PNG:
+    # картинка загружается в Telegram один раз, дальше отправляется по file_id
+    fig.subplots_adjust(left=0.09, right=0.98, top=0.94, bottom=0.08, hspace=0.08)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", pil_kwargs={"compress_level": 1})
+    return buf.getvalue()
+
+
+def get_chart(resource: str, range_name: str, bonus: float) -> Optional[Dict]:
+    """
+    Запись кэша {"png": bytes, "file_id": str|None, "key": ...} для графика или None, если данных нет.
+    Бросает ImportError без matplotlib.
+    """
+    latest = database.get_latest_market(resource)
+    if not latest:
+        return None
+    tier = bonus_tier(bonus)
+    key = (resource, range_name, tier, latest['timestamp'])
+    with _lock:
+        entry = _cache.get(key)
+        if entry:
+            _cache.move_to_end(key)
+            CACHE_HITS.inc(kind="file_id" if entry["file_id"] else "bytes")
+            return entry
+        pending = _inflight.get(key)
+        owner = pending is None
+        if owner:
+            pending = _inflight[key] = Future()
+    if not owner:
+        RENDER_WAITS.inc()
+        return pending.result()
+    try:
+        entry = _build(key, resource, range_name, tier)
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    pending.set_result(entry)
+    return entry
+
+
+def _build(key: Tuple, resource: str, range_name: str, bonus: float) -> Optional[Dict]:
+    series = _series(resource, range_name)
+    if len(series) < 2:
+        return None
+    with RENDER_DURATION.time(range=range_name):
+        png = _render(resource, range_name, bonus, series)
+    RENDERS.inc(range=range_name)
+    entry = {"png": png, "file_id": None, "key": key}
+    with _lock:
+        _cache[key] = entry
+        while len(_cache) > CACHE_MAX:
+            _cache.popitem(last=False)
+    return entry
+
+
+def remember_file_id(entry: Dict, sent) -> None:
+    """Сохраняет file_id загруженной картинки: повторная отправка не передаёт байты заново."""
+    photo = getattr(sent, "photo", None)
+    if photo:
+        with _lock:
+            entry["file_id"] = photo[-1].file_id
+
+
+def send_chart(bot, message, resource: str, range_name: str, bonus: float, caption: Optional[str] = None) -> bool:
+    """Отправляет график в ответ на message; False, если данных для графика нет."""
+    entry = get_chart(resource, range_name, bonus)
+    if entry is None:
+        return False
+    if entry["file_id"]:
+        bot.send_photo(message.chat.id, entry["file_id"], caption=caption, reply_to_message_id=message.message_id)
+        return True
+    sent = bot.send_photo(message.chat.id, io.BytesIO(entry["png"]), caption=caption,
+                          reply_to_message_id=message.message_id)
+    remember_file_id(entry, sent)
+    return True
@@ -0,0 +1,98 @@
+# chats.py
+# Настройки групповых чатов с кэшем в памяти процесса. Все изменения идут через этот модуль:
+# каждое — точечный UPSERT одной колонки (или json_patch для profit_settings) с обновлением кэша,
+# без предварительного чтения строки. TTL ограничивает устаревание, если чат меняет другой процесс.
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import database
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 60.0
+CACHE_MAX = 10000
+
+_cache: Dict[int, tuple] = {}     # chat_id -> (загружено в, настройки)
+_lock = threading.Lock()
+_clock = time.monotonic
+
+
+def get_settings(chat_id: int) -> Dict:
+    """
+    Возвращает настройки чата (копию): notify_enabled, notify_interval, pinned_message_id, no_pin, profit_settings.
+    """
+    now = _clock()
+    with _lock:
+        entry = _cache.get(chat_id)
+        if entry and now - entry[0] < CACHE_TTL:
+            return _copy(entry[1])
+    settings = database.get_chat_settings(chat_id)
+    _store(chat_id, settings, now)
+    return _copy(settings)
+
+
+def _copy(settings: Dict) -> Dict:
+    return dict(settings, profit_settings=dict(settings.get('profit_settings') or {}))
+
+
+def _store(chat_id: int, settings: Dict, loaded_at: float) -> None:
+    with _lock:
+        if len(_cache) >= CACHE_MAX and chat_id not in _cache:
+            # Вытесняем самую старую запись
+            oldest = min(_cache, key=lambda k: _cache[k][0])
+            del _cache[oldest]
+        _cache[chat_id] = (loaded_at, settings)
+
+
+def _update_cached(chat_id: int, **fields) -> None:
+    # Обновляем только уже закэшированную запись; если её нет, следующее чтение загрузит её из БД
+    with _lock:
+        entry = _cache.get(chat_id)
+        if entry:
+            entry[1].update(fields)
+
+
+def invalidate(chat_id: Optional[int] = None) -> None:
+    with _lock:
+        if chat_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(chat_id, None)
+
+
+def _set(chat_id: int, field: str, value) -> None:
+    try:
+        database.update_chat_field(chat_id, field, value)
+    except Exception:
+        invalidate(chat_id)
+        raise
+    _update_cached(chat_id, **{field: value})
+
+
+def set_notify_enabled(chat_id: int, enabled: bool) -> None:
+    _set(chat_id, "notify_enabled", bool(enabled))
+
+
+def set_interval(chat_id: int, minutes: int) -> None:
+    _set(chat_id, "notify_interval", int(minutes))
+
+
+def set_pinned_message(chat_id: int, message_id: Optional[int]) -> None:
+    _set(chat_id, "pinned_message_id", message_id)
+
+
+def set_no_pin(chat_id: int, no_pin: bool) -> None:
+    _set(chat_id, "no_pin", bool(no_pin))
+
+
+def patch_profit_settings(chat_id: int, patch: Dict) -> Dict:
+    """Сливает patch с profit_settings чата в SQL; ключи со значением None удаляются."""
+    try:
+        merged = database.patch_chat_profit_settings(chat_id, patch)
+    except Exception:
+        invalidate(chat_id)
+        raise
+    _update_cached(chat_id, profit_settings=merged)
+    return dict(merged)
@@ -0,0 +1,109 @@
+# config.py
+import os
+from dataclasses import dataclass, field
+from typing import Dict
+
+# Периоды фоновых задач по умолчанию, секунды
+DEFAULT_JOB_INTERVALS = {
+    "cleanup_expired_alerts": 600,
+    "update_dynamic_timers": 60,
+    "stale_db_reminders": 60,
+    "check_profit_alerts": 300,
+    "sync_timers": 60,
+    "sync_new_timers": 2,        # задержка таймера, созданного не у лидера
+}
+
+
+def _bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env(name: str, default, cast):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise ValueError(f"Некорректное значение переменной окружения {name}: {value!r}")
+
+
+@dataclass
+class Config:
+    """
+    Настройки процесса. Значения по умолчанию можно переопределить переменными окружения BSP_*,
+    интервал задачи — через BSP_INTERVAL_<ИМЯ_ЗАДАЧИ>, например BSP_INTERVAL_CHECK_PROFIT_ALERTS=120.
+    """
+    token: str = "YOUR_BOT_TOKEN_HERE"
+    db_path: str = "bsp.db"
+    job_intervals: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_JOB_INTERVALS))
+    job_jitter: float = 0.1      # доля интервала, на которую сдвигается каждый запуск
+    job_workers: int = 4
+    handler_workers: int = 8     # воркеры обработки апдейтов (апдейты одного чата — всегда в одном);
+                                 # в async-режиме — потоки синхронной части обработчиков
+    update_mode: str = "polling"             # polling | webhook
+    webhook_url: str = ""                    # публичный URL для setWebhook; пусто — не регистрировать
+    webhook_host: str = "127.0.0.1"
+    webhook_port: int = 8080
+    webhook_path: str = "/telegram"
+    webhook_secret: str = ""
+    webhook_reuse_port: bool = False         # SO_REUSEPORT: несколько процессов на одном порту
+    metrics_port: int = 0                    # 0 — не поднимать /metrics
+    metrics_host: str = "127.0.0.1"
+    query_trace: bool = False                # трассировка SQL (querytrace)
+    query_trace_sample: float = 1.0          # доля трассируемых запросов пользователей
+    query_slow_ms: float = 100.0
+    query_max_per_request: int = 25
+    async_mode: bool = False     # AsyncTeleBot + asyncio вместо TeleBot и потоков
+    db_threads: int = 8          # размер пула для блокирующих вызовов фоновых задач в async-режиме
+    leader_election: bool = False            # фоновые задачи и таймеры — только в процессе-лидере
+    leader_ttl: float = 15.0                 # срок аренды лидера, с
+    leader_heartbeat: float = 5.0            # период продления аренды, с
+    instance_id: str = ""                    # имя процесса в аренде; пусто — host:pid
+    price_snapshot_interval: float = 15.0    # период обновления снимка цен для inline-запросов, с
+    inline_cache_time: int = 30              # cache_time ответов на inline-запросы, с
+    ingest_window: float = 0.2               # сбор форвардов рынка в один коммит, с; 0 — писать в обработчике
+    rate_limit: bool = True                  # token bucket на дорогие команды (ratelimit.py)
+    rate_user_burst: float = 12.0            # токенов в ведре пользователя
+    rate_user_rate: float = 0.25             # пополнение ведра пользователя, токенов/с
+    rate_chat_burst: float = 30.0            # то же для группового чата
+    rate_chat_rate: float = 0.5
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        cfg = cls()
+        cfg.token = _env("BSP_TOKEN", cfg.token, str)
+        cfg.db_path = _env("BSP_DB_PATH", cfg.db_path, str)
+        cfg.job_jitter = _env("BSP_JOB_JITTER", cfg.job_jitter, float)
+        cfg.job_workers = _env("BSP_JOB_WORKERS", cfg.job_workers, int)
+        cfg.handler_workers = _env("BSP_HANDLER_WORKERS", cfg.handler_workers, int)
+        cfg.update_mode = _env("BSP_UPDATE_MODE", cfg.update_mode, str)
+        cfg.webhook_url = _env("BSP_WEBHOOK_URL", cfg.webhook_url, str)
+        cfg.webhook_host = _env("BSP_WEBHOOK_HOST", cfg.webhook_host, str)
+        cfg.webhook_port = _env("BSP_WEBHOOK_PORT", cfg.webhook_port, int)
+        cfg.webhook_path = _env("BSP_WEBHOOK_PATH", cfg.webhook_path, str)
+        cfg.webhook_secret = _env("BSP_WEBHOOK_SECRET", cfg.webhook_secret, str)
+        cfg.webhook_reuse_port = _env("BSP_WEBHOOK_REUSE_PORT", cfg.webhook_reuse_port, _bool)
+        cfg.metrics_port = _env("BSP_METRICS_PORT", cfg.metrics_port, int)
+        cfg.metrics_host = _env("BSP_METRICS_HOST", cfg.metrics_host, str)
+        cfg.query_trace = _env("BSP_QUERY_TRACE", cfg.query_trace, _bool)
+        cfg.query_trace_sample = _env("BSP_QUERY_TRACE_SAMPLE", cfg.query_trace_sample, float)
+        cfg.query_slow_ms = _env("BSP_QUERY_SLOW_MS", cfg.query_slow_ms, float)
+        cfg.query_max_per_request = _env("BSP_QUERY_MAX_PER_REQUEST", cfg.query_max_per_request, int)
+        cfg.async_mode = _env("BSP_ASYNC", cfg.async_mode, _bool)
+        cfg.db_threads = _env("BSP_DB_THREADS", cfg.db_threads, int)
+        cfg.leader_election = _env("BSP_LEADER_ELECTION", cfg.leader_election, _bool)
+        cfg.leader_ttl = _env("BSP_LEADER_TTL", cfg.leader_ttl, float)
+        cfg.leader_heartbeat = _env("BSP_LEADER_HEARTBEAT", cfg.leader_heartbeat, float)
+        cfg.instance_id = _env("BSP_INSTANCE_ID", cfg.instance_id, str)
+        cfg.price_snapshot_interval = _env("BSP_PRICE_SNAPSHOT_INTERVAL", cfg.price_snapshot_interval, float)
+        cfg.inline_cache_time = _env("BSP_INLINE_CACHE_TIME", cfg.inline_cache_time, int)
+        cfg.ingest_window = _env("BSP_INGEST_WINDOW", cfg.ingest_window, float)
+        cfg.rate_limit = _env("BSP_RATE_LIMIT", cfg.rate_limit, _bool)
+        cfg.rate_user_burst = _env("BSP_RATE_USER_BURST", cfg.rate_user_burst, float)
+        cfg.rate_user_rate = _env("BSP_RATE_USER_RATE", cfg.rate_user_rate, float)
+        cfg.rate_chat_burst = _env("BSP_RATE_CHAT_BURST", cfg.rate_chat_burst, float)
+        cfg.rate_chat_rate = _env("BSP_RATE_CHAT_RATE", cfg.rate_chat_rate, float)
+        for name, interval in cfg.job_intervals.items():
+            cfg.job_intervals[name] = _env(f"BSP_INTERVAL_{name.upper()}", interval, float)
+        return cfg
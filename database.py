@@ -5,15 +5,37 @@ from typing import List, Optional, Dict, Tuple
 import json
 from datetime import datetime
 
+import metrics
+import querytrace
+
 DB_PATH = "bsp.db"
 
+# Цены в market хранятся целыми числами: цена * PRICE_SCALE (точность 1e-6, как округление
+# нормализованных цен в market.parse_market_message). Масштаб записанных цен — в PRAGMA user_version.
+PRICE_SCALE = 1_000_000
+# Длительность свечи в market_candles, секунды
+CANDLE_PERIOD = 3600
+# Начальный справочник ресурсов (имя, эмодзи в сообщении рынка); новые ресурсы добавляются при вставке тиков
+DEFAULT_RESOURCES = [
+    ("Дерево", "🪵"),
+    ("Камень", "🪨"),
+    ("Провизия", "🍞"),
+    ("Лошади", "🐴"),
+]
+
+DB_CALLS = metrics.counter("bsp_db_calls_total", "Вызовы функций database", ["function", "status"])
+DB_DURATION = metrics.histogram("bsp_db_duration_seconds", "Длительность функций database", ["function"])
+
 def get_connection():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, factory=querytrace.connection_factory())
     conn.row_factory = sqlite3.Row
     return conn
 
 def init_db():
     conn = get_connection()
+    # WAL: читатели (экспорт, аналитика) работают со снимком и не блокируют запись, и наоборот.
+    # Режим хранится в файле БД, достаточно включить один раз.
+    conn.execute("PRAGMA journal_mode=WAL")
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -28,15 +50,15 @@ def init_db():
         )
     """)
     c.execute("""
-        CREATE TABLE IF NOT EXISTS market (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            resource TEXT,
-            buy REAL,
-            sell REAL,
-            quantity INTEGER,
-            timestamp INTEGER
+        CREATE TABLE IF NOT EXISTS resources (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            emoji TEXT
         )
     """)
+    c.executemany("INSERT OR IGNORE INTO resources (name, emoji) VALUES (?, ?)", DEFAULT_RESOURCES)
+    _migrate_market(c)
+    _create_candles(c)
     c.execute("""
         CREATE TABLE IF NOT EXISTS alerts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -80,9 +102,147 @@ def init_db():
             active INTEGER DEFAULT 1
         )
     """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    # Момент следующего напоминания; выражение должно совпадать с claim_due_*_reminders
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_reminder_due ON users (last_reminder + notify_interval * 60) WHERE notify_enabled=1")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chats_reminder_due ON chats (last_reminder + notify_interval * 60) WHERE notify_enabled=1")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_active_time ON alerts (alert_time) WHERE status='active'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_profit_alerts_active ON chat_profit_alerts (resource, threshold_price) WHERE active=1")
     conn.commit()
     conn.close()
 
+_MARKET_DDL = """
+    CREATE TABLE IF NOT EXISTS market (
+        resource_id INTEGER NOT NULL REFERENCES resources (id),
+        timestamp INTEGER NOT NULL,
+        buy INTEGER,
+        sell INTEGER,
+        quantity INTEGER,
+        PRIMARY KEY (resource_id, timestamp)
+    ) WITHOUT ROWID
+"""
+
+def _migrate_market(c):
+    """
+    Тики рынка хранятся кластеризованно по (resource_id, timestamp): диапазон по ресурсу и времени —
+    непрерывный участок B-дерева. Старая таблица (resource TEXT, цены REAL, rowid) конвертируется;
+    тики с одинаковыми ресурсом и временем схлопываются в последний вставленный.
+    """
+    columns = [r[1] for r in c.execute("PRAGMA table_info(market)").fetchall()]
+    if "resource" in columns:
+        c.execute("ALTER TABLE market RENAME TO market_old")
+        c.execute("DROP INDEX IF EXISTS idx_market_resource_ts")
+        c.execute("DROP INDEX IF EXISTS idx_market_ts")
+        c.execute(_MARKET_DDL)
+        c.execute("INSERT OR IGNORE INTO resources (name) SELECT DISTINCT resource FROM market_old WHERE resource IS NOT NULL")
+        c.execute(f"""
+            INSERT OR REPLACE INTO market (resource_id, timestamp, buy, sell, quantity)
+            SELECT r.id, o.timestamp, CAST(ROUND(o.buy * {PRICE_SCALE}) AS INTEGER),
+                   CAST(ROUND(o.sell * {PRICE_SCALE}) AS INTEGER), o.quantity
+            FROM market_old o JOIN resources r ON r.name = o.resource
+            WHERE o.timestamp IS NOT NULL
+            ORDER BY o.id
+        """)
+        c.execute("DROP TABLE market_old")
+    else:
+        c.execute(_MARKET_DDL)
+        # Таблицы с масштабом 1000 (user_version ещё не заполнялся) переводятся в текущий масштаб
+        stored = c.execute("PRAGMA user_version").fetchone()[0] or 1000
+        if stored != PRICE_SCALE:
+            _rescale_prices(c, PRICE_SCALE // stored)
+    c.execute(f"PRAGMA user_version = {PRICE_SCALE}")
+    # Чтение в прежнем виде: имя ресурса и цены с плавающей точкой
+    c.execute("DROP VIEW IF EXISTS market_v")
+    c.execute(f"""
+        CREATE VIEW market_v AS
+        SELECT r.name AS resource, m.resource_id, m.timestamp,
+               m.buy * 1.0 / {PRICE_SCALE} AS buy, m.sell * 1.0 / {PRICE_SCALE} AS sell, m.quantity
+        FROM market m JOIN resources r ON r.id = m.resource_id
+    """)
+
+def _rescale_prices(c, factor: int):
+    c.execute("UPDATE market SET buy = buy * ?, sell = sell * ?", (factor, factor))
+    if c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='market_candles'").fetchone():
+        c.execute("UPDATE market_candles SET open = open * ?1, high = high * ?1, low = low * ?1, "
+                  "close = close * ?1, sell = sell * ?1", (factor,))
+
+_CANDLE_UPSERT = f"""
+    INSERT INTO market_candles (resource_id, bucket, open, high, low, close, sell, quantity, ticks, first_ts, last_ts)
+    VALUES ((SELECT id FROM resources WHERE name = ?1), ?2 / {CANDLE_PERIOD} * {CANDLE_PERIOD}, ?3, ?3, ?3, ?3, ?4, ?5, 1, ?2, ?2)
+    ON CONFLICT (resource_id, bucket) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < first_ts THEN excluded.open ELSE open END,
+        high = max(high, excluded.high),
+        low = min(low, excluded.low),
+        close = CASE WHEN excluded.last_ts >= last_ts THEN excluded.close ELSE close END,
+        sell = CASE WHEN excluded.last_ts >= last_ts THEN excluded.sell ELSE sell END,
+        quantity = CASE WHEN excluded.last_ts >= last_ts THEN excluded.quantity ELSE quantity END,
+        ticks = ticks + 1,
+        first_ts = min(first_ts, excluded.first_ts),
+        last_ts = max(last_ts, excluded.last_ts)
+"""
+
+def _candles_from_market(where: str = "") -> str:
+    """Свечи, посчитанные заново по тикам market (where — фильтр тиков); заменяют существующие."""
+    # Первые/последние значения в часе берутся по first_ts/last_ts через оконные функции
+    return f"""
+        INSERT OR REPLACE INTO market_candles (resource_id, bucket, open, high, low, close, sell, quantity, ticks, first_ts, last_ts)
+        SELECT resource_id, bucket, open, MAX(buy), MIN(buy), close, sell, quantity, COUNT(*), MIN(timestamp), MAX(timestamp)
+        FROM (
+            SELECT resource_id, timestamp / {CANDLE_PERIOD} * {CANDLE_PERIOD} AS bucket, timestamp, buy,
+                   first_value(buy) OVER w AS open,
+                   last_value(buy) OVER w AS close,
+                   last_value(sell) OVER w AS sell,
+                   last_value(quantity) OVER w AS quantity
+            FROM market {where}
+            WINDOW w AS (PARTITION BY resource_id, timestamp / {CANDLE_PERIOD} ORDER BY timestamp
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+        )
+        GROUP BY resource_id, bucket
+    """
+
+# Свеча (ресурс, час) по тику: ?1 — имя ресурса, ?2 — timestamp тика
+_CANDLE_STALE = f"""
+    SELECT 1 FROM market_candles k
+    WHERE k.resource_id = (SELECT id FROM resources WHERE name = ?1) AND k.bucket = ?2 / {CANDLE_PERIOD} * {CANDLE_PERIOD}
+      AND k.ticks != (SELECT COUNT(*) FROM market m
+                      WHERE m.resource_id = k.resource_id AND m.timestamp >= k.bucket AND m.timestamp < k.bucket + {CANDLE_PERIOD})
+"""
+_CANDLE_REBUILD = _candles_from_market(
+    f"WHERE resource_id = (SELECT id FROM resources WHERE name = ?1) "
+    f"AND timestamp >= ?2 / {CANDLE_PERIOD} * {CANDLE_PERIOD} AND timestamp < ?2 / {CANDLE_PERIOD} * {CANDLE_PERIOD} + {CANDLE_PERIOD}")
+
+def _create_candles(c):
+    """
+    Часовые свечи по цене покупки (плюс последняя цена продажи и объём) — для длинных периодов /history.
+    Обновляются при каждой вставке тиков; при создании таблицы заполняются из market.
+    """
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='market_candles'").fetchone()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS market_candles (
+            resource_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            open INTEGER, high INTEGER, low INTEGER, close INTEGER,
+            sell INTEGER,
+            quantity INTEGER,
+            ticks INTEGER NOT NULL,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            PRIMARY KEY (resource_id, bucket)
+        ) WITHOUT ROWID
+    """)
+    if exists:
+        return
+    c.execute(_candles_from_market())
+
+def _scaled(price) -> Optional[int]:
+    return None if price is None else int(round(float(price) * PRICE_SCALE))
+
 # User functions
 def ensure_user(user_id: int, username: str):
     conn = get_connection()
@@ -106,6 +266,27 @@ def update_user_bonus(user_id: int, bonus: float):
     conn.commit()
     conn.close()
 
+def get_users_bonus(user_ids: List[int]) -> Dict[int, float]:
+    if not user_ids:
+        return {}
+    conn = get_connection()
+    c = conn.cursor()
+    ids = list(set(user_ids))
+    placeholders = ', '.join('?' * len(ids))
+    c.execute(f"SELECT id, bonus FROM users WHERE id IN ({placeholders})", ids)
+    rows = c.fetchall()
+    conn.close()
+    return {r['id']: float(r['bonus'] or 0.0) for r in rows}
+
+def get_nonzero_bonuses() -> Dict[int, float]:
+    """Бонусы всех пользователей с ненулевым бонусом (у остальных бонус 0)."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, bonus FROM users WHERE bonus != 0")
+    rows = c.fetchall()
+    conn.close()
+    return {r['id']: float(r['bonus']) for r in rows}
+
 def update_user_field(user_id: int, field: str, value):
     conn = get_connection()
     c = conn.cursor()
@@ -121,6 +302,14 @@ def get_active_alerts() -> List[Dict]:
     conn.close()
     return [dict(r) for r in rows]
 
+def count_active_alerts() -> int:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM alerts WHERE status='active'")
+    count = c.fetchone()[0]
+    conn.close()
+    return count
+
 def get_user_active_alerts(user_id: int) -> List[Dict]:
     conn = get_connection()
     c = conn.cursor()
@@ -154,6 +343,36 @@ def update_alert_fields(alert_id: int, fields: dict):
     conn.commit()
     conn.close()
 
+def apply_alert_updates(statuses: List[Tuple[int, str]], reschedules: List[Tuple[int, str, float, float]]):
+    """
+    Применяет пачку изменений алертов одной транзакцией.
+    statuses: [(alert_id, status)], reschedules: [(alert_id, alert_time, speed, current_price)]
+    """
+    if not statuses and not reschedules:
+        return
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany("UPDATE alerts SET status=? WHERE id=?", [(status, aid) for aid, status in statuses])
+    c.executemany(
+        "UPDATE alerts SET alert_time=?, speed=?, current_price=? WHERE id=?",
+        [(alert_time, speed, price, aid) for aid, alert_time, speed, price in reschedules]
+    )
+    conn.commit()
+    conn.close()
+
+def expire_active_alerts(cutoff_iso: str) -> List[int]:
+    """
+    Помечает cleanup_expired все активные алерты с alert_time раньше cutoff_iso
+    одним UPDATE; возвращает их id.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("UPDATE alerts SET status='cleanup_expired' WHERE status='active' AND alert_time < ? RETURNING id", (cutoff_iso,))
+    rows = c.fetchall()
+    conn.commit()
+    conn.close()
+    return [r[0] for r in rows]
+
 def insert_alert_record(user_id: int, resource: str, target_price: float, direction: str,
                         speed: float, current_price: float, alert_time: str, chat_id: Optional[int] = None) -> int:
     conn = get_connection()
@@ -178,25 +397,80 @@ def cancel_user_alerts(user_id: int) -> int:
     return count
 
 # Market functions
+def get_resources() -> List[Dict]:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name, emoji FROM resources ORDER BY id")
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
 def insert_market_record(resource: str, buy: float, sell: float, quantity: int, timestamp: int):
+    insert_market_records([(resource, buy, sell, quantity, timestamp)])
+
+_MARKET_INSERT = """
+    INSERT OR REPLACE INTO market (resource_id, buy, sell, quantity, timestamp)
+    VALUES ((SELECT id FROM resources WHERE name = ?), ?, ?, ?, ?)
+"""
+
+def _insert_market(conn, c, records: List[Tuple[str, float, float, int, int]]):
+    # Должно быть первым в транзакции: при неизвестном ресурсе она откатывается и повторяется
+    rows = [(res, _scaled(buy), _scaled(sell), qty, ts) for res, buy, sell, qty, ts in records]
+    try:
+        c.executemany(_MARKET_INSERT, rows)
+    except sqlite3.IntegrityError:
+        # Неизвестный ресурс (resource_id NULL): добавляем в справочник и повторяем
+        conn.rollback()
+        c.executemany("INSERT OR IGNORE INTO resources (name) VALUES (?)", [(name,) for name in {r[0] for r in records}])
+        c.executemany(_MARKET_INSERT, rows)
+    c.executemany(_CANDLE_UPSERT, [(res, ts, buy, sell, qty) for res, buy, sell, qty, ts in rows])
+    # Upsert только дописывает тик в свечу. Если INSERT OR REPLACE перезаписал уже сохранённый тик
+    # (повторный форвард, повторный импорт), число тиков свечи разойдётся с market — такую свечу пересчитываем
+    hours = {(res, ts // CANDLE_PERIOD * CANDLE_PERIOD) for res, _, _, _, ts in rows}
+    stale = [key for key in hours if c.execute(_CANDLE_STALE, key).fetchone()]
+    if stale:
+        c.executemany(_CANDLE_REBUILD, stale)
+
+def insert_market_records(records: List[Tuple[str, float, float, int, int]]):
+    """Пакетная вставка [(resource, buy, sell, quantity, timestamp)] одной транзакцией."""
+    if not records:
+        return
+    conn = get_connection()
+    c = conn.cursor()
+    _insert_market(conn, c, records)
+    conn.commit()
+    conn.close()
+
+def commit_market_batch(records: List[Tuple[str, float, float, int, int]], history: List[Tuple[int, str]]):
+    """Тики нескольких форвардов и их записи history [(timestamp, text)] — одной транзакцией."""
     conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)", (resource, buy, sell, quantity, timestamp))
+    if records:
+        _insert_market(conn, c, records)
+    c.executemany("INSERT INTO history (timestamp, text) VALUES (?, ?)", history)
     conn.commit()
     conn.close()
 
 def get_latest_market(resource: str) -> Optional[Dict]:
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM market WHERE resource=? ORDER BY timestamp DESC LIMIT 1", (resource,))
+    c.execute("SELECT * FROM market_v WHERE resource=? ORDER BY timestamp DESC LIMIT 1", (resource,))
     row = c.fetchone()
     conn.close()
     return dict(row) if row else None
 
 def get_latest_market_all() -> List[Dict]:
+    """Последний тик каждого ресурса."""
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM market ORDER BY timestamp DESC LIMIT 4")
+    c.execute(f"""
+        SELECT r.name AS resource, m.resource_id, m.timestamp,
+               m.buy * 1.0 / {PRICE_SCALE} AS buy, m.sell * 1.0 / {PRICE_SCALE} AS sell, m.quantity
+        FROM resources r
+        JOIN market m ON m.resource_id = r.id
+         AND m.timestamp = (SELECT MAX(timestamp) FROM market WHERE resource_id = r.id)
+        ORDER BY r.id
+    """)
     rows = c.fetchall()
     conn.close()
     return [dict(r) for r in rows]
@@ -205,16 +479,55 @@ def get_recent_market(resource: str, minutes: int = 15) -> List[Dict]:
     cutoff = int(time.time()) - minutes * 60
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM market WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
+    c.execute("SELECT * FROM market_v WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
     rows = c.fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+def get_recent_market_all(minutes: int = 15) -> Dict[str, List[Dict]]:
+    """
+    Окно последних тиков сразу по всем ресурсам одним запросом:
+    {resource: [records по возрастанию timestamp]}
+    """
+    cutoff = int(time.time()) - minutes * 60
+    conn = get_connection()
+    c = conn.cursor()
+    # Один диапазон первичного ключа на ресурс (CROSS JOIN фиксирует порядок: сначала справочник)
+    c.execute(f"""
+        SELECT r.name AS resource, m.resource_id, m.timestamp,
+               m.buy * 1.0 / {PRICE_SCALE} AS buy, m.sell * 1.0 / {PRICE_SCALE} AS sell, m.quantity
+        FROM resources r CROSS JOIN market m
+        WHERE m.resource_id = r.id AND m.timestamp >= ?
+        ORDER BY r.id, m.timestamp ASC
+    """, (cutoff,))
+    rows = c.fetchall()
+    conn.close()
+    grouped: Dict[str, List[Dict]] = {}
+    for r in rows:
+        grouped.setdefault(r['resource'], []).append(dict(r))
+    return grouped
+
 def get_market_history(resource: str, hours: int = 24) -> List[Dict]:
     cutoff = int(time.time()) - hours * 3600
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM market WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
+    c.execute("SELECT * FROM market_v WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def get_market_candles(resource: str, since_ts: int = 0) -> List[Dict]:
+    """Часовые свечи ресурса начиная с since_ts: [{bucket, open, high, low, close, sell, quantity}] по возрастанию."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT m.bucket, m.open * 1.0 / {PRICE_SCALE} AS open, m.high * 1.0 / {PRICE_SCALE} AS high,
+               m.low * 1.0 / {PRICE_SCALE} AS low, m.close * 1.0 / {PRICE_SCALE} AS close,
+               m.sell * 1.0 / {PRICE_SCALE} AS sell, m.quantity
+        FROM resources r JOIN market_candles m ON m.resource_id = r.id
+        WHERE r.name = ? AND m.bucket >= ?
+        ORDER BY m.bucket ASC
+    """, (resource, since_ts))
     rows = c.fetchall()
     conn.close()
     return [dict(r) for r in rows]
@@ -222,7 +535,7 @@ def get_market_history(resource: str, hours: int = 24) -> List[Dict]:
 def get_market_week_range(resource: str, price_field: str, week_start: int) -> Tuple[float, float]:
     conn = get_connection()
     c = conn.cursor()
-    c.execute(f"SELECT MIN({price_field}) as minp, MAX({price_field}) as maxp FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
+    c.execute(f"SELECT MIN({price_field}) as minp, MAX({price_field}) as maxp FROM market_v WHERE resource=? AND timestamp>=?", (resource, week_start))
     row = c.fetchone()
     conn.close()
     return (row['minp'], row['maxp']) if row else (0, 0)
@@ -230,7 +543,7 @@ def get_market_week_range(resource: str, price_field: str, week_start: int) -> T
 def get_market_week_max_price(resource: str, price_field: str, week_start: int) -> float:
     conn = get_connection()
     c = conn.cursor()
-    c.execute(f"SELECT MAX({price_field}) as maxp FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
+    c.execute(f"SELECT MAX({price_field}) as maxp FROM market_v WHERE resource=? AND timestamp>=?", (resource, week_start))
     row = c.fetchone()
     conn.close()
     return row['maxp'] if row and row['maxp'] is not None else 0.0
@@ -238,7 +551,7 @@ def get_market_week_max_price(resource: str, price_field: str, week_start: int)
 def get_market_week_max_qty(resource: str, week_start: int) -> int:
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT MAX(quantity) as maxq FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
+    c.execute("SELECT MAX(quantity) as maxq FROM market_v WHERE resource=? AND timestamp>=?", (resource, week_start))
     row = c.fetchone()
     conn.close()
     return row['maxq'] if row and row['maxq'] else 0
@@ -246,7 +559,8 @@ def get_market_week_max_qty(resource: str, week_start: int) -> int:
 def get_global_latest_timestamp() -> Optional[int]:
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT MAX(timestamp) as ts FROM market")
+    # Максимум по последним тикам ресурсов: по одному спуску по первичному ключу на ресурс
+    c.execute("SELECT MAX((SELECT MAX(timestamp) FROM market WHERE resource_id = r.id)) as ts FROM resources r")
     row = c.fetchone()
     conn.close()
     return row['ts'] if row and row['ts'] else None
@@ -282,6 +596,36 @@ def set_chat_last_reminder(chat_id: int, ts: int):
     conn.commit()
     conn.close()
 
+def claim_due_user_reminders(now_ts: int) -> List[int]:
+    """
+    Одним UPDATE отмечает напоминание всем пользователям, у которых оно просрочено,
+    и возвращает их id.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        UPDATE users SET last_reminder=?
+        WHERE notify_enabled=1 AND last_reminder + notify_interval * 60 <= ?
+        RETURNING id
+    """, (now_ts, now_ts))
+    rows = c.fetchall()
+    conn.commit()
+    conn.close()
+    return [r[0] for r in rows]
+
+def claim_due_chat_reminders(now_ts: int) -> List[int]:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        UPDATE chats SET last_reminder=?
+        WHERE notify_enabled=1 AND last_reminder + notify_interval * 60 <= ?
+        RETURNING chat_id
+    """, (now_ts, now_ts))
+    rows = c.fetchall()
+    conn.commit()
+    conn.close()
+    return [r[0] for r in rows]
+
 def get_user_push_settings(user_id: int) -> Dict:
     conn = get_connection()
     c = conn.cursor()
@@ -302,6 +646,17 @@ def update_user_push_settings(user_id: int, enabled: bool = None, interval: int
     conn.commit()
     conn.close()
 
+CHAT_DEFAULTS = {"notify_enabled": True, "notify_interval": 15, "pinned_message_id": None, "no_pin": False, "profit_settings": {}}
+# Колонки chats, которые можно менять по одной (update_chat_field)
+CHAT_FIELDS = ("notify_enabled", "notify_interval", "pinned_message_id", "no_pin")
+
+def _chat_row(row) -> Dict:
+    d = dict(row)
+    d['notify_enabled'] = bool(d['notify_enabled'])
+    d['no_pin'] = bool(d['no_pin'])
+    d['profit_settings'] = json.loads(d['profit_settings'] or '{}')
+    return d
+
 def get_chat_settings(chat_id: int) -> Dict:
     conn = get_connection()
     c = conn.cursor()
@@ -309,37 +664,61 @@ def get_chat_settings(chat_id: int) -> Dict:
     row = c.fetchone()
     conn.close()
     if row:
-        d = dict(row)
-        d['notify_enabled'] = bool(d['notify_enabled'])
-        d['profit_settings'] = json.loads(d['profit_settings'])
-        return d
-    return {"notify_enabled": True, "notify_interval": 15, "pinned_message_id": None, "no_pin": False, "profit_settings": {}}
+        return _chat_row(row)
+    return dict(CHAT_DEFAULTS, chat_id=chat_id, profit_settings={})
 
 def upsert_chat_settings(chat_id: int, notify_enabled: bool, interval: int, pinned_message_id: int = None, no_pin: bool = None, profit_settings: dict = None):
+    """Перезаписывает настройки чата целиком; profit_settings сливается с сохранёнными в SQL (json_patch)."""
     conn = get_connection()
     c = conn.cursor()
-    current = get_chat_settings(chat_id)
-    new_ps = json.dumps(current['profit_settings'] | (profit_settings or {}))
     c.execute("""
-        INSERT INTO chats (chat_id, notify_enabled, notify_interval, pinned_message_id, no_pin, profit_settings) 
-        VALUES (?, ?, ?, ?, ?, ?) 
-        ON CONFLICT(chat_id) DO UPDATE SET 
-        notify_enabled=excluded.notify_enabled, 
-        notify_interval=excluded.notify_interval, 
+        INSERT INTO chats (chat_id, notify_enabled, notify_interval, pinned_message_id, no_pin, profit_settings)
+        VALUES (?, ?, ?, ?, ?, json(?))
+        ON CONFLICT(chat_id) DO UPDATE SET
+        notify_enabled=excluded.notify_enabled,
+        notify_interval=excluded.notify_interval,
         pinned_message_id=excluded.pinned_message_id,
         no_pin=excluded.no_pin,
-        profit_settings=excluded.profit_settings
-    """, (chat_id, 1 if notify_enabled else 0, interval, pinned_message_id, 1 if no_pin else 0, new_ps))
+        profit_settings=json_patch(chats.profit_settings, excluded.profit_settings)
+    """, (chat_id, 1 if notify_enabled else 0, interval, pinned_message_id, 1 if no_pin else 0, json.dumps(profit_settings or {})))
     conn.commit()
     conn.close()
 
-def set_chat_no_pin(chat_id: int, no_pin: bool):
+def update_chat_field(chat_id: int, field: str, value):
+    """Меняет одну колонку настроек чата одним UPSERT, не трогая остальные."""
+    if field not in CHAT_FIELDS:
+        raise ValueError(f"Неизвестное поле настроек чата: {field}")
+    if isinstance(value, bool):
+        value = int(value)
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE chats SET no_pin=? WHERE chat_id=?", (1 if no_pin else 0, chat_id))
+    c.execute(f"""
+        INSERT INTO chats (chat_id, {field}) VALUES (?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET {field}=excluded.{field}
+    """, (chat_id, value))
     conn.commit()
     conn.close()
 
+def patch_chat_profit_settings(chat_id: int, patch: dict) -> Dict:
+    """
+    Сливает patch с profit_settings чата в SQL (json_patch, RFC 7396: ключ со значением None удаляется)
+    и возвращает итоговый словарь.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO chats (chat_id, profit_settings) VALUES (?, json(?))
+        ON CONFLICT(chat_id) DO UPDATE SET profit_settings=json_patch(chats.profit_settings, excluded.profit_settings)
+        RETURNING profit_settings
+    """, (chat_id, json.dumps(patch)))
+    row = c.fetchone()
+    conn.commit()
+    conn.close()
+    return json.loads(row[0])
+
+def set_chat_no_pin(chat_id: int, no_pin: bool):
+    update_chat_field(chat_id, "no_pin", no_pin)
+
 def unpin_all_messages(chat_id: int):
     # Placeholder: in real, use bot.unpin_chat_message
     pass
@@ -367,6 +746,39 @@ def deactivate_profit_alert(chat_id: int, resource: str):
     conn.commit()
     conn.close()
 
+def get_triggered_profit_alerts() -> List[Dict]:
+    """
+    Активные алерты чатов, условия которых выполнены по последней цене ресурса.
+    Последний тик ищется по первичному ключу market один раз на ресурс из справочника,
+    алерты — диапазоном по threshold_price, так что стоимость зависит от числа сработавших.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"""
+        WITH latest AS (
+            SELECT r.name AS resource, m.buy * 1.0 / {PRICE_SCALE} AS buy, m.quantity
+            FROM resources r
+            JOIN market m ON m.resource_id = r.id
+             AND m.timestamp = (SELECT MAX(timestamp) FROM market WHERE resource_id = r.id)
+        )
+        SELECT a.id, a.chat_id, a.resource, a.threshold_price, a.min_quantity, l.buy, l.quantity
+        FROM latest l
+        JOIN chat_profit_alerts a ON a.resource = l.resource
+        WHERE a.active = 1 AND a.threshold_price >= l.buy AND a.min_quantity <= l.quantity
+    """)
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def deactivate_profit_alerts(alert_ids: List[int]):
+    if not alert_ids:
+        return
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany("UPDATE chat_profit_alerts SET active=0 WHERE id=?", [(aid,) for aid in alert_ids])
+    conn.commit()
+    conn.close()
+
 # Other
 def get_bot_stats() -> Dict:
     # Legacy, but keep for compatibility
@@ -375,7 +787,7 @@ def get_bot_stats() -> Dict:
     stats = {}
     c.execute("SELECT COUNT(*) as cnt FROM users")
     stats['users'] = c.fetchone()['cnt']
-    c.execute("SELECT COUNT(DISTINCT resource) as cnt FROM market")
+    c.execute("SELECT COUNT(*) as cnt FROM resources r WHERE EXISTS (SELECT 1 FROM market WHERE resource_id = r.id)")
     stats['resources'] = c.fetchone()['cnt']
     conn.close()
     return stats
@@ -388,4 +800,92 @@ def get_bot_history(limit: int = 20) -> List[Dict]:
     conn.close()
     return [dict(r) for r in rows]
 
-init_db()
\ No newline at end of file
+# Lease functions (выбор лидера между процессами)
+def acquire_lease(name: str, holder: str, ttl: float, now: float) -> bool:
+    """
+    Захватывает или продлевает аренду name для holder на ttl секунд.
+    Успешно, если аренды нет, она уже наша или истекла; проверка и запись — один атомарный UPSERT.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+        WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        RETURNING holder
+    """, (name, holder, now + ttl, now))
+    row = c.fetchone()
+    conn.commit()
+    conn.close()
+    return row is not None
+
+def release_lease(name: str, holder: str):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+    conn.commit()
+    conn.close()
+
+def get_lease(name: str) -> Optional[Dict]:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT * FROM leases WHERE name=?", (name,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def get_alerts_due_before(alert_time_iso: str) -> List[Dict]:
+    """Активные алерты со временем срабатывания до alert_time_iso (индекс idx_alerts_active_time)."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, alert_time FROM alerts WHERE status='active' AND alert_time < ?", (alert_time_iso,))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def get_max_alert_id() -> int:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT MAX(id) FROM alerts")
+    row = c.fetchone()
+    conn.close()
+    return row[0] or 0
+
+def get_alerts_created_after(alert_id: int) -> List[Dict]:
+    """Алерты с id больше alert_id (по первичному ключу), по возрастанию id."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, alert_time, status FROM alerts WHERE id > ? ORDER BY id", (alert_id,))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def compact():
+    """Обновляет статистику планировщика и пересобирает файл БД (VACUUM) — для обслуживания."""
+    conn = get_connection()
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+
+def snapshot_connection() -> sqlite3.Connection:
+    """
+    Отдельное соединение только для чтения с открытой транзакцией: все запросы в нём видят
+    один согласованный снимок БД (в режиме WAL писатели при этом не блокируются).
+    Транзакцию завершает conn.close().
+    """
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("BEGIN")
+    # Снимок фиксируется первым чтением
+    conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+    return conn
+
+def _instrument_functions():
+    # Оборачиваем все публичные функции модуля счётчиком вызовов и гистограммой длительности
+    for name, fn in list(globals().items()):
+        if name.startswith("_") or name in ("get_connection", "init_db", "snapshot_connection"):
+            continue
+        if callable(fn) and getattr(fn, "__module__", None) == __name__:
+            globals()[name] = metrics.instrumented(DB_CALLS, DB_DURATION, function=name)(fn)
+
+_instrument_functions()
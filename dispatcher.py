@@ -0,0 +1,328 @@
+# dispatcher.py
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SENDS = metrics.counter("bsp_send_total", "Исходящие сообщения по результату", ["result"])
+SEND_DURATION = metrics.histogram("bsp_send_duration_seconds", "Длительность вызова send_message")
+
+# Лимиты Telegram Bot API
+GLOBAL_RATE = 30.0          # сообщений в секунду на бота
+CHAT_RATE = 1.0             # сообщений в секунду в личный чат
+GROUP_RATE = 20.0 / 60.0    # сообщений в секунду в группу
+GROUP_BURST = 3
+
+WORKERS = 4
+MAX_QUEUE = 10000
+MAX_RETRIES = 5
+MAX_BACKOFF = 60.0
+
+COALESCE_WINDOW = 1.0       # секунд на сбор уведомлений в один чат
+MAX_MESSAGE_LEN = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """
+    Простое ведро токенов: rate токенов в секунду, не более capacity.
+    Может быть заблокировано до момента blocked_until (например, после 429 retry_after).
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 — можно отправлять сейчас)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "parts", "kwargs", "attempts", "enqueued_at")
+
+    def __init__(self, chat_id: int, text: str, kwargs: dict, now: float):
+        self.chat_id = chat_id
+        self.parts = [text]
+        self.kwargs = kwargs
+        self.attempts = 0
+        self.enqueued_at = now
+
+    @property
+    def text(self) -> str:
+        return COALESCE_SEPARATOR.join(self.parts)
+
+    def can_merge(self, text: str) -> bool:
+        return len(self.text) + len(COALESCE_SEPARATOR) + len(text) <= MAX_MESSAGE_LEN
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    result_json = getattr(exc, "result_json", None) or {}
+    params = result_json.get("parameters") or {}
+    value = params.get("retry_after")
+    return float(value) if value is not None else None
+
+
+class MessageDispatcher:
+    """
+    Очередь исходящих сообщений с пулом воркеров.
+    Соблюдает глобальный лимит, лимит на личный чат и на группу,
+    повторяет отправку после 429 (retry_after) и временных ошибок с экспоненциальной задержкой.
+    Уведомления через notify() собираются по чату в течение coalesce_window и уходят одним сообщением.
+    bot — любой объект с методом send_message(chat_id, text, **kwargs).
+    """
+
+    def __init__(self, bot, workers: int = WORKERS, global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE, group_rate: float = GROUP_RATE,
+                 max_queue: int = MAX_QUEUE, max_retries: int = MAX_RETRIES,
+                 coalesce_window: float = COALESCE_WINDOW, clock=time.monotonic):
+        self.bot = bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.coalesce_window = coalesce_window
+        self.clock = clock
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._chats: Dict[int, TokenBucket] = {}
+        # Ещё не отправленные уведомления, к которым можно дописывать: chat_id -> _Outgoing
+        self._open: Dict[int, _Outgoing] = {}
+        self._threads = []
+        self._running = False
+        self._in_flight = 0
+        self._counters = {"enqueued": 0, "sent": 0, "retried": 0, "rate_limited": 0, "coalesced": 0,
+                          "dropped_queue_full": 0, "dropped_failed": 0}
+
+    # --- публичный API ---
+
+    def start(self) -> "MessageDispatcher":
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"dispatcher-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Досылает очередь (не дольше timeout) и останавливает воркеров. Открытые уведомления уходят сразу,
+        не дожидаясь окна объединения; новые notify() после этого тоже не ждут окна.
+        """
+        with self._cond:
+            running = self._running
+            if running:
+                now = self.clock()
+                self.coalesce_window = 0.0
+                self._heap = [(min(ready_at, now) if self._open.get(item.chat_id) is item else ready_at, seq, item)
+                              for ready_at, seq, item in self._heap]
+                heapq.heapify(self._heap)
+                self._cond.notify_all()
+        if running and not self.join(timeout):
+            logger.warning(f"Не все сообщения отправлены до остановки: в очереди {self.metrics()['queue_depth']}")
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Ставит сообщение в очередь. Возвращает False, если очередь переполнена."""
+        now = self.clock()
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                self._counters["dropped_queue_full"] += 1
+                SENDS.inc(result="queue_full")
+                logger.warning(f"Очередь отправки переполнена, сообщение в {chat_id} отброшено")
+                return False
+            self._push(now, _Outgoing(chat_id, text, kwargs, now))
+            self._counters["enqueued"] += 1
+            return True
+
+    def notify(self, chat_id: int, text: str) -> bool:
+        """
+        Ставит уведомление в очередь с объединением: всё, что придёт в тот же чат
+        до фактической отправки (не раньше чем через coalesce_window), уйдёт одним сообщением.
+        """
+        now = self.clock()
+        with self._cond:
+            pending = self._open.get(chat_id)
+            if pending is not None and pending.can_merge(text):
+                pending.parts.append(text)
+                self._counters["coalesced"] += 1
+                return True
+            if len(self._heap) >= self.max_queue:
+                self._counters["dropped_queue_full"] += 1
+                SENDS.inc(result="queue_full")
+                logger.warning(f"Очередь отправки переполнена, уведомление в {chat_id} отброшено")
+                return False
+            item = _Outgoing(chat_id, text, {}, now)
+            self._open[chat_id] = item
+            self._push(now + self.coalesce_window, item)
+            self._counters["enqueued"] += 1
+            return True
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт, пока очередь опустеет и все отправки завершатся."""
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            while self._heap or self._in_flight:
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+            return True
+
+    def metrics(self) -> Dict[str, int]:
+        with self._cond:
+            m = dict(self._counters)
+            m["queue_depth"] = len(self._heap)
+            m["in_flight"] = self._in_flight
+            return m
+
+    # --- внутреннее ---
+
+    def _push(self, ready_at: float, item: _Outgoing) -> None:
+        heapq.heappush(self._heap, (ready_at, next(self._seq), item))
+        self._cond.notify()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            # Отрицательные id — группы и каналы
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, GROUP_BURST, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, 1, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _next_item(self) -> Optional[_Outgoing]:
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                now = self.clock()
+                ready_at = self._heap[0][0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                _, _, item = heapq.heappop(self._heap)
+                chat_bucket = self._chat_bucket(item.chat_id, now)
+                wait = max(self._global.wait_time(now), chat_bucket.wait_time(now))
+                if wait > 0:
+                    self._push(now + wait, item)
+                    continue
+                self._global.consume(now)
+                chat_bucket.consume(now)
+                if self._open.get(item.chat_id) is item:
+                    del self._open[item.chat_id]
+                self._in_flight += 1
+                return item
+            return None
+
+    def _worker(self) -> None:
+        while True:
+            item = self._next_item()
+            if item is None:
+                return
+            try:
+                self._deliver(item)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, item: _Outgoing) -> None:
+        started = time.perf_counter()
+        try:
+            self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+            with self._cond:
+                self._counters["sent"] += 1
+            SENDS.inc(result="sent")
+            return
+        except Exception as e:
+            error = e
+        finally:
+            SEND_DURATION.observe(time.perf_counter() - started)
+
+        item.attempts += 1
+        now = self.clock()
+        retry_after = _retry_after(error)
+        code = getattr(error, "error_code", None)
+        with self._cond:
+            if retry_after is not None:
+                # 429: ждём сколько просит Telegram, и не шлём в этот чат до истечения паузы
+                self._counters["rate_limited"] += 1
+                SENDS.inc(result="rate_limited")
+                self._chat_bucket(item.chat_id, now).block(now + retry_after)
+                if item.attempts <= self.max_retries:
+                    self._counters["retried"] += 1
+                    self._push(now + retry_after, item)
+                    return
+            elif (code is None or code >= 500) and item.attempts <= self.max_retries:
+                backoff = min(MAX_BACKOFF, 2 ** (item.attempts - 1)) * (0.5 + random.random() / 2)
+                self._counters["retried"] += 1
+                SENDS.inc(result="retry")
+                self._push(now + backoff, item)
+                return
+            self._counters["dropped_failed"] += 1
+            SENDS.inc(result="dropped")
+        logger.warning(f"Не удалось отправить сообщение в {item.chat_id} (попыток: {item.attempts}): {error}")
+
+
+_dispatchers: Dict[int, MessageDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def for_bot(bot) -> MessageDispatcher:
+    """Возвращает (и при первом обращении запускает) общий диспетчер для данного бота."""
+    # Фасады одного бота (aio.DeferredBot) пользуются его диспетчером
+    bot = getattr(bot, "base_bot", bot)
+    with _dispatchers_lock:
+        d = _dispatchers.get(id(bot))
+        if d is None:
+            d = MessageDispatcher(bot).start()
+            _dispatchers[id(bot)] = d
+        return d
@@ -0,0 +1,76 @@
+# downsample.py
+# Largest-Triangle-Three-Buckets: прореживание ряда до n точек с сохранением формы (пики и провалы).
+# С numpy площади треугольников считаются векторно внутри каждой корзины, средние соседних
+# корзин — по префиксным суммам; без numpy работает тот же алгоритм на чистом Python.
+from typing import List, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен
+    np = None
+
+
+def lttb(x: Sequence[float], y: Sequence[float], n: int) -> List[int]:
+    """
+    Индексы n опорных точек ряда (x по возрастанию). Первая и последняя точки сохраняются всегда.
+    Если точек не больше n, возвращаются все.
+    """
+    size = len(x)
+    if len(y) != size:
+        raise ValueError("x и y должны быть одной длины")
+    if n >= size:
+        return list(range(size))
+    if n < 3:
+        return [0, size - 1][:max(n, 0)]
+    if np is not None:
+        return _lttb_numpy(np.asarray(x, dtype=float), np.asarray(y, dtype=float), n).tolist()
+    return _lttb_python([float(v) for v in x], [float(v) for v in y], n)
+
+
+def _edges(size: int, n: int) -> List[int]:
+    # Границы n-2 внутренних корзин на точках 1..size-2; шаг >= 1, поэтому корзины непустые
+    step = (size - 2) / (n - 2)
+    return [1 + int(i * step) for i in range(n - 2)] + [size - 1]
+
+
+def _lttb_numpy(x, y, n: int):
+    size = len(x)
+    edges = _edges(size, n)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (hi, edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        avg_x = (cx[nhi] - cx[nlo]) / (nhi - nlo)
+        avg_y = (cy[nhi] - cy[nlo]) / (nhi - nlo)
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - avg_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y - ay))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def _lttb_python(x: List[float], y: List[float], n: int) -> List[int]:
+    size = len(x)
+    edges = _edges(size, n)
+    out = [0]
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (hi, edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        count = nhi - nlo
+        avg_x = sum(x[nlo:nhi]) / count
+        avg_y = sum(y[nlo:nhi]) / count
+        ax, ay = x[a], y[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        out.append(a)
+    out.append(size - 1)
+    return out
@@ -0,0 +1,175 @@
+# export.py
+# Потоковая выгрузка market, часовых свечей и alerts в CSV или Parquet для аналитики.
+# Строки читаются курсором порциями по fetchmany и сразу пишутся в файл, так что память
+# не зависит от размера таблицы. Все таблицы одной выгрузки читаются из одного снимка
+# (отдельное read-only соединение с открытой транзакцией): в режиме WAL бот продолжает писать,
+# а выгрузка видит БД на момент начала. Пока снимок открыт, checkpoint не может урезать WAL-файл.
+import csv
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import database
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow нужен только для Parquet
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000
+FORMATS = ("csv", "parquet")
+
+
+class Table(NamedTuple):
+    select: str                         # SELECT ... FROM ... без WHERE/ORDER BY
+    columns: List[Tuple[str, str]]      # (имя, тип: int | float | str)
+    time_column: str                    # колонка фильтра по времени
+    time_iso: bool                      # время хранится ISO-строкой, а не unix timestamp
+    resource_column: str
+    order: str                          # порядок по первичному ключу — без сортировки в SQLite
+
+
+_SCALE = f"1.0 / {database.PRICE_SCALE}"
+
+TABLES: Dict[str, Table] = {
+    "market": Table(
+        f"SELECT r.name, m.timestamp, m.buy * {_SCALE}, m.sell * {_SCALE}, m.quantity "
+        "FROM market m JOIN resources r ON r.id = m.resource_id",
+        [("resource", "str"), ("timestamp", "int"), ("buy", "float"), ("sell", "float"), ("quantity", "int")],
+        "m.timestamp", False, "r.name", "m.resource_id, m.timestamp"),
+    "candles": Table(
+        f"SELECT r.name, c.bucket, c.open * {_SCALE}, c.high * {_SCALE}, c.low * {_SCALE}, c.close * {_SCALE}, "
+        f"c.sell * {_SCALE}, c.quantity, c.ticks FROM market_candles c JOIN resources r ON r.id = c.resource_id",
+        [("resource", "str"), ("bucket", "int"), ("open", "float"), ("high", "float"), ("low", "float"),
+         ("close", "float"), ("sell", "float"), ("quantity", "int"), ("ticks", "int")],
+        "c.bucket", False, "r.name", "c.resource_id, c.bucket"),
+    "alerts": Table(
+        "SELECT id, user_id, resource, target_price, direction, speed, current_price, alert_time, status, "
+        "created_at, chat_id FROM alerts",
+        [("id", "int"), ("user_id", "int"), ("resource", "str"), ("target_price", "float"), ("direction", "str"),
+         ("speed", "float"), ("current_price", "float"), ("alert_time", "str"), ("status", "str"),
+         ("created_at", "str"), ("chat_id", "int")],
+        "created_at", True, "resource", "id"),
+}
+
+
+@contextmanager
+def snapshot():
+    """Соединение с согласованным снимком БД; транзакция закрывается на выходе."""
+    conn = database.snapshot_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _query(table: Table, since: Optional[int], until: Optional[int],
+           resources: Optional[Sequence[str]]) -> Tuple[str, list]:
+    where, params = [], []
+    if since is not None:
+        where.append(f"{table.time_column} >= ?")
+        params.append(datetime.fromtimestamp(since).isoformat() if table.time_iso else since)
+    if until is not None:
+        where.append(f"{table.time_column} < ?")
+        params.append(datetime.fromtimestamp(until).isoformat() if table.time_iso else until)
+    if resources:
+        where.append(f"{table.resource_column} IN ({', '.join('?' * len(resources))})")
+        params.extend(resources)
+    sql = table.select
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return f"{sql} ORDER BY {table.order}", params
+
+
+def iter_chunks(conn, name: str, since: Optional[int] = None, until: Optional[int] = None,
+                resources: Optional[Sequence[str]] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[List[tuple]]:
+    """
+    Порции строк таблицы name (кортежи в порядке TABLES[name].columns).
+    since/until — unix timestamp, интервал [since, until); resources — имена ресурсов.
+    """
+    table = TABLES[name]
+    sql, params = _query(table, since, until, resources)
+    cur = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cur.close()
+
+
+def write_csv(chunks: Iterator[List[tuple]], columns: List[Tuple[str, str]], out) -> int:
+    writer = csv.writer(out)
+    writer.writerow([c[0] for c in columns])
+    total = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        total += len(rows)
+    return total
+
+
+_ARROW_TYPES = {"int": "int64", "float": "float64", "str": "string"}
+
+
+def write_parquet(chunks: Iterator[List[tuple]], columns: List[Tuple[str, str]], path: str) -> int:
+    """Каждая порция — отдельная row group; схема задана заранее, поэтому пустая выгрузка тоже валидна."""
+    if pa is None:
+        raise RuntimeError("Для Parquet нужен pyarrow: pip install pyarrow")
+    schema = pa.schema([(name, getattr(pa, _ARROW_TYPES[kind])()) for name, kind in columns])
+    total = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            total += len(rows)
+    return total
+
+
+def export_table(conn, name: str, path: str, fmt: str = "csv", since: Optional[int] = None,
+                 until: Optional[int] = None, resources: Optional[Sequence[str]] = None,
+                 chunk_size: int = CHUNK_SIZE) -> int:
+    """Пишет таблицу name в path ("-" — stdout, только CSV); возвращает число строк."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}, ожидается один из {FORMATS}")
+    chunks = iter_chunks(conn, name, since, until, resources, chunk_size)
+    columns = TABLES[name].columns
+    if fmt == "parquet":
+        if path == "-":
+            raise ValueError("Parquet нельзя писать в stdout")
+        return write_parquet(chunks, columns, path)
+    if path == "-":
+        return write_csv(chunks, columns, sys.stdout)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        return write_csv(chunks, columns, f)
+
+
+def export(names: Sequence[str], out: str, fmt: str = "csv", since: Optional[int] = None,
+           until: Optional[int] = None, resources: Optional[Sequence[str]] = None,
+           chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Выгружает таблицы names из одного снимка в каталог out как <таблица>.<fmt>
+    (out="-" — одна таблица в stdout). Возвращает {таблица: число строк}.
+    """
+    unknown = [n for n in names if n not in TABLES]
+    if unknown:
+        raise ValueError(f"Неизвестные таблицы: {', '.join(unknown)}")
+    if out == "-" and len(names) != 1:
+        raise ValueError("В stdout можно выгрузить только одну таблицу")
+    if out != "-":
+        os.makedirs(out, exist_ok=True)
+    counts = {}
+    with snapshot() as conn:
+        for name in names:
+            path = out if out == "-" else os.path.join(out, f"{name}.{fmt}")
+            counts[name] = export_table(conn, name, path, fmt, since, until, resources, chunk_size)
+            logger.info(f"Выгружено {name}: {counts[name]} строк")
+    return counts
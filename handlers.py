@@ -0,0 +1,371 @@
+# handlers.py
+# Логика обработчиков команд, общая для синхронного (TeleBot) и асинхронного (AsyncTeleBot) режимов.
+# Каждый обработчик принимает (bot, update); bot — TeleBot или синхронный адаптер из aio.py.
+import functools
+import logging
+import time
+from datetime import datetime
+
+from telebot import types
+
+import alerts
+import charts
+import chats
+import database
+import downsample
+import ingest
+import market
+import metrics
+import prices
+import querytrace
+import ratelimit
+import users
+
+logger = logging.getLogger(__name__)
+
+HANDLER_CALLS = metrics.counter("bsp_handler_requests_total", "Вызовы обработчиков", ["handler", "status"])
+HANDLER_DURATION = metrics.histogram("bsp_handler_duration_seconds", "Длительность обработчиков", ["handler"])
+
+
+def cmd_start(bot, message):
+    users.ensure_user(message.from_user.id, message.from_user.username)
+    welcome = f"Привет, @{message.from_user.username}! Бот BS Market Analytics запущен.\n\nДоступные команды:\n/stat - Статистика\n/history [ресурс] - История\n/chart [ресурс] - График\n/status - Ваши алерты\n/cancel - Отмена алертов\n/settings - Бонусы\n/push - Настройка уведомлений"
+    bot.reply_to(message, welcome)
+
+def cmd_help(bot, message):
+    alerts.cmd_help_handler(bot, message)
+
+def cmd_stat(bot, message):
+    user_id = message.from_user.id
+    bonus_pct = int(users.get_user_bonus(user_id) * 100)
+    now = datetime.now()
+    global_ts = database.get_global_latest_timestamp()
+    update_str = datetime.fromtimestamp(global_ts).strftime("%d.%m.%Y %H:%M") if global_ts else "Неизвестно"
+
+    resources = market.resource_names()
+    emoji = market.resource_emoji()
+    reply = f"📊 Текущая статистика рынка\n🕗 Обновлено: {update_str}\n🔃 Бонус игрока: {bonus_pct}%\n──────────────────────\n"
+    week_start = int(time.time()) - 7*24*3600
+
+    for res in resources:
+        pred_buy, pred_sell, trend, speed, last_ts = market.compute_extrapolated_price(res, user_id)
+        if pred_buy is None:
+            continue
+        last_update_str = datetime.fromtimestamp(last_ts).strftime("%H:%M") if last_ts else "N/A"
+        was_buy = database.get_market_week_max_price(res, 'buy', week_start)
+        was_sell = database.get_market_week_max_price(res, 'sell', week_start)
+        was_buy_adj, was_sell_adj = users.adjust_prices_for_user(user_id, was_buy, was_sell)
+        buy_range = database.get_market_week_range(res, 'buy', week_start)
+        sell_range = database.get_market_week_range(res, 'sell', week_start)
+        max_qty = database.get_market_week_max_qty(res, week_start)
+        trend_emoji = "📈" if trend == "up" else "📉" if trend == "down" else "➖"
+        speed_str = f"{speed:+.4f}/мин" if speed else "0"
+        reply += f"{emoji.get(res, '')} {res}\n"
+        reply += f"├ 🕒 Последнее обновление: {last_update_str}\n"
+        reply += f"├ 💹 Покупка: {pred_buy:>8.3f} (было: {was_buy_adj:.3f})\n"
+        reply += f"│   Диапазон за неделю: {buy_range[0]:.3f} — {buy_range[1]:.3f}\n"
+        reply += f"├ 💰 Продажа: {pred_sell:>8.3f} (было: {was_sell_adj:.3f})\n"
+        reply += f"│   Диапазон за неделю: {sell_range[0]:.3f} — {sell_range[1]:.3f}\n"
+        reply += f"├ 📦 Макс. объём: {max_qty:,} шт.\n"
+        reply += f"└ 📊 Тренд: {trend_emoji} {'растёт' if trend=='up' else 'падает' if trend=='down' else 'стабилен'} ({speed_str})\n\n"
+
+    reply += "──────────────────────\n📈 — рост | 📉 — падение | ➖ — стабильно\nЦены скорректированы с учетом бонусов игрока."
+    bot.reply_to(message, reply)
+
+# Длинные периоды /history: из часовых свечей, прореженных LTTB до HISTORY_POINTS точек
+HISTORY_RANGES = {"7d": 7 * 24 * 3600, "30d": 30 * 24 * 3600, "all": None}
+HISTORY_POINTS = 60
+
+def cmd_history(bot, message):
+    parts = message.text.split()
+    resource = parts[1].capitalize() if len(parts) > 1 else None
+    period = parts[2].lower() if len(parts) > 2 else "24h"
+    if not resource or resource not in market.resource_names() or (period != "24h" and period not in HISTORY_RANGES):
+        bot.reply_to(message, "Укажите ресурс и период: /history Дерево [24h|7d|30d|all]")
+        return
+    bonus = users.get_user_bonus(message.from_user.id)
+    if period != "24h":
+        _history_rollup(bot, message, resource, period, bonus)
+        return
+    records = database.get_market_history(resource, hours=24)
+    if not records:
+        bot.reply_to(message, f"Нет истории для {resource}.")
+        return
+    trend = market.get_trend(records, "buy")
+    speed = alerts.calculate_speed(records, "buy")
+    trend_str = f"Тренд: {'падает 📉' if trend=='down' else 'растёт 📈' if trend=='up' else 'стабилен ➖'} ({speed:+.4f}/мин)" if speed else "Тренд: стабилен ➖"
+    # График вместо простыни из сотен строк; текстом — только если matplotlib не установлен
+    if charts.available():
+        try:
+            if charts.send_chart(bot, message, resource, "24h", bonus, caption=f"📊 {resource} за 24 часа\n{trend_str}"):
+                return
+        except Exception:
+            logger.exception("Не удалось отправить график /history")
+    reply = f"BS Market Analytics:\n📊 История цен на {resource} за последние 24 часов:\n\n"
+    grouped = {}
+    for r in records:
+        dt = datetime.fromtimestamp(r['timestamp'])
+        hour = dt.hour
+        if hour not in grouped:
+            grouped[hour] = []
+        grouped[hour].append(r)
+    for hour in sorted(grouped, reverse=True):
+        reply += f"🕐 {hour:02d}:00:\n"
+        for rec in sorted(grouped[hour], key=lambda x: x['timestamp']):
+            time_str = datetime.fromtimestamp(rec['timestamp']).strftime("%H:%M")
+            buy_adj, sell_adj = users.adjust_prices_with_bonus(bonus, rec['buy'], rec['sell'])
+            reply += f"  {time_str} - Купить: {buy_adj:.2f}, Продать: {sell_adj:.2f}\n"
+        reply += "\n"
+    reply += trend_str
+    bot.reply_to(message, reply)
+
+def _history_rollup(bot, message, resource, period, bonus):
+    span = HISTORY_RANGES[period]
+    since = int(time.time()) - span if span else 0
+    candles = database.get_market_candles(resource, since)
+    if not candles:
+        bot.reply_to(message, f"Нет истории для {resource}.")
+        return
+    points = [candles[i] for i in downsample.lttb([c['bucket'] for c in candles], [c['close'] for c in candles], HISTORY_POINTS)]
+    low = min(c['low'] for c in candles)
+    high = max(c['high'] for c in candles)
+    low_adj, _ = users.adjust_prices_with_bonus(bonus, low, 0)
+    high_adj, _ = users.adjust_prices_with_bonus(bonus, high, 0)
+    first_adj, _ = users.adjust_prices_with_bonus(bonus, candles[0]['open'], 0)
+    last_adj, _ = users.adjust_prices_with_bonus(bonus, candles[-1]['close'], 0)
+    change = (last_adj - first_adj) / first_adj * 100 if first_adj else 0.0
+    title = "всё время" if span is None else f"{span // 86400} дн."
+    reply = f"BS Market Analytics:\n📊 История цен на {resource} за {title} ({len(points)} из {len(candles)} часовых точек):\n\n"
+    day = None
+    for c in points:
+        dt = datetime.fromtimestamp(c['bucket'])
+        if dt.date() != day:
+            day = dt.date()
+            reply += f"📅 {dt.strftime('%d.%m.%Y')}:\n"
+        buy_adj, sell_adj = users.adjust_prices_with_bonus(bonus, c['close'], c['sell'])
+        reply += f"  {dt.strftime('%H:%M')} - Купить: {buy_adj:.2f}, Продать: {sell_adj:.2f}\n"
+    reply += f"\nДиапазон покупки: {low_adj:.2f} — {high_adj:.2f}, изменение: {change:+.1f}%"
+    bot.reply_to(message, reply)
+
+def cmd_chart(bot, message):
+    parts = message.text.split()
+    resource = parts[1].capitalize() if len(parts) > 1 else None
+    range_name = parts[2].lower() if len(parts) > 2 else "24h"
+    if not resource or resource not in market.resource_names() or range_name not in charts.RANGES:
+        bot.reply_to(message, f"Использование: /chart <ресурс> [{'|'.join(charts.RANGES)}]\nПример: /chart Дерево 7d")
+        return
+    if not charts.available():
+        bot.reply_to(message, "Графики недоступны на этом сервере. Используйте /history.")
+        return
+    bonus = users.get_user_bonus(message.from_user.id)
+    if not charts.send_chart(bot, message, resource, range_name, bonus):
+        bot.reply_to(message, f"Нет истории для {resource}.")
+
+def cmd_status(bot, message):
+    alerts.cmd_status_handler(bot, message)
+
+def cmd_cancel(bot, message):
+    alerts.cmd_cancel_handler(bot, message)
+
+def cmd_settings(bot, message):
+    user_id = message.from_user.id
+    user = database.get_user(user_id)
+    anchor = bool(user.get('anchor', 0))
+    trade_level = user.get('trade_level', 0)
+    bonus = (0.02 if anchor else 0) + (0.02 * trade_level)
+    users.set_user_bonus(user_id, bonus)
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Якорь: " + ("Вкл" if anchor else "Выкл"), callback_data="settings_anchor"))
+    markup.add(types.InlineKeyboardButton(f"Уровень торговли: {trade_level}", callback_data="settings_trade"))
+    reply = f"⚙️ Настройки:\nЯкорь: {'Да (+2%)' if anchor else 'Нет'}\nУровень торговли: {trade_level} (+{trade_level*2}%)\nБонус: {bonus*100:.0f}%"
+    bot.reply_to(message, reply, reply_markup=markup)
+
+def callback_settings(bot, call):
+    user_id = call.from_user.id
+    if call.data == "settings_anchor":
+        current = database.get_user(user_id).get('anchor', 0)
+        new = 1 - current
+        database.update_user_field(user_id, 'anchor', new)
+        bonus = users.get_user_bonus(user_id)
+        bot.answer_callback_query(call.id, f"Якорь {'включен' if new else 'выключен'} ({bonus*100:.0f}%)")
+    elif call.data == "settings_trade":
+        bot.answer_callback_query(call.id, "Отправьте новый уровень торговли (число)")
+        bot.register_next_step_handler(call.message, lambda m: set_trade_level(bot, m))
+
+def set_trade_level(bot, message):
+    try:
+        level = int(message.text)
+        database.update_user_field(message.from_user.id, 'trade_level', level)
+        bonus = users.get_user_bonus(message.from_user.id)
+        bot.reply_to(message, f"Уровень торговли: {level} ({bonus*100:.0f}%)")
+    except ValueError:
+        bot.reply_to(message, "Неверное число.")
+
+def cmd_push(bot, message):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    is_group = message.chat.type in ['group', 'supergroup']
+    settings = database.get_user_push_settings(user_id) if not is_group else chats.get_settings(chat_id)
+    markup = types.InlineKeyboardMarkup()
+    enabled_text = "Включить" if not settings.get('notify_enabled', True) else "Отключить"
+    markup.add(types.InlineKeyboardButton(f"{enabled_text} уведомления", callback_data="push_toggle"))
+    markup.add(types.InlineKeyboardButton(f"Интервал: {settings.get('notify_interval', 15)} мин", callback_data="push_interval"))
+    if is_group:
+        markup.add(types.InlineKeyboardButton("Открепить все", callback_data="push_unpin"))
+        markup.add(types.InlineKeyboardButton("Не закреплять в чате", callback_data="push_no_pin"))
+    bot.reply_to(message, "⚡ Настройки уведомлений:", reply_markup=markup)
+
+def callback_push(bot, call):
+    user_id = call.from_user.id
+    chat_id = call.message.chat.id
+    is_group = call.message.chat.type in ['group', 'supergroup']
+    if call.data == "push_toggle":
+        if is_group:
+            new_status = not chats.get_settings(chat_id)['notify_enabled']
+            chats.set_notify_enabled(chat_id, new_status)
+        else:
+            new_status = not database.get_user_push_settings(user_id)['enabled']
+            database.update_user_push_settings(user_id, enabled=new_status)
+        bot.answer_callback_query(call.id, f"Уведомления {'включены' if new_status else 'отключены'}")
+    elif call.data == "push_interval":
+        bot.answer_callback_query(call.id, "Отправьте число минут")
+        if is_group:
+            bot.register_next_step_handler(call.message, lambda m: set_chat_interval(bot, m, chat_id))
+        else:
+            bot.register_next_step_handler(call.message, lambda m: set_user_interval(bot, m, user_id))
+    elif call.data == "push_unpin":
+        database.unpin_all_messages(chat_id)
+        bot.answer_callback_query(call.id, "Все закрепленные сообщения откреплены")
+    elif call.data == "push_no_pin":
+        chats.set_no_pin(chat_id, True)
+        bot.answer_callback_query(call.id, "Закрепление отключено")
+
+def set_user_interval(bot, message, user_id):
+    try:
+        minutes = int(message.text)
+        database.update_user_push_settings(user_id, interval=minutes)
+        bot.reply_to(message, f"Интервал: {minutes} мин")
+    except ValueError:
+        bot.reply_to(message, "Неверный формат")
+
+def set_chat_interval(bot, message, chat_id):
+    try:
+        minutes = int(message.text)
+        chats.set_interval(chat_id, minutes)
+        bot.reply_to(message, f"Интервал: {minutes} мин")
+    except ValueError:
+        bot.reply_to(message, "Неверный формат")
+
+def cmd_timer(bot, message):
+    alerts.cmd_timer_handler(bot, message)
+
+def handle_forward(bot, message):
+    if "🎪" in message.text:
+        ingest.handle_market_forward(bot, message)
+
+def inline_prices(bot, query):
+    # Без обращений к БД: цены из снимка prices, бонус из карты users
+    bonus = users.cached_bonus(query.from_user.id)
+    results = prices.inline_results(query.query or "", bonus) if prices.ready() else []
+    # Ответ зависит от бонуса, поэтому кэш Telegram — персональный
+    bot.answer_inline_query(query.id, results, cache_time=prices.INLINE_CACHE_TIME if results else 5,
+                            is_personal=True)
+
+def cmd_buyalert(bot, message):
+    if message.chat.type not in ['group', 'supergroup']:
+        bot.reply_to(message, "Эта команда работает только в групповых чатах.")
+        return
+
+    parts = message.text.split()[1:]
+    if len(parts) != 3:
+        bot.reply_to(message, "Использование: /buyalert <ресурс> <макс_цена> <мин_количество>\nПример: /buyalert Дерево 8.5 50000")
+        return
+
+    resource = parts[0].capitalize()
+    try:
+        threshold = float(parts[1])
+        min_qty = int(parts[2])
+    except ValueError:
+        bot.reply_to(message, "❌ Неверный формат. Цена — число, количество — целое число.")
+        return
+
+    if threshold <= 0 or min_qty <= 0:
+        bot.reply_to(message, "❌ Цена и количество должны быть положительными.")
+        return
+
+    chat_id = message.chat.id
+    conn = database.get_connection()
+    c = conn.cursor()
+
+    # Сначала попробуем обновить
+    c.execute("""
+        UPDATE chat_profit_alerts
+        SET threshold_price = ?, min_quantity = ?, active = 1
+        WHERE chat_id = ? AND resource = ?
+    """, (threshold, min_qty, chat_id, resource))
+
+    # Если обновлено 0 строк — значит, записи не было, вставляем новую
+    if c.rowcount == 0:
+        c.execute("""
+            INSERT INTO chat_profit_alerts (chat_id, resource, threshold_price, min_quantity, active)
+            VALUES (?, ?, ?, ?, 1)
+        """, (chat_id, resource, threshold, min_qty))
+
+    conn.commit()
+    conn.close()
+
+    bot.reply_to(message, f"✅ Алерт установлен: @{message.from_user.username} хочет купить {resource} по цене ≤ {threshold} при наличии ≥ {min_qty} шт.")
+
+
+# (тип, обработчик, фильтры). Порядок важен: срабатывает первый подходящий обработчик,
+# поэтому перехват всего текста (handle_forward) регистрируется последним.
+HANDLERS = [
+    ("message", cmd_start, {"commands": ["start"]}),
+    ("message", cmd_help, {"commands": ["help"]}),
+    ("message", cmd_stat, {"commands": ["stat"]}),
+    ("message", cmd_history, {"commands": ["history"]}),
+    ("message", cmd_chart, {"commands": ["chart"]}),
+    ("message", cmd_status, {"commands": ["status"]}),
+    ("message", cmd_cancel, {"commands": ["cancel"]}),
+    ("message", cmd_settings, {"commands": ["settings"]}),
+    ("callback", callback_settings, {"func": lambda call: call.data.startswith("settings_")}),
+    ("message", cmd_push, {"commands": ["push"]}),
+    ("callback", callback_push, {"func": lambda call: call.data.startswith("push")}),
+    ("message", cmd_timer, {"commands": ["timer"]}),
+    ("message", cmd_buyalert, {"commands": ["buyalert"]}),
+    ("message", handle_forward, {"func": lambda m: True, "content_types": ["text"]}),
+    ("inline", inline_prices, {"func": lambda q: True}),
+]
+
+
+def _traced(fn):
+    @functools.wraps(fn)
+    def wrapper(bot, update):
+        with querytrace.request(fn.__name__):
+            return fn(bot, update)
+    return wrapper
+
+
+def _bind(bot, fn):
+    @functools.wraps(fn)
+    def callback(update):
+        return fn(bot, update)
+    return callback
+
+
+def register_handlers(bot, make_callback=None) -> None:
+    """
+    Регистрирует обработчики на bot (TeleBot или AsyncTeleBot).
+    make_callback(fn) превращает обработчик вида fn(bot, update) в callback для библиотеки;
+    по умолчанию просто подставляет bot первым аргументом.
+    """
+    make_callback = make_callback or (lambda fn: _bind(bot, fn))
+    for kind, fn, filters in HANDLERS:
+        fn = metrics.instrumented(HANDLER_CALLS, HANDLER_DURATION, handler=fn.__name__)(ratelimit.guard(_traced(fn)))
+        callback = make_callback(fn)
+        if kind == "message":
+            bot.register_message_handler(callback, **filters)
+        elif kind == "inline":
+            bot.register_inline_handler(callback, **filters)
+        else:
+            bot.register_callback_query_handler(callback, **filters)
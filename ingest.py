@@ -0,0 +1,275 @@
+# ingest.py
+# Приём форвардов рынка. Обработчик только проверяет сообщение и ставит его в очередь;
+# поток ingest собирает форварды, пришедшие за WINDOW секунд, разбирает их (бонусы отправителей —
+# одним запросом), отсеивает повторы одного рынка (по времени исходного сообщения и объёмам —
+# в пакете и среди недавно сохранённых) и пишет всё одной транзакцией.
+# После коммита отправляются ответы (через dispatcher) и вызываются хуки on_commit:
+# обновление снимка цен, внеочередная проверка алертов.
+# Без запущенного конвейера (бенчмарки, async-режим, остановка) форвард обрабатывается сразу
+# тем же кодом как пакет из одного элемента.
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database
+import dispatcher
+import market
+import metrics
+import users
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 0.2             # секунд на сбор пакета после первого форварда
+MAX_BATCH = 200
+MAX_QUEUE = 1000
+MAX_AGE = 3600           # форварды старше часа не принимаются
+RECENT_MAX = 5000        # запомненных рынков для отсева повторов
+
+FORWARDS = metrics.counter("bsp_ingest_forwards_total", "Форварды рынка по результату", ["result"])
+BATCH_SIZE = metrics.histogram("bsp_ingest_batch_size", "Форвардов в одном коммите",
+                               buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+QUEUE_WAIT = metrics.histogram("bsp_ingest_queue_seconds", "Ожидание форварда в очереди до коммита")
+COMMIT_DURATION = metrics.histogram("bsp_ingest_commit_seconds", "Разбор и коммит пакета форвардов")
+
+_hooks: List[Callable[[], None]] = []
+_pipeline: Optional["IngestPipeline"] = None
+_STOP = object()
+_recent: "OrderedDict[Tuple, float]" = OrderedDict()   # ключ рынка -> время коммита
+_recent_lock = threading.Lock()
+
+
+class Forward:
+    """
+    Форвард рынка в очереди: текст, отправитель, время форварда (timestamp тиков),
+    время исходного сообщения рынка (origin) и callback для ответа.
+    """
+
+    __slots__ = ("text", "sender_id", "sender_name", "timestamp", "origin", "reply", "enqueued_at")
+
+    def __init__(self, text: str, sender_id: Optional[int], sender_name: str, timestamp: int,
+                 reply: Callable[[str], None], origin: Optional[int] = None):
+        self.text = text
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.timestamp = timestamp
+        self.origin = origin if origin is not None else timestamp
+        self.reply = reply
+        self.enqueued_at = time.monotonic()
+
+
+def on_commit(fn: Callable[[], None]) -> None:
+    """Хук после каждого успешного коммита тиков рынка (в потоке ingest)."""
+    _hooks.append(fn)
+
+
+def _market_key(forward: Forward, parsed: Dict) -> Tuple:
+    # Цены в форварде пересчитаны по бонусу отправителя и могут расходиться в последних знаках;
+    # время исходного сообщения и объёмы у всех, кто переслал один рынок, совпадают
+    return forward.origin, tuple(sorted((res, int(vals.get("quantity", 0) or 0)) for res, vals in parsed.items()))
+
+
+def reset() -> None:
+    """Забывает недавно сохранённые рынки (БД подменена, например в бенчмарках)."""
+    with _recent_lock:
+        _recent.clear()
+
+
+def _seen_recently(key: Tuple) -> bool:
+    with _recent_lock:
+        return key in _recent
+
+
+def _remember(keys) -> None:
+    now = time.time()
+    with _recent_lock:
+        for key in keys:
+            _recent[key] = now
+            _recent.move_to_end(key)
+        # Форварды старше MAX_AGE не принимаются, помнить их рынки дольше не нужно
+        while _recent and (len(_recent) > RECENT_MAX or now - next(iter(_recent.values())) > MAX_AGE):
+            _recent.popitem(last=False)
+
+
+def process(batch: List[Forward]) -> None:
+    """Разбирает пакет форвардов, пишет его одной транзакцией и отвечает отправителям."""
+    started = time.monotonic()
+    bonuses = users.get_users_bonus([f.sender_id for f in batch if f.sender_id is not None])
+    ticks: Dict[Tuple[str, int], Tuple[str, float, float, int, int]] = {}
+    history = []
+    outcomes = []
+    markets = set()
+    for forward in batch:
+        parsed = market.parse_market_message(forward.text, sender_id=forward.sender_id,
+                                             bonus=bonuses.get(forward.sender_id, 0.0))
+        if not parsed:
+            outcomes.append((forward, None))
+            continue
+        # Тот же рынок, пересланный несколькими участниками (в этом пакете или недавно), пишется один раз
+        key = _market_key(forward, parsed)
+        if key in markets or _seen_recently(key):
+            outcomes.append((forward, 0))
+            continue
+        markets.add(key)
+        for resource, vals in parsed.items():
+            # Как и в INSERT OR REPLACE, из разных тиков с одним временем остаётся последний
+            ticks[(resource, forward.timestamp)] = (
+                resource, float(vals.get("buy", 0.0)), float(vals.get("sell", 0.0)),
+                int(vals.get("quantity", 0) or 0), forward.timestamp)
+        history.append((int(time.time()), f"Получен форвард рынка: сохранено {len(parsed)} записей "
+                                          f"(отправитель: {forward.sender_name})"))
+        outcomes.append((forward, len(parsed)))
+    try:
+        if history:
+            database.commit_market_batch(list(ticks.values()), history)
+            _remember(markets)
+    except Exception:
+        logger.exception(f"Не удалось сохранить пакет из {len(batch)} форвардов рынка")
+        FORWARDS.inc(len(batch), result="error")
+        for forward in batch:
+            _reply(forward, "❌ Произошла внутренняя ошибка при обработке форварда.")
+        return
+    COMMIT_DURATION.observe(time.monotonic() - started)
+    BATCH_SIZE.observe(len(batch))
+    now = time.monotonic()
+    for forward, saved in outcomes:
+        QUEUE_WAIT.observe(now - forward.enqueued_at)
+        if saved is None:
+            FORWARDS.inc(result="unparsed")
+            _reply(forward, "❌ Не удалось распознать данные рынка. Проверьте формат сообщения.")
+        elif saved:
+            FORWARDS.inc(result="saved")
+            _reply(forward, f"✅ Сохранено {saved} записей рынка.")
+        else:
+            FORWARDS.inc(result="duplicate")
+            _reply(forward, "ℹ️ Этот рынок уже получен от другого участника.")
+    if history:
+        for hook in _hooks:
+            try:
+                hook()
+            except Exception:
+                logger.exception(f"Ошибка в хуке после коммита {getattr(hook, '__name__', hook)}")
+
+
+def _reply(forward: Forward, text: str) -> None:
+    try:
+        forward.reply(text)
+    except Exception:
+        logger.exception("Не удалось ответить на форвард рынка")
+
+
+class IngestPipeline:
+    """Очередь форвардов и поток, коммитящий их пакетами."""
+
+    def __init__(self, window: float = WINDOW, max_batch: int = MAX_BATCH, max_queue: int = MAX_QUEUE):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._accepting = False
+
+    def start(self) -> "IngestPipeline":
+        self._accepting = True
+        self._thread = threading.Thread(target=self._run, name="ingest", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Перестаёт принимать форварды, дорабатывает уже принятые и останавливает поток."""
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    def submit(self, forward: Forward) -> bool:
+        """False, если очередь переполнена или конвейер остановлен."""
+        with self._lock:
+            if not self._accepting:
+                return False
+            try:
+                self._queue.put_nowait(forward)
+            except queue.Full:
+                return False
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                process(batch)
+            except Exception:
+                logger.exception("Ошибка в потоке ingest")
+
+
+def install(window: float = WINDOW, max_batch: int = MAX_BATCH, max_queue: int = MAX_QUEUE) -> IngestPipeline:
+    """Запускает конвейер процесса: дальше handle_market_forward только ставит форварды в очередь."""
+    global _pipeline
+    _pipeline = IngestPipeline(window, max_batch, max_queue).start()
+    return _pipeline
+
+
+def handle_market_forward(bot, message) -> None:
+    """
+    Проверяет пересланное сообщение рынка и передаёт его конвейеру; ответ придёт после коммита.
+    Без конвейера (или при переполненной очереди) форвард обрабатывается сразу.
+    """
+    forward_from = getattr(message, "forward_from", None)
+    forward_sender_name = getattr(message, "forward_sender_name", None)
+    if forward_from and getattr(forward_from, "id", None):
+        sender_id = forward_from.id
+    elif forward_sender_name:
+        sender_id = None
+    else:
+        bot.reply_to(message, "❌ Сообщение должно быть пересылкой (forward) от бота рынка.")
+        return
+
+    now_ts = int(time.time())
+    msg_ts = int(getattr(message, "date", now_ts))
+    origin_ts = getattr(message, "forward_date", None)
+    origin_ts = int(origin_ts) if origin_ts else None
+    if now_ts - msg_ts > MAX_AGE:
+        bot.reply_to(message, "❌ Сообщение слишком старое (более 1 часа). Отправьте свежий форвард.")
+        return
+
+    sender_name = (forward_from.username if forward_from and getattr(forward_from, "username", None)
+                   else forward_sender_name or "unknown")
+    pipeline = _pipeline
+    if pipeline is not None and pipeline.running:
+        outbox = dispatcher.for_bot(bot)
+        chat_id, message_id = message.chat.id, message.message_id
+        forward = Forward(message.text or "", sender_id, sender_name, msg_ts,
+                          lambda text: outbox.send(chat_id, text, reply_to_message_id=message_id), origin_ts)
+        if pipeline.submit(forward):
+            return
+        FORWARDS.inc(result="overflow")
+        logger.warning("Очередь форвардов рынка переполнена, форвард обрабатывается в обработчике")
+    process([Forward(message.text or "", sender_id, sender_name, msg_ts, lambda text: bot.reply_to(message, text),
+                     origin_ts)])
@@ -0,0 +1,122 @@
+# leader.py
+# Выбор лидера между процессами бота: аренда (lease) в таблице leases общей SQLite-базы.
+# Лидер продлевает аренду каждые heartbeat секунд; если он упал или завис дольше ttl,
+# аренду забирает другой процесс. Фоновые задачи и таймеры выполняются только у лидера,
+# обработка апдейтов — во всех процессах.
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "background"
+TTL = 15.0
+HEARTBEAT = 5.0
+
+IS_LEADER = metrics.gauge("bsp_leader", "1, если процесс — лидер фоновых задач")
+TRANSITIONS = metrics.counter("bsp_leader_transitions_total", "Смены роли процесса", ["role"])
+
+
+def default_instance_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderElector:
+    """
+    Поток heartbeat: раз в heartbeat секунд пытается захватить или продлить аренду.
+    on_elected / on_demoted вызываются из этого потока при смене роли.
+    Роль снимается сама, если аренду не удалось продлить до её истечения (например, БД заблокирована),
+    чтобы два процесса не считали себя лидерами одновременно.
+    """
+
+    def __init__(self, instance_id: Optional[str] = None, name: str = LEASE_NAME,
+                 ttl: float = TTL, heartbeat: float = HEARTBEAT, clock=time.time):
+        if heartbeat >= ttl:
+            raise ValueError(f"heartbeat ({heartbeat}) должен быть меньше ttl ({ttl})")
+        self.instance_id = instance_id or default_instance_id()
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self._leader = False
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._on_elected: List[Callable[[], None]] = []
+        self._on_demoted: List[Callable[[], None]] = []
+        IS_LEADER.set(0)
+
+    def on_elected(self, fn: Callable[[], None]) -> None:
+        self._on_elected.append(fn)
+
+    def on_demoted(self, fn: Callable[[], None]) -> None:
+        self._on_demoted.append(fn)
+
+    def is_leader(self) -> bool:
+        with self._lock:
+            # Аренда могла истечь между heartbeat — не полагаемся на последний успешный ответ
+            return self._leader and self.clock() < self._expires_at
+
+    def start(self) -> "LeaderElector":
+        self._thread = threading.Thread(target=self._run, name="leader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Останавливает heartbeat и освобождает аренду, чтобы другой процесс перехватил её сразу."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.heartbeat + 1)
+            self._thread = None
+        if self.is_leader():
+            try:
+                database.release_lease(self.name, self.instance_id)
+            except Exception:
+                logger.exception("Не удалось освободить аренду лидера")
+        self._set_role(False, 0.0)
+
+    def tick(self) -> bool:
+        """Одна попытка захвата/продления аренды; возвращает текущую роль."""
+        now = self.clock()
+        try:
+            held = database.acquire_lease(self.name, self.instance_id, self.ttl, now)
+        except Exception:
+            logger.warning("Не удалось продлить аренду лидера", exc_info=True)
+            held = self.is_leader()
+            if held:
+                return True
+            self._set_role(False, 0.0)
+            return False
+        self._set_role(held, now + self.ttl if held else 0.0)
+        return held
+
+    def _set_role(self, leader: bool, expires_at: float) -> None:
+        with self._lock:
+            changed = leader != self._leader
+            self._leader = leader
+            self._expires_at = expires_at
+        if not changed:
+            return
+        IS_LEADER.set(1 if leader else 0)
+        TRANSITIONS.inc(role="leader" if leader else "follower")
+        if leader:
+            logger.info(f"Процесс {self.instance_id} стал лидером фоновых задач")
+        else:
+            logger.info(f"Процесс {self.instance_id} больше не лидер")
+        for fn in self._on_elected if leader else self._on_demoted:
+            try:
+                fn()
+            except Exception:
+                logger.exception(f"Ошибка в обработчике смены роли {getattr(fn, '__name__', fn)}")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.heartbeat)
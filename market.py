@@ -1,4 +1,5 @@
 # market.py
+import functools
 import re
 import logging
 import time
@@ -10,14 +11,45 @@ import users
 
 logger = logging.getLogger(__name__)
 
-EMOJI_TO_RESOURCE = {
-    "🪵": "Дерево",
-    "🪨": "Камень",
-    "🍞": "Провизия",
-    "🐴": "Лошади"
-}
+# Справочник ресурсов (таблица resources) кэшируется в процессе; ключ — путь к БД
+RESOURCES_TTL = 60.0
+_resources_cache: Dict[str, Tuple[float, List[Dict]]] = {}
 
-RESOURCE_EMOJI = {v: k for k, v in EMOJI_TO_RESOURCE.items()}
+
+def resources() -> List[Dict]:
+    """Ресурсы [{id, name, emoji}] по возрастанию id; без БД — начальный справочник."""
+    now = time.monotonic()
+    cached = _resources_cache.get(database.DB_PATH)
+    if cached and now - cached[0] < RESOURCES_TTL:
+        return cached[1]
+    try:
+        rows = database.get_resources()
+    except Exception:
+        logger.exception("Не удалось загрузить справочник ресурсов")
+        return [{"id": i, "name": name, "emoji": emoji} for i, (name, emoji) in enumerate(database.DEFAULT_RESOURCES, 1)]
+    _resources_cache[database.DB_PATH] = (now, rows)
+    return rows
+
+
+def resource_names() -> List[str]:
+    return [r['name'] for r in resources()]
+
+
+def resource_emoji() -> Dict[str, str]:
+    return {r['name']: r['emoji'] for r in resources() if r['emoji']}
+
+
+def emoji_to_resource() -> Dict[str, str]:
+    return {r['emoji']: r['name'] for r in resources() if r['emoji']}
+
+
+@functools.lru_cache(maxsize=8)
+def _patterns(emojis: Tuple[str, ...]):
+    # Эмодзи может состоять из нескольких символов, поэтому альтернация, а не класс символов
+    alt = "|".join(re.escape(e) for e in sorted(emojis, key=len, reverse=True)) or "(?!)"
+    resource_pattern = re.compile(rf"^(.+?):\s*([\d, ]+)\s*({alt})\s*$")
+    combined_pattern = re.compile(rf"^(.+?):\s*([\d, ]+)\s*({alt})\s+.*Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))")
+    return resource_pattern, combined_pattern
 
 
 def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float]]]:
@@ -30,12 +62,13 @@ def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float
         return None
 
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    emoji_map = emoji_to_resource()
     resources: Dict[str, Dict[str, float]] = {}
     current_resource = None
     current_quantity = 0
 
     # Паттерны
-    resource_pattern = re.compile(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s*$")
+    resource_pattern, combined_pattern = _patterns(tuple(sorted(emoji_map)))
     price_pattern = re.compile(r"(?:[📈📉]?\s*)?Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))")
     # Альтернативный паттерн, если формат "Купить: 8.31 Продать: 6.80"
     alt_price_pattern = re.compile(r"Купить[:\s]*([0-9]+(?:[.,][0-9]+))[,;\s]+Продать[:\s]*([0-9]+(?:[.,][0-9]+))")
@@ -57,7 +90,7 @@ def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float
                 qty = 0
             current_quantity = qty
             # Map emoji to standard resource name; fallback to parsed name
-            resource_name = EMOJI_TO_RESOURCE.get(emoji, name_part)
+            resource_name = emoji_map.get(emoji, name_part)
             current_resource = resource_name
             # ensure placeholder
             resources[current_resource] = {"buy": 0.0, "sell": 0.0, "quantity": current_quantity}
@@ -83,7 +116,7 @@ def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float
             continue
 
         # Иногда ресурс и цены могут быть в одной строк: "Дерево: 96 342 449 🪵 Купить/продать: 8.31/6.80💰"
-        combined_match = re.search(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s+.*Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))", line)
+        combined_match = combined_pattern.search(line)
         if combined_match:
             name_part = combined_match.group(1).strip()
             qty_str = combined_match.group(2).replace(' ', '').replace(',', '')
@@ -94,7 +127,7 @@ def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float
                 qty = int(qty_str) if qty_str.isdigit() else 0
             except Exception:
                 qty = 0
-            resource_name = EMOJI_TO_RESOURCE.get(emoji, name_part)
+            resource_name = emoji_map.get(emoji, name_part)
             try:
                 buy_price = float(buy_raw)
                 sell_price = float(sell_raw)
@@ -110,11 +143,13 @@ def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float
     return resources
 
 
-def parse_market_message(text: str, sender_id: Optional[int] = None) -> Optional[Dict[str, Dict[str, float]]]:
+def parse_market_message(text: str, sender_id: Optional[int] = None,
+                         bonus: Optional[float] = None) -> Optional[Dict[str, Dict[str, float]]]:
     """
     Парсит сообщение рынка. Если sender_id указан и у отправителя включены бонусы,
     преобразует присланные (скорее всего скорректированные) цены обратно в базовые
     (то есть нормализует к "без-бонусов"), чтобы база хранила единый эталон.
+    bonus — уже известный бонус отправителя (тогда БД не читается).
     Возвращает словарь: {resource: {"buy": base_buy, "sell": base_sell, "quantity": qty}, ...}
     """
     parsed = _parse_market_message_lines(text)
@@ -125,10 +160,11 @@ def parse_market_message(text: str, sender_id: Optional[int] = None) -> Optional
     if sender_id is None:
         return parsed
 
-    try:
-        bonus = users.get_user_bonus(sender_id)  # float, например 0.2 для 20%
-    except Exception:
-        bonus = 0.0
+    if bonus is None:
+        try:
+            bonus = users.get_user_bonus(sender_id)  # float, например 0.2 для 20%
+        except Exception:
+            bonus = 0.0
 
     normalized: Dict[str, Dict[str, float]] = {}
     for resource, vals in parsed.items():
@@ -154,73 +190,6 @@ def parse_market_message(text: str, sender_id: Optional[int] = None) -> Optional
     return normalized
 
 
-def handle_market_forward(bot, message) -> None:
-    """
-    Обрабатывает пересланное сообщение рынка: парсит, нормализует цены (учитывая бонус отправителя),
-    сохраняет в БД и уведомляет отправителя о результате.
-    """
-    try:
-        # Проверка, что это пересылка (forward)
-        sender_id = None
-        forward_from = getattr(message, "forward_from", None)
-        forward_sender_name = getattr(message, "forward_sender_name", None)
-        if forward_from and getattr(forward_from, "id", None):
-            sender_id = forward_from.id
-        elif forward_sender_name:
-            sender_id = None
-        else:
-            # Не пересылка — игнорируем
-            bot.reply_to(message, "❌ Сообщение должно быть пересылкой (forward) от бота рынка.")
-            return
-
-        # Проверка времени (не старше 1 часа)
-        now_ts = int(time.time())
-        msg_ts = int(getattr(message, "date", now_ts))
-        if now_ts - msg_ts > 3600:
-            bot.reply_to(message, "❌ Сообщение слишком старое (более 1 часа). Отправьте свежий форвард.")
-            return
-
-        parsed = parse_market_message(message.text or "", sender_id=sender_id)
-        if not parsed:
-            bot.reply_to(message, "❌ Не удалось распознать данные рынка. Проверьте формат сообщения.")
-            return
-
-        saved = 0
-        for resource, vals in parsed.items():
-            buy = float(vals.get("buy", 0.0))
-            sell = float(vals.get("sell", 0.0))
-            qty = int(vals.get("quantity", 0) or 0)
-            timestamp = int(msg_ts)
-            try:
-                database.insert_market_record(resource, buy, sell, qty, timestamp)
-                saved += 1
-            except Exception as e:
-                logger.exception(f"Ошибка сохранения записи рынка для {resource}: {e}")
-
-        # Запись в history
-        try:
-            conn = database.get_connection()
-            cur = conn.cursor()
-            summary = f"Получен форвард рынка: сохранено {saved} записей (отправитель: {forward_from.username if forward_from and getattr(forward_from, 'username', None) else forward_sender_name or 'unknown'})"
-            cur.execute("INSERT INTO history (timestamp, text) VALUES (?, ?)", (int(time.time()), summary))
-            conn.commit()
-            conn.close()
-        except Exception:
-            logger.debug("Не удалось записать историю форварда", exc_info=True)
-
-        if saved > 0:
-            bot.reply_to(message, f"✅ Сохранено {saved} записей рынка.")
-        else:
-            bot.reply_to(message, "ℹ️ Записей для сохранения не найдено.")
-
-    except Exception as e:
-        logger.exception("Ошибка в handle_market_forward")
-        try:
-            bot.reply_to(message, "❌ Произошла внутренняя ошибка при обработке форварда.")
-        except Exception:
-            pass
-
-
 def calculate_speed(records: List[dict], price_field: str = "buy") -> Optional[float]:
     if not records or len(records) < 2:
         return None
@@ -0,0 +1,162 @@
+# prices.py
+# Снимок последних цен в памяти процесса для inline-запросов (@bot Дерево): последний тик,
+# скорость и тренд каждого ресурса. Снимок перечитывается из БД двумя запросами раз в
+# REFRESH_INTERVAL секунд (и сразу после форварда рынка в этом процессе), inline-ответ БД не трогает.
+# Готовые наборы результатов кэшируются по бонусу пользователя до следующего обновления снимка.
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from telebot import types
+
+import database
+import market
+import metrics
+import scheduler
+import users
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 15.0
+LOOKBACK_MINUTES = 60    # окно скорости, как в market.compute_extrapolated_price
+INLINE_CACHE_TIME = 30
+RESULT_SETS_MAX = 64     # наборов результатов (по бонусу) на одну версию снимка
+
+REFRESHES = metrics.counter("bsp_price_snapshot_refreshes_total", "Обновления снимка цен", ["status"])
+RESULT_SETS = metrics.counter("bsp_inline_result_sets_total", "Наборы inline-результатов", ["cache"])
+
+_snapshot: Optional[Dict] = None     # {"version", "built_at", "resources": [...]}; заменяется целиком
+_results: Dict[Tuple[int, float], List] = {}
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_started = False
+
+
+def refresh() -> None:
+    """Перечитывает снимок из БД и сбрасывает готовые наборы результатов."""
+    global _snapshot
+    with _refresh_lock:
+        try:
+            latest = database.get_latest_market_all()
+            recent = database.get_recent_market_all(minutes=LOOKBACK_MINUTES)
+            users.load_bonuses()
+        except Exception:
+            REFRESHES.inc(status="error")
+            raise
+        emoji = market.resource_emoji()
+        entries = []
+        for row in latest:
+            records = recent.get(row['resource']) or [row]
+            entries.append({
+                "resource": row['resource'],
+                "resource_id": row['resource_id'],
+                "emoji": emoji.get(row['resource'], ""),
+                "timestamp": int(row['timestamp']),
+                "buy": float(row['buy']),
+                "sell": float(row['sell']),
+                "quantity": int(row['quantity'] or 0),
+                "speed_buy": market.calculate_speed(records, "buy"),
+                "speed_sell": market.calculate_speed(records, "sell"),
+                "trend": market.get_trend(records, "buy"),
+            })
+        with _lock:
+            version = (_snapshot["version"] + 1) if _snapshot else 1
+            _snapshot = {"version": version, "built_at": time.time(), "resources": entries}
+            _results.clear()
+        REFRESHES.inc(status="ok")
+
+
+def _safe_refresh() -> None:
+    try:
+        refresh()
+    except Exception:
+        logger.exception("Не удалось обновить снимок цен")
+
+
+def start(interval: float = REFRESH_INTERVAL, cache_time: int = INLINE_CACHE_TIME) -> None:
+    """Первое заполнение снимка и периодическое обновление в общем планировщике (в каждом процессе)."""
+    global _started, INLINE_CACHE_TIME
+    if _started:
+        return
+    _started = True
+    INLINE_CACHE_TIME = cache_time
+    _safe_refresh()
+    scheduler.shared().every(interval, _safe_refresh, first_delay=interval)
+    metrics.gauge("bsp_price_snapshot_age_seconds", "Возраст снимка цен").set_function(
+        lambda: time.time() - _snapshot["built_at"] if _snapshot else 0.0)
+
+
+def market_changed() -> None:
+    """Вызывается после сохранения форварда: снимок обновляется в фоне, не задерживая обработчик."""
+    if _started:
+        scheduler.shared().call_later(0, _safe_refresh)
+
+
+def ready() -> bool:
+    return _snapshot is not None and bool(_snapshot["resources"])
+
+
+def _extrapolate(entry: Dict, bonus: float, now: float) -> Tuple[float, float, Optional[float]]:
+    """Цены покупки/продажи на момент now и скорость покупки с учётом бонуса (как compute_extrapolated_price)."""
+    buy, sell = users.adjust_prices_with_bonus(bonus, entry['buy'], entry['sell'])
+    elapsed = max(0.0, (now - entry['timestamp']) / 60.0)
+    speed_buy = entry['speed_buy'] / (1 + bonus) if entry['speed_buy'] is not None else None
+    if speed_buy and elapsed > 0:
+        buy += speed_buy * elapsed
+    if entry['speed_sell'] is not None and elapsed > 0:
+        sell += entry['speed_sell'] * (1 + bonus) * elapsed
+    return round(buy, 6), round(sell, 6), speed_buy
+
+
+def _article(entry: Dict, bonus: float, now: float):
+    buy, sell, speed = _extrapolate(entry, bonus, now)
+    trend = entry['trend']
+    trend_emoji = "📈" if trend == "up" else "📉" if trend == "down" else "➖"
+    trend_word = "растёт" if trend == "up" else "падает" if trend == "down" else "стабилен"
+    speed_str = f"{speed:+.4f}/мин" if speed else "0"
+    updated = datetime.fromtimestamp(entry['timestamp']).strftime("%H:%M")
+    text = (
+        f"{entry['emoji']} {entry['resource']}\n"
+        f"├ 🕒 Последнее обновление: {updated}\n"
+        f"├ 💹 Покупка: {buy:.3f}\n"
+        f"├ 💰 Продажа: {sell:.3f}\n"
+        f"├ 📦 Объём: {entry['quantity']:,} шт.\n"
+        f"└ 📊 Тренд: {trend_emoji} {trend_word} ({speed_str})\n"
+        f"Бонус игрока: {bonus * 100:.0f}%"
+    )
+    return types.InlineQueryResultArticle(
+        id=str(entry['resource_id']),
+        title=f"{entry['emoji']} {entry['resource']}: {buy:.3f} / {sell:.3f}",
+        description=f"Покупка / продажа · {trend_emoji} {trend_word} ({speed_str}) · {updated}",
+        input_message_content=types.InputTextMessageContent(text),
+    )
+
+
+def result_set(bonus: float) -> List[Tuple[str, object]]:
+    """[(ресурс, InlineQueryResultArticle)] для бонуса по текущему снимку; строится один раз на версию снимка."""
+    snap = _snapshot
+    if snap is None:
+        return []
+    key = (snap["version"], round(bonus, 4))
+    with _lock:
+        cached = _results.get(key)
+    if cached is not None:
+        RESULT_SETS.inc(cache="hit")
+        return cached
+    now = time.time()
+    built = [(e['resource'], _article(e, bonus, now)) for e in snap["resources"]]
+    with _lock:
+        if len(_results) >= RESULT_SETS_MAX:
+            _results.clear()
+        _results[key] = built
+    RESULT_SETS.inc(cache="miss")
+    return built
+
+
+def inline_results(query: str, bonus: float) -> List:
+    """Результаты для текста inline-запроса: ресурсы, имя которых начинается с запроса (пусто — все)."""
+    needle = query.strip().lower()
+    return [article for resource, article in result_set(bonus)
+            if not needle or resource.lower().startswith(needle)]
@@ -0,0 +1,218 @@
+# querytrace.py
+# Опциональная трассировка SQL: время каждого запроса, форма параметров, вызывающая функция,
+# медленные запросы и число запросов на один «запрос пользователя» (обработчик или итерацию задачи).
+#
+#   querytrace.enable(slow_ms=50, max_queries=20, sample_rate=0.05)   # в продакшене
+#   with querytrace.assert_max_queries(5):                            # в тестах
+#       handlers.cmd_stat(bot, message)
+import contextlib
+import contextvars
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_MS = 100.0
+MAX_QUERIES = 25
+
+
+@dataclass
+class Query:
+    sql: str
+    params: Tuple[str, ...]     # типы параметров, без значений
+    rows: int                   # число наборов параметров (executemany)
+    duration: float
+    caller: str
+    error: Optional[str] = None
+
+
+@dataclass
+class Scope:
+    name: str
+    queries: List[Query] = field(default_factory=list)
+
+    @property
+    def total_time(self) -> float:
+        return sum(q.duration for q in self.queries)
+
+    def repeated(self, top: int = 3) -> List[Tuple[str, int]]:
+        """Самые частые запросы — кандидаты на N+1."""
+        return Counter(q.sql for q in self.queries).most_common(top)
+
+
+_scope: contextvars.ContextVar[Optional[Scope]] = contextvars.ContextVar("querytrace_scope", default=None)
+_lock = threading.Lock()
+_enabled = False
+_forced = 0
+_slow_ms = SLOW_MS
+_max_queries = MAX_QUERIES
+_sample_rate = 1.0
+_listeners: List[Callable[[Query], None]] = []
+
+
+def enable(slow_ms: float = SLOW_MS, max_queries: int = MAX_QUERIES, sample_rate: float = 1.0) -> None:
+    """Включает трассировку для доли sample_rate запросов пользователей."""
+    global _enabled, _slow_ms, _max_queries, _sample_rate
+    _slow_ms = slow_ms
+    _max_queries = max_queries
+    _sample_rate = sample_rate
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def add_listener(fn: Callable[[Query], None]) -> None:
+    """Вызывается для каждого трассированного запроса (например, для сбора статистики нагрузки)."""
+    _listeners.append(fn)
+
+
+def remove_listener(fn: Callable[[Query], None]) -> None:
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+
+def active() -> bool:
+    return _enabled or _forced > 0
+
+
+def _normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def _params_shape(params) -> Tuple[str, ...]:
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return tuple(f"{k}:{type(v).__name__}" for k, v in params.items())
+    return tuple(type(p).__name__ for p in params)
+
+
+def _caller() -> str:
+    # Первая функция вне этого модуля и sqlite3 — обычно функция из database.py
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get("__name__") in (__name__, "sqlite3", "metrics"):
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def _record(sql: str, params, rows: int, duration: float, error: Optional[str] = None) -> None:
+    scope = _scope.get()
+    if scope is None and not _enabled:
+        return
+    query = Query(_normalize(sql), _params_shape(params), rows, duration, _caller(), error)
+    if scope is not None:
+        scope.queries.append(query)
+    for listener in _listeners:
+        listener(query)
+    if duration * 1000 >= _slow_ms:
+        where = f" в {scope.name}" if scope else ""
+        logger.warning(f"Медленный запрос ({duration * 1000:.1f} мс, {query.caller}{where}): {query.sql} {query.params}")
+
+
+class TracingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            error = str(e)
+            raise
+        finally:
+            _record(sql, parameters, 1, time.perf_counter() - start, error)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq = list(seq_of_parameters)
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().executemany(sql, seq)
+        except sqlite3.Error as e:
+            error = str(e)
+            raise
+        finally:
+            _record(sql, seq[0] if seq else None, len(seq), time.perf_counter() - start, error)
+
+
+class TracingConnection(sqlite3.Connection):
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().commit()
+        except sqlite3.Error as e:
+            error = str(e)
+            raise
+        finally:
+            # COMMIT не запрос рамки (лимиты и порог N+1 считают только запросы) — его время получают только слушатели
+            if _listeners:
+                query = Query("COMMIT", (), 0, time.perf_counter() - start, _caller(), error)
+                for listener in _listeners:
+                    listener(query)
+
+
+def connection_factory():
+    """Класс соединения для sqlite3.connect(factory=...): трассирующий, если трассировка активна."""
+    return TracingConnection if active() else sqlite3.Connection
+
+
+@contextlib.contextmanager
+def request(name: str):
+    """
+    Рамка одного запроса пользователя (обработчик, итерация фоновой задачи).
+    При выходе предупреждает, если запросов к БД больше max_queries.
+    """
+    if not _enabled or _scope.get() is not None or random.random() >= _sample_rate:
+        yield None
+        return
+    scope = Scope(name)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        if len(scope.queries) > _max_queries:
+            logger.warning(
+                f"{name}: {len(scope.queries)} запросов к БД ({scope.total_time * 1000:.1f} мс), "
+                f"порог {_max_queries}; чаще всего: {scope.repeated()}"
+            )
+
+
+@contextlib.contextmanager
+def assert_max_queries(limit: int, name: str = "assert_max_queries"):
+    """Бросает AssertionError, если внутри блока выполнено больше limit запросов."""
+    global _forced
+    with _lock:
+        _forced += 1
+    scope = Scope(name)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        with _lock:
+            _forced -= 1
+    if len(scope.queries) > limit:
+        listing = "\n".join(f"  {q.caller}: {q.sql}" for q in scope.queries)
+        raise AssertionError(f"Ожидалось не больше {limit} запросов, выполнено {len(scope.queries)}:\n{listing}")
@@ -0,0 +1,215 @@
+# ratelimit.py
+# Допуск дорогих команд по token bucket: у каждого пользователя и каждого группового чата своё
+# ведро токенов, команда списывает COSTS[обработчик] сразу из обоих вёдер. Запрос сверх бюджета
+# получает последний ответ на ту же команду из кэша (для команд только на чтение), иначе —
+# короткий отказ, который сам выдаётся не чаще NOTICE_INTERVAL секунд на пользователя.
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Стоимость в токенах по имени обработчика; обработчики не из списка не ограничиваются
+COSTS = {
+    "cmd_stat": 6,
+    "cmd_history": 3,
+    "cmd_chart": 3,
+    "cmd_status": 1,
+    "cmd_cancel": 1,
+    "cmd_settings": 1,
+    "cmd_push": 1,
+    "cmd_timer": 2,
+    "cmd_buyalert": 2,
+    "handle_forward": 3,     # только форварды рынка, остальной текст бесплатен
+}
+# Команды только на чтение: при превышении бюджета можно повторить недавний ответ
+CACHEABLE = {"cmd_stat", "cmd_history", "cmd_chart"}
+
+USER_BURST = 12.0
+USER_RATE = 0.25         # токенов в секунду
+CHAT_BURST = 30.0
+CHAT_RATE = 0.5
+RESPONSE_TTL = 60.0
+RESPONSE_MAX = 5000
+BUCKETS_MAX = 50000
+NOTICE_INTERVAL = 30.0
+
+THROTTLED = metrics.counter("bsp_throttled_total", "Запросы сверх бюджета", ["handler", "scope", "outcome"])
+ADMITTED = metrics.counter("bsp_admitted_total", "Запросы, прошедшие контроль допуска", ["handler"])
+
+_enabled = True
+_clock = time.monotonic
+_lock = threading.Lock()
+_buckets: Dict[Tuple[str, int], List[float]] = {}           # (scope, id) -> [токены, обновлено в]
+_responses: "OrderedDict[Tuple, Tuple[float, List]]" = OrderedDict()
+_notices: Dict[int, float] = {}
+
+
+def configure(enabled: bool = True, user_burst: float = USER_BURST, user_rate: float = USER_RATE,
+              chat_burst: float = CHAT_BURST, chat_rate: float = CHAT_RATE) -> None:
+    global _enabled, USER_BURST, USER_RATE, CHAT_BURST, CHAT_RATE
+    _enabled = enabled
+    USER_BURST, USER_RATE, CHAT_BURST, CHAT_RATE = user_burst, user_rate, chat_burst, chat_rate
+    reset()
+
+
+def reset() -> None:
+    with _lock:
+        _buckets.clear()
+        _responses.clear()
+        _notices.clear()
+
+
+def cost(name: str, message) -> int:
+    if name == "handle_forward" and "🎪" not in (message.text or ""):
+        return 0
+    return COSTS.get(name, 0)
+
+
+def _level(key: Tuple[str, int], burst: float, rate: float, now: float) -> List[float]:
+    bucket = _buckets.get(key)
+    if bucket is None:
+        if len(_buckets) >= BUCKETS_MAX:
+            _prune(now)
+        bucket = _buckets[key] = [burst, now]
+    else:
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    return bucket
+
+
+def _prune(now: float) -> None:
+    # Полные вёдра ничем не отличаются от новых — их можно забыть
+    for key, (tokens, updated) in list(_buckets.items()):
+        burst, rate = (USER_BURST, USER_RATE) if key[0] == "user" else (CHAT_BURST, CHAT_RATE)
+        if tokens + (now - updated) * rate >= burst:
+            del _buckets[key]
+
+
+def try_acquire(user_id: int, chat_id: Optional[int], amount: float) -> Tuple[bool, Optional[str], float]:
+    """
+    Списывает amount токенов из ведра пользователя и (для групп) чата, только если хватает в обоих.
+    Возвращает (допущен, исчерпанное ведро "user"/"chat", секунд до пополнения).
+    """
+    now = _clock()
+    with _lock:
+        scopes = [("user", user_id, USER_BURST, USER_RATE)]
+        if chat_id is not None and chat_id != user_id:
+            scopes.append(("chat", chat_id, CHAT_BURST, CHAT_RATE))
+        buckets = [(scope, _level((scope, key), burst, rate, now), rate) for scope, key, burst, rate in scopes]
+        for scope, bucket, rate in buckets:
+            if bucket[0] < amount:
+                return False, scope, (amount - bucket[0]) / rate if rate > 0 else float("inf")
+        for _, bucket, _ in buckets:
+            bucket[0] -= amount
+    return True, None, 0.0
+
+
+class _RecordingBot:
+    """Прокси бота, запоминающий текстовые ответы и отправленные фото, чтобы повторить их из кэша."""
+
+    def __init__(self, bot):
+        self._bot = bot
+        self.replies: List[Tuple[str, object, dict]] = []
+
+    def __getattr__(self, name: str):
+        return getattr(self._bot, name)
+
+    def reply_to(self, message, text, **kwargs):
+        self.replies.append(("text", text, kwargs))
+        return self._bot.reply_to(message, text, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        sent = self._bot.send_photo(chat_id, photo, **kwargs)
+        file_id = photo if isinstance(photo, str) else (getattr(sent, "photo", None) or [None])[-1]
+        file_id = getattr(file_id, "file_id", file_id)
+        if file_id:
+            kwargs = {k: v for k, v in kwargs.items() if k != "reply_to_message_id"}
+            self.replies.append(("photo", file_id, kwargs))
+        return sent
+
+
+def _response_key(name: str, message) -> Tuple:
+    return (name, message.from_user.id, message.chat.id, " ".join((message.text or "").lower().split()))
+
+
+def _remember(key: Tuple, replies: List) -> None:
+    with _lock:
+        _responses[key] = (_clock(), replies)
+        _responses.move_to_end(key)
+        while len(_responses) > RESPONSE_MAX:
+            _responses.popitem(last=False)
+
+
+def _cached(key: Tuple) -> Optional[List]:
+    with _lock:
+        entry = _responses.get(key)
+        if entry is None:
+            return None
+        if _clock() - entry[0] > RESPONSE_TTL:
+            del _responses[key]
+            return None
+        return entry[1]
+
+
+def _replay(bot, message, replies: List) -> None:
+    for kind, payload, kwargs in replies:
+        if kind == "text":
+            bot.reply_to(message, payload, **kwargs)
+        else:
+            bot.send_photo(message.chat.id, payload, reply_to_message_id=message.message_id, **kwargs)
+
+
+def _reject(bot, message, wait: float) -> bool:
+    """Короткий отказ; False, если пользователь уже получал отказ недавно (тогда запрос молча отбрасывается)."""
+    now = _clock()
+    user_id = message.from_user.id
+    with _lock:
+        if now - _notices.get(user_id, float("-inf")) < NOTICE_INTERVAL:
+            return False
+        _notices[user_id] = now
+        if len(_notices) > BUCKETS_MAX:
+            for uid in [u for u, ts in _notices.items() if now - ts >= NOTICE_INTERVAL]:
+                del _notices[uid]
+    bot.reply_to(message, f"⏳ Слишком много запросов. Повторите через {max(1, int(wait + 0.999))} с.")
+    return True
+
+
+def guard(fn):
+    """Обёртка обработчика fn(bot, message): контроль допуска, кэш ответов, отказ при превышении."""
+    name = fn.__name__
+    if name not in COSTS:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(bot, message):
+        amount = cost(name, message)
+        if not _enabled or amount <= 0:
+            return fn(bot, message)
+        chat_id = message.chat.id if message.chat.type != "private" else None
+        admitted, scope, wait = try_acquire(message.from_user.id, chat_id, amount)
+        key = _response_key(name, message) if name in CACHEABLE else None
+        if admitted:
+            ADMITTED.inc(handler=name)
+            if key is None:
+                return fn(bot, message)
+            recorder = _RecordingBot(bot)
+            result = fn(recorder, message)
+            if recorder.replies:
+                _remember(key, recorder.replies)
+            return result
+        cached = _cached(key) if key is not None else None
+        if cached:
+            THROTTLED.inc(handler=name, scope=scope, outcome="cached")
+            _replay(bot, message, cached)
+        elif _reject(bot, message, wait):
+            THROTTLED.inc(handler=name, scope=scope, outcome="rejected")
+        else:
+            THROTTLED.inc(handler=name, scope=scope, outcome="dropped")
+        return None
+    return wrapper
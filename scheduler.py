@@ -0,0 +1,100 @@
+# scheduler.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Общий планировщик: один поток, куча (время, задача).
+    Подходит для коротких задач — разовых (таймеры алертов) и периодических (очистка).
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self) -> "Scheduler":
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def call_at(self, ts: float, fn: Callable, *args) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (ts, next(self._seq), fn, args))
+            self._cond.notify()
+
+    def call_later(self, delay: float, fn: Callable, *args) -> None:
+        self.call_at(self.clock() + max(0.0, delay), fn, *args)
+
+    def every(self, interval: float, fn: Callable, *args, first_delay: float = 0.0) -> None:
+        """Периодический запуск fn с фиксированным шагом; пропущенные запуски не догоняются."""
+        def tick(planned):
+            try:
+                fn(*args)
+            finally:
+                next_ts = planned + interval
+                now = self.clock()
+                if next_ts < now:
+                    next_ts = now + interval
+                self.call_at(next_ts, tick, next_ts)
+
+        first = self.clock() + first_delay
+        self.call_at(first, tick, first)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - self.clock()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception(f"Ошибка в задаче планировщика {getattr(fn, '__name__', fn)}")
+
+
+_shared: Optional[Scheduler] = None
+_shared_lock = threading.Lock()
+
+
+def shared() -> Scheduler:
+    """Возвращает (и при первом обращении запускает) общий планировщик процесса."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Scheduler().start()
+        return _shared
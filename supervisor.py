@@ -0,0 +1,218 @@
+# supervisor.py
+import logging
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import metrics
+import querytrace
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+JOB_RUNS = metrics.counter("bsp_job_runs_total", "Запуски фоновых задач", ["job", "status"])
+JOB_DURATION = metrics.histogram("bsp_job_duration_seconds", "Длительность итерации фоновой задачи", ["job"],
+                                 buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300))
+JOB_OVERRUNS = metrics.counter("bsp_job_overruns_total", "Итерации дольше интервала задачи", ["job"])
+JOB_SKIPPED = metrics.counter("bsp_job_skipped_total", "Пропущенные запуски (предыдущий ещё идёт)", ["job"])
+
+
+class Job:
+    """Периодическая задача и её счётчики."""
+
+    def __init__(self, name: str, fn: Callable, interval: float, jitter: float = 0.0):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_started: Optional[float] = None
+        self.last_finished: Optional[float] = None
+
+    def record(self, started: float, finished: float, failed: bool) -> bool:
+        """Обновляет счётчики после запуска; возвращает True при перерасходе интервала."""
+        duration = finished - started
+        self.running = False
+        self.runs += 1
+        self.failures += failed
+        self.last_started = started
+        self.last_finished = finished
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        overrun = duration > self.interval
+        if overrun:
+            self.overruns += 1
+            JOB_OVERRUNS.inc(job=self.name)
+        JOB_RUNS.inc(job=self.name, status="error" if failed else "ok")
+        JOB_DURATION.observe(duration, job=self.name)
+        return overrun
+
+    def next_delay(self) -> float:
+        spread = self.interval * self.jitter
+        return max(0.0, self.interval + random.uniform(-spread, spread))
+
+    def stats(self, now: float) -> Dict:
+        return {
+            "interval": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "last_duration": self.last_duration,
+            "avg_duration": self.total_duration / self.runs if self.runs else 0.0,
+            "max_duration": self.max_duration,
+            "last_finished": self.last_finished,
+            # Задача считается отставшей, если не завершалась дольше двух интервалов
+            "behind": self.last_finished is not None and now - self.last_finished > 2 * self.interval,
+        }
+
+
+class Supervisor:
+    """
+    Владеет периодическими задачами: планирует их на общем планировщике с джиттером,
+    выполняет на пуле воркеров, считает длительность, ошибки и перерасход интервала,
+    корректно останавливается (в том числе по SIGTERM).
+    Если предыдущий запуск задачи ещё идёт, новый пропускается, а не ставится в очередь.
+    is_leader — при нескольких процессах: задачи запускаются, только пока он возвращает True.
+    """
+
+    def __init__(self, workers: int = 4, sched: Optional[scheduler.Scheduler] = None, clock=time.time,
+                 is_leader: Optional[Callable[[], bool]] = None):
+        self.clock = clock
+        self.is_leader = is_leader or (lambda: True)
+        self._sched = sched or scheduler.shared()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stopped = threading.Event()
+        self._shutdown_hooks: List[Callable] = []
+        self._final_hooks: List[Callable] = []
+
+    def add_job(self, name: str, fn: Callable, interval: float, jitter: float = 0.0,
+                first_delay: Optional[float] = None) -> Job:
+        job = Job(name, fn, interval, jitter)
+        with self._lock:
+            self._jobs[name] = job
+        delay = random.uniform(0, interval * jitter) if first_delay is None else first_delay
+        self._sched.call_later(delay, self._submit, job)
+        return job
+
+    def add_shutdown_hook(self, fn: Callable, first: bool = False, last: bool = False) -> None:
+        """
+        first=True — выполнить раньше уже добавленных (например, дослать очередь до остановки диспетчера);
+        last=True — после всех остальных, в том числе добавленных позже (сам диспетчер отправки).
+        """
+        if last:
+            self._final_hooks.append(fn)
+        elif first:
+            self._shutdown_hooks.insert(0, fn)
+        else:
+            self._shutdown_hooks.append(fn)
+
+    def trigger(self, name: str) -> bool:
+        """
+        Внеочередной запуск задачи (например, после новых данных рынка) без сдвига расписания.
+        False, если задача уже выполняется, процесс не лидер или задачи нет.
+        """
+        if self._stopping.is_set() or not self.is_leader():
+            return False
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None or job.running:
+                return False
+            job.running = True
+        try:
+            self._executor.submit(self._run, job)
+        except RuntimeError:
+            with self._lock:
+                job.running = False
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Dict]:
+        now = self.clock()
+        with self._lock:
+            return {name: job.stats(now) for name, job in self._jobs.items()}
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def stop(self) -> None:
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        logger.info("Остановка фоновых задач...")
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for hook in self._shutdown_hooks + self._final_hooks:
+            try:
+                hook()
+            except Exception:
+                logger.exception(f"Ошибка в shutdown hook {getattr(hook, '__name__', hook)}")
+        logger.info("Фоновые задачи остановлены.")
+        self._stopped.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Блокирует до полной остановки (stop() или сигнал)."""
+        return self._stopped.wait(timeout)
+
+    def install_signal_handlers(self) -> None:
+        """Останавливает задачи по SIGTERM/SIGINT. Вызывать из главного потока."""
+        def handler(signum, frame):
+            logger.info(f"Получен сигнал {signum}")
+            threading.Thread(target=self.stop, name="supervisor-stop", daemon=True).start()
+
+        signal.signal(signal.SIGTERM, handler)
+        signal.signal(signal.SIGINT, handler)
+
+    def _submit(self, job: Job) -> None:
+        if self._stopping.is_set():
+            return
+        if not self.is_leader():
+            self._sched.call_later(job.next_delay(), self._submit, job)
+            return
+        with self._lock:
+            busy = job.running
+            if busy:
+                job.skipped += 1
+                JOB_SKIPPED.inc(job=job.name)
+            else:
+                job.running = True
+        if busy:
+            logger.warning(f"Задача {job.name} не успела завершиться за интервал {job.interval:g} с, запуск пропущен")
+        else:
+            try:
+                self._executor.submit(self._run, job)
+            except RuntimeError:
+                # пул уже остановлен
+                return
+        self._sched.call_later(job.next_delay(), self._submit, job)
+
+    def _run(self, job: Job) -> None:
+        started = self.clock()
+        failed = False
+        try:
+            with querytrace.request(f"job:{job.name}"):
+                job.fn()
+        except Exception:
+            failed = True
+            logger.exception(f"Ошибка в фоновой задаче {job.name}")
+        finally:
+            finished = self.clock()
+            with self._lock:
+                overrun = job.record(started, finished, failed)
+            if overrun:
+                logger.warning(f"Задача {job.name} выполнялась {finished - started:.1f} с — дольше интервала {job.interval:g} с")
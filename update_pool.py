@@ -0,0 +1,133 @@
+# update_pool.py
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 8
+MAX_QUEUE = 1000
+SLOW_WAIT = 5.0     # секунд ожидания в очереди, после которых пишем предупреждение
+
+
+def chat_key(update) -> Optional[int]:
+    """Id чата, к которому относится апдейт (для inline-запросов — id пользователя)."""
+    for attr in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, attr, None)
+        if msg is not None:
+            return msg.chat.id
+    call = getattr(update, "callback_query", None)
+    if call is not None:
+        if call.message is not None:
+            return call.message.chat.id
+        return call.from_user.id
+    for attr in ("inline_query", "chosen_inline_result"):
+        obj = getattr(update, attr, None)
+        if obj is not None:
+            return obj.from_user.id
+    return None
+
+
+class ChatWorkerPool:
+    """
+    Пул обработчиков апдейтов: апдейт попадает к воркеру по хешу chat id,
+    поэтому сообщения одного чата обрабатываются строго по порядку,
+    а разные чаты — параллельно и не задерживают друг друга.
+    process — функция, принимающая список апдейтов (обычно исходный TeleBot.process_new_updates
+    у бота с threaded=False, чтобы обработчики выполнялись прямо в воркере).
+    """
+
+    def __init__(self, process: Callable[[List], None], workers: int = WORKERS,
+                 max_queue: int = MAX_QUEUE, clock=time.monotonic):
+        self.process = process
+        self.clock = clock
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._processed = [0] * workers
+        self._failed = [0] * workers
+        self._wait_total = [0.0] * workers
+        self._wait_max = [0.0] * workers
+        self._rr = 0
+
+    def start(self) -> "ChatWorkerPool":
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(i, q), name=f"updates-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout: float = 10.0) -> None:
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def submit(self, updates: List) -> None:
+        """Раскладывает апдейты по воркерам. Блокируется, если очередь воркера заполнена."""
+        now = self.clock()
+        for update in updates:
+            key = chat_key(update)
+            if key is None:
+                with self._lock:
+                    self._rr += 1
+                    idx = self._rr % len(self._queues)
+            else:
+                idx = hash(key) % len(self._queues)
+            self._queues[idx].put((now, update))
+
+    def join(self) -> None:
+        for q in self._queues:
+            q.join()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            processed = sum(self._processed)
+            return {
+                "workers": len(self._queues),
+                "queue_depth": sum(q.qsize() for q in self._queues),
+                "queue_depth_max": max(q.qsize() for q in self._queues),
+                "processed": processed,
+                "failed": sum(self._failed),
+                "avg_wait": sum(self._wait_total) / processed if processed else 0.0,
+                "max_wait": max(self._wait_max),
+            }
+
+    def _worker(self, idx: int, q: queue.Queue) -> None:
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                enqueued_at, update = item
+                wait = self.clock() - enqueued_at
+                if wait > SLOW_WAIT:
+                    logger.warning(f"Апдейт {getattr(update, 'update_id', '?')} ждал в очереди воркера {idx} {wait:.1f} с")
+                else:
+                    logger.debug(f"Апдейт {getattr(update, 'update_id', '?')} ждал в очереди воркера {idx} {wait:.3f} с")
+                failed = False
+                try:
+                    self.process([update])
+                except Exception:
+                    failed = True
+                    logger.exception(f"Ошибка при обработке апдейта {getattr(update, 'update_id', '?')}")
+                with self._lock:
+                    self._processed[idx] += 1
+                    self._failed[idx] += failed
+                    self._wait_total[idx] += wait
+                    self._wait_max[idx] = max(self._wait_max[idx], wait)
+            finally:
+                q.task_done()
+
+
+def install(bot, workers: int = WORKERS) -> ChatWorkerPool:
+    """
+    Подключает пул к TeleBot(threaded=False): polling и webhook передают апдейты
+    через bot.process_new_updates, который теперь только ставит их в очередь.
+    """
+    pool = ChatWorkerPool(bot.process_new_updates, workers=workers).start()
+    bot.process_new_updates = pool.submit
+    return pool
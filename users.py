@@ -1,12 +1,16 @@
 # users.py
 import sqlite3
 import logging
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 
 import database
 
 logger = logging.getLogger(__name__)
 
+# Ненулевые бонусы всех пользователей для путей без обращения к БД (inline-запросы).
+# Перезагружается снимком цен (prices.refresh), локальные изменения видны сразу.
+_bonuses: Dict[int, float] = {}
+
 
 def ensure_user(user_id: int, username: Optional[str] = None) -> None:
     """
@@ -25,6 +29,7 @@ def set_user_bonus(user_id: int, bonus: float) -> None:
     try:
         ensure_user(user_id)
         database.update_user_bonus(user_id, float(bonus))
+        _bonuses[user_id] = float(bonus)
     except Exception:
         logger.exception(f"Ошибка при set_user_bonus {user_id}")
 
@@ -42,6 +47,38 @@ def get_user_bonus(user_id: int) -> float:
         return 0.0
 
 
+def load_bonuses() -> None:
+    """Перечитывает из БД карту ненулевых бонусов для cached_bonus."""
+    global _bonuses
+    _bonuses = database.get_nonzero_bonuses()
+
+
+def cached_bonus(user_id: int) -> float:
+    """Бонус пользователя из карты в памяти, без обращения к БД (может отставать на период обновления)."""
+    return _bonuses.get(user_id, 0.0)
+
+
+def get_users_bonus(user_ids: list[int]) -> dict[int, float]:
+    """
+    Возвращает бонусы сразу для набора пользователей: {user_id: bonus}.
+    Отсутствующие в БД пользователи в словарь не попадают.
+    """
+    try:
+        return database.get_users_bonus(user_ids)
+    except Exception:
+        logger.exception("Ошибка при get_users_bonus")
+        return {}
+
+
+def adjust_prices_with_bonus(bonus: float, base_buy: float, base_sell: float) -> Tuple[float, float]:
+    """
+    Корректирует базовые цены по уже известному бонусу (без обращения к БД).
+    """
+    adj_buy = base_buy / (1 + bonus) if bonus else base_buy
+    adj_sell = base_sell * (1 + bonus) if bonus else base_sell
+    return float(round(adj_buy, 6)), float(round(adj_sell, 6))
+
+
 def adjust_prices_for_user(user_id: Optional[int], base_buy: float, base_sell: float) -> Tuple[float, float]:
     """
     Корректирует базовые цены для пользователя с учётом его бонуса.
@@ -49,9 +86,7 @@ def adjust_prices_for_user(user_id: Optional[int], base_buy: float, base_sell: f
     """
     try:
         bonus = get_user_bonus(user_id) if user_id is not None else 0.0
-        adj_buy = base_buy / (1 + bonus) if bonus else base_buy
-        adj_sell = base_sell * (1 + bonus) if bonus else base_sell
-        return float(round(adj_buy, 6)), float(round(adj_sell, 6))
+        return adjust_prices_with_bonus(bonus, base_buy, base_sell)
     except Exception:
         logger.exception(f"Ошибка при adjust_prices_for_user {user_id}")
         return base_buy, base_sell
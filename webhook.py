@@ -0,0 +1,112 @@
+# webhook.py
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY = 1024 * 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+
+    def log_message(self, fmt, *args):
+        logger.debug("webhook: " + fmt, *args)
+
+    def _reply(self, code: int, body: bytes = b"") -> None:
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._reply(200, b"ok")
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        srv = self.server
+        if self.path != srv.path:
+            self._reply(404)
+            return
+        # Байты, а не str: compare_digest не принимает строки с не-ASCII символами
+        if srv.secret_token and not hmac.compare_digest(self.headers.get(SECRET_HEADER, "").encode(),
+                                                        srv.secret_token.encode()):
+            srv.count(rejected=1)
+            self._reply(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length <= 0 or length > MAX_BODY:
+            self._reply(400 if length <= 0 else 413)
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+            # Telegram шлёт по одному апдейту; список принимаем для пачек и записанных потоков
+            raw = payload if isinstance(payload, list) else [payload]
+            updates = [types.Update.de_json(u) for u in raw]
+        except Exception:
+            logger.warning("webhook: не удалось разобрать тело запроса", exc_info=True)
+            self._reply(400)
+            return
+        try:
+            srv.submit(updates)
+        except Exception:
+            logger.exception("webhook: не удалось поставить апдейты в очередь")
+            self._reply(500)
+            return
+        srv.count(received=len(updates))
+        self._reply(200)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Локальный HTTP-сервер для webhook Telegram: проверяет секретный токен,
+    передаёт апдейты в submit (обычно пул обработчиков) и сразу отвечает 200.
+    port=0 — выбрать свободный порт (удобно в тестах), фактический адрес в server_address.
+    reuse_port — SO_REUSEPORT: несколько процессов слушают один порт, ядро распределяет соединения.
+    """
+    daemon_threads = True
+
+    def __init__(self, submit: Callable[[List], None], host: str = "127.0.0.1", port: int = 8080,
+                 path: str = "/telegram", secret_token: Optional[str] = None, reuse_port: bool = False):
+        self.allow_reuse_port = reuse_port
+        super().__init__((host, port), _Handler)
+        self.submit = submit
+        self.path = path
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self._counters_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        if not secret_token:
+            logger.warning("webhook: секретный токен не задан, запросы не проверяются")
+
+    def count(self, received: int = 0, rejected: int = 0) -> None:
+        """Счётчики обновляются из потоков запросов."""
+        with self._counters_lock:
+            self.received += received
+            self.rejected += rejected
+
+    def start(self) -> "WebhookServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None